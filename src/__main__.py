@@ -1,21 +1,114 @@
+import argparse
 import os
+import sys
 import time
-from posting_list import InvertedIndex, create_indices
+from contextlib import nullcontext
+from posting_list import DEFAULT_WEIGHTS, FieldWeights, InvertedIndex, create_indices
+from compressed_index import write_segment_postings
+from impact_index import open_impact_index, write_impact_index
 from query_processing import QueryProcessor
+from profiling import Profiler
+from query_cache import CACHE_NAME, QueryCache
 from importer import Importer
+from bulk_load import bulk_load_dir
+from batch import CACHE_BUDGET, batch
+from server import serve
+from segments import ingest_dir, merge_segments, open_index
+from shards import SHARDS_DIR, ShardedQueryProcessor, build_shards
+from snapshot import refresh_snapshot
 from db import *
 
-def parse_dir(directory: str) -> None:
-    """Takes a directory path and parses all Documents inside this path, writing the results to a file."""
-    docs = Importer.import_dir(directory)
+def parse_dir(directory: str, processes: int = None) -> None:
+    """Takes a directory path and parses all Documents inside this path, writing the results to the db.
+    The files are parsed by a pool of worker processes and streamed into the db, so not all Documents are kept in memory.
+    """
     with open_db() as connection:
-        insert_documents(connection, docs)
-        insert_tfs(connection, docs)
-        insert_boost(connection, docs)
+        insert_records(connection, Importer.stream_dir(directory, processes))
         compute_statistics(connection)
 
 
 if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(prog="zwo", description="A Search Engine for the New York Times Corpus 2000")
+    arguments.add_argument("--rebuild-boosts", action="store_true",
+                           help="recompute the static document boosts, e.g. after changing constants.py")
+    arguments.add_argument("--processes", type=int, default=None,
+                           help="number of worker processes, defaults to the number of cores for parsing the corpus "
+                                "and to 1 in batch and server mode")
+    arguments.add_argument("--bulk-load", action="store_true",
+                           help="build the db in bulk load mode, faster but not crash safe")
+    arguments.add_argument("--cache", action="store_true",
+                           help=f"remember query results across runs in {CACHE_NAME}")
+    arguments.add_argument("--batch", metavar="FILE",
+                           help="process every line of FILE as a query, - reads the queries from stdin")
+    arguments.add_argument("--output", metavar="FILE", help="write the batch results to FILE instead of stdout")
+    arguments.add_argument("--format", choices=("tsv", "json"), default="tsv", help="format of the batch results")
+    arguments.add_argument("-k", type=int, default=10, help="number of results per query in batch mode")
+    arguments.add_argument("--serve", action="store_true", help="answer search requests over http")
+    arguments.add_argument("--host", default="127.0.0.1", help="address the server listens on")
+    arguments.add_argument("--port", type=int, default=8080, help="port the server listens on")
+    arguments.add_argument("--threads", type=int, default=4, help="query processors per server process")
+    arguments.add_argument("--posting-cache", type=int, default=None, metavar="MB",
+                           help="keep the posting lists of frequent terms in a cache of this size in every server "
+                                f"or batch process, defaults to {CACHE_BUDGET // 1024 // 1024} in batch mode")
+    arguments.add_argument("--pin", type=int, default=0, metavar="TERMS",
+                           help="read the posting lists of this many terms with the highest dfs into the posting "
+                                "cache on startup and never evict them")
+    arguments.add_argument("--ingest", metavar="DIR",
+                           help="add the documents in DIR to the existing db as a new segment")
+    arguments.add_argument("--merge", action="store_true", help="merge all segments of the db into one")
+    arguments.add_argument("--profile", action="store_true",
+                           help="report the time spent in every stage of query processing, in batch mode summed up "
+                                "over all queries, in server mode under /stats")
+    arguments.add_argument("--impacts", action="store_true",
+                           help="answer queries with the impact ordered index, which is written if it is outdated")
+    arguments.add_argument("--budget", type=int, default=None,
+                           help="score at most this many postings per query with --impacts, faster but approximate")
+    arguments.add_argument("--and", dest="conjunctive", action="store_true",
+                           help="only return documents containing all terms of the query")
+    arguments.add_argument("--from", dest="date_from", type=int, default=None, metavar="YYYYMMDD",
+                           help="only return documents published on this day or later")
+    arguments.add_argument("--to", dest="date_to", type=int, default=None, metavar="YYYYMMDD",
+                           help="only return documents published on this day or earlier")
+    arguments.add_argument("--max-page", type=int, default=None,
+                           help="only return documents printed on this page or a page before")
+    arguments.add_argument("--weights", type=float, nargs=3, default=None, metavar=("CONTENT", "TITLE", "ABSTRACT"),
+                           help="weights of the tfs of the content, the title and the abstract, defaults to the ones "
+                                "in constants.py, in batch mode and for interactive searches")
+    arguments.add_argument("--shards", type=int, default=None,
+                           help=f"build the index as this many shards in {SHARDS_DIR}, which are searched in parallel")
+    args = arguments.parse_args()
+
+    if args.rebuild_boosts:
+        with open_db() as connection:
+            rebuild_static_boosts(connection)
+            refresh_snapshot(connection)
+        raise SystemExit
+
+    if args.ingest:
+        ingest_dir(args.ingest, args.processes)
+        raise SystemExit
+
+    if args.merge:
+        with open_db() as connection:
+            merge_segments(connection)
+        raise SystemExit
+
+    if args.serve:
+        serve(args.host, args.port, args.processes or 1, args.threads, args.profile,
+              args.posting_cache * 1024 * 1024 if args.posting_cache else None, args.pin)
+        raise SystemExit
+
+    weights = FieldWeights(*args.weights) if args.weights else DEFAULT_WEIGHTS
+    filters = dict(date_from=args.date_from, date_to=args.date_to, max_page=args.max_page)
+
+    if args.batch:
+        with (nullcontext(sys.stdin) if args.batch == "-" else open(args.batch)) as input_, \
+                (open(args.output, "w") if args.output else nullcontext(sys.stdout)) as output:
+            batch(input_, output, args.k, args.processes or 1, args.format, args.profile, weights,
+                  args.posting_cache * 1024 * 1024 if args.posting_cache else CACHE_BUDGET,
+                  conjunctive=args.conjunctive, impact_ordered=args.impacts, budget=args.budget, **filters)
+        raise SystemExit
+
     print(r'''
                                                           .-.   .-.                                .-.  .-.
                                                           |  \ /  |                                |  /\  |     
@@ -38,23 +131,66 @@ if __name__ == "__main__":
 |                                                        |                 \            /
 |________________________________________________________|                  |          |''')
 
-    if os.path.isfile("nyt.sqlite"):
+    if os.path.isdir(SHARDS_DIR):
+        if args.impacts:
+            arguments.error("--impacts is not supported for a sharded index")
+
+        query = input("\nSearch: ")
+        with ShardedQueryProcessor(processes=args.processes, weights=weights) as processor:
+            time_stamp = time.time()
+            accumulators = processor.process(query, k=10, pruning=True, conjunctive=args.conjunctive, **filters)
+            elapsed_time = time.time() - time_stamp
+            documents = processor.get_documents([acc.did for acc in accumulators])
+            print(f'\nHere are the Top-10 results for {query}')
+            print(f'Found in {round(elapsed_time, 2)} seconds.\n')
+            for i, acc in enumerate(accumulators):
+                print(f'{i+1}.\tscore: {int(acc.score)}\turl: {documents[acc.did][1]}\ttitle: {documents[acc.did][0]}')
+
+    elif os.path.isfile("nyt.sqlite"):
 
         with open_db() as connection:
             query = input("\nSearch: ")
-            processor = QueryProcessor(connection)
+            # prefer the compressed posting files, the tfs tables are only used if they have not been written
+            index = open_index(connection)
+            cache = QueryCache(connection, path=CACHE_NAME) if args.cache else None
+            profiler = Profiler() if args.profile else None
+            impacts = None
+            if args.impacts:
+                impacts = open_impact_index(connection, index.store, index.terms, weights)
+                if impacts is None:
+                    write_impact_index(connection, store=index.store, terms=index.terms, weights=weights)
+                    impacts = open_impact_index(connection, index.store, index.terms, weights)
+            processor = QueryProcessor(connection, index, cache, profiler, impacts, weights)
 
             time_stamp = time.time()
-            accumulators = processor.process(query, k=10)
+            accumulators = processor.process(query, k=10, pruning=True, impact_ordered=args.impacts,
+                                             budget=args.budget, conjunctive=args.conjunctive, **filters)
             elapsed_time = time.time() - time_stamp
             print(f'\nHere are the Top-10 results for {query}')
             print(f'Found in {round(elapsed_time, 2)} seconds.\n')
-            for i, acc in enumerate(accumulators):
-                print(f'{i+1}.\tscore: {int(acc.score)}\turl: {get_url(connection, acc.did)}\ttitle: {get_headline(connection, acc.did)}')
+            with processor.profiler.stage("metadata"):
+                documents = [(get_url(connection, acc.did), get_headline(connection, acc.did)) for acc in accumulators]
+            for i, (acc, (url, title)) in enumerate(zip(accumulators, documents)):
+                print(f'{i+1}.\tscore: {int(acc.score)}\turl: {url}\ttitle: {title}')
+            if profiler is not None:
+                print(f'\n{profiler.report()}')
+            if cache is not None:
+                cache.save()
+
+    elif args.shards:
+        dir = input("Please tell me the path to the diretory of the nyt corpus: ")
+        build_shards(dir, args.shards, args.processes)
 
     else:
         create_db()
         dir = input("Please tell me the path to the diretory of the nyt corpus: ")
-        parse_dir(dir)
+        if args.bulk_load:
+            bulk_load_dir(dir, args.processes)
+        else:
+            parse_dir(dir, args.processes)
+            with open_db() as connection:
+                create_indices(connection)
         with open_db() as connection:
-            create_indices(connection)
+            write_segment_postings(connection)
+            if args.impacts:
+                write_impact_index(connection)
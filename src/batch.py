@@ -0,0 +1,154 @@
+import json
+import math
+import sys
+import time
+from dataclasses import dataclass
+from multiprocessing import Pool
+from typing import List, Optional, Sequence, TextIO, Tuple
+
+from db import DBConnection, get_documents, open_db
+from impact_index import ImpactOrderedIndex, open_impact_index, write_impact_index
+from posting_cache import PostingCache
+from posting_list import DEFAULT_WEIGHTS, FieldWeights, InvertedIndex, np
+from profiling import Profiler
+from query_processing import QueryProcessor
+from segments import open_index
+
+
+@dataclass
+class QueryResult:
+    """Results of a single query of a batch"""
+    query: str
+    results: List[Tuple[int, float]]
+    latency: float
+
+
+# bytes of posting lists every process of a batch keeps for the following queries, unless another budget is given
+CACHE_BUDGET = 256 * 1024 * 1024
+
+
+def open_batch_index(connection: DBConnection, cache_budget: int, weights: FieldWeights,
+                     impact_ordered: bool = False) -> Tuple[InvertedIndex, Optional[ImpactOrderedIndex]]:
+    """Open the index with a PostingCache of cache_budget bytes, so the posting lists of the frequent terms are only
+    fetched once for all queries of a process, and the impact ordered index if it is needed"""
+    index = open_index(connection)
+    index.cachePostings(PostingCache(cache_budget))
+    impacts = open_impact_index(connection, index.store, index.terms, weights) if impact_ordered else None
+    return index, impacts
+
+
+def process_chunk(connection: DBConnection, index: InvertedIndex, impacts: Optional[ImpactOrderedIndex],
+                  queries: Sequence[str], k: int, profiler: Profiler = None, weights: FieldWeights = None,
+                  options: dict = None) -> List[QueryResult]:
+    """Process a chunk of queries with one processor over the given index, see open_batch_index.
+    The same index is used for all chunks of a process, so its cached posting lists are shared by all of them.
+    The options are passed on to QueryProcessor.process."""
+    processor = QueryProcessor(connection, index, profiler=profiler, impacts=impacts, weights=weights)
+    results = []
+    for query in queries:
+        time_stamp = time.perf_counter()
+        accumulators = processor.process(query, k, pruning=True, vectorized=np is not None, **(options or {}))
+        latency = time.perf_counter() - time_stamp
+        results.append(QueryResult(query, [(acc.did, acc.score) for acc in accumulators], latency))
+    return results
+
+
+_worker = None  # (connection, index, impact ordered index) of a worker process, shared by all chunks it processes
+
+
+def _init_worker(cache_budget: int, weights: FieldWeights, impact_ordered: bool) -> None:
+    global _worker
+    connection = open_db()
+    _worker = (connection, *open_batch_index(connection, cache_budget, weights, impact_ordered))
+
+
+def _process_chunk_in_worker(queries: Sequence[str], k: int, profile: bool, weights: FieldWeights,
+                             options: dict) -> Tuple[List[QueryResult], Profiler]:
+    profiler = Profiler() if profile else None
+    return process_chunk(*_worker, queries, k, profiler, weights, options), profiler
+
+
+def run_batch(queries: Sequence[str], k: int = 10, processes: int = 1, chunk_size: int = 256,
+              profiler: Profiler = None, weights: FieldWeights = None, cache_budget: int = CACHE_BUDGET,
+              **options) -> List[QueryResult]:
+    """Process all queries and return their results in the same order.
+    The queries are split into chunks which are processed by a pool of processes, if processes > 1.
+    Every process keeps the posting lists of the frequent terms in a PostingCache of cache_budget bytes for all the
+    chunks it processes. If a profiler is given, the stages and counters of all queries are added to it.
+    The field tfs are weighted with the given weights, by default with the ones in constants.py. The options, e.g.
+    conjunctive, impact_ordered or the filters, are passed on to QueryProcessor.process. The impact ordered index has
+    to be written for the weights already."""
+    weights = weights if weights is not None else DEFAULT_WEIGHTS
+    impact_ordered = options.get("impact_ordered", False)
+    chunk_size = max(1, min(chunk_size, -(-len(queries) // processes)))  # give every process something to do
+    chunks = [queries[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
+    if processes == 1:
+        connection = open_db()
+        index, impacts = open_batch_index(connection, cache_budget, weights, impact_ordered)
+        return [result for chunk in chunks
+                for result in process_chunk(connection, index, impacts, chunk, k, profiler, weights, options)]
+    with Pool(processes, initializer=_init_worker, initargs=(cache_budget, weights, impact_ordered)) as pool:
+        chunk_results = pool.starmap(_process_chunk_in_worker,
+                                     ((chunk, k, profiler is not None, weights, options) for chunk in chunks))
+    if profiler is not None:
+        for _, chunk_profiler in chunk_results:
+            profiler.merge(chunk_profiler)
+    return [result for chunk, _ in chunk_results for result in chunk]
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """Return the p-th percentile (nearest rank) of the values"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def write_results(connection: DBConnection, results: List[QueryResult], output: TextIO, format_: str = "tsv") -> None:
+    """Write the results as tsv (one line per hit) or json, including url and title of every hit"""
+    documents = get_documents(connection, {did for result in results for did, _ in result.results})
+    if format_ == "json":
+        json.dump([{
+            "query": result.query,
+            "latency": result.latency,
+            "results": [{"rank": rank + 1, "did": did, "score": score,
+                         "url": documents[did][1], "title": documents[did][0]}
+                        for rank, (did, score) in enumerate(result.results)]
+        } for result in results], output, indent=2)
+        output.write("\n")
+    else:
+        output.write("query\trank\tscore\tdid\turl\ttitle\n")
+        for result in results:
+            for rank, (did, score) in enumerate(result.results):
+                output.write(f"{result.query}\t{rank + 1}\t{score}\t{did}\t{documents[did][1]}\t{documents[did][0]}\n")
+
+
+def batch(input_: TextIO, output: TextIO, k: int = 10, processes: int = 1, format_: str = "tsv",
+          profile: bool = False, weights: FieldWeights = None, cache_budget: int = CACHE_BUDGET, **options) -> None:
+    """Process every line of input_ as a query, write the results to output and report the throughput.
+    With profile, the time spent in every stage of all queries is reported as well. The options are passed on to
+    QueryProcessor.process, the impact ordered index is written first if it is needed and outdated."""
+    queries = [line.strip() for line in input_ if line.strip()]
+    weights = weights if weights is not None else DEFAULT_WEIGHTS
+    if options.get("impact_ordered"):
+        with open_db() as connection:
+            index = open_index(connection)
+            impacts = open_impact_index(connection, index.store, index.terms, weights)
+            if impacts is None:
+                write_impact_index(connection, store=index.store, terms=index.terms, weights=weights)
+            else:
+                impacts.close()
+    profiler = Profiler() if profile else None
+    time_stamp = time.perf_counter()
+    results = run_batch(queries, k, processes, profiler=profiler, weights=weights, cache_budget=cache_budget,
+                        **options)
+    elapsed_time = time.perf_counter() - time_stamp
+    with open_db() as connection:
+        write_results(connection, results, output, format_)
+
+    latencies = [result.latency * 1000 for result in results]
+    if latencies:
+        print(f"[+] {len(queries)} queries in {round(elapsed_time, 2)} seconds, "
+              f"{round(len(queries) / elapsed_time, 1)} queries/sec, "
+              f"latency p50 {percentile(latencies, 50):.2f} ms, p95 {percentile(latencies, 95):.2f} ms, "
+              f"p99 {percentile(latencies, 99):.2f} ms", file=sys.stderr)
+    if profiler is not None:
+        print(profiler.report(totals=True), file=sys.stderr)
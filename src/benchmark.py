@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from typing import Callable, Dict, List
+
+from batch import percentile
+from bulk_load import bulk_load
+from db import compute_statistics, create_db, insert_boost, insert_documents, insert_records, insert_tfs, open_db
+from impact_index import ImpactOrderedIndex, write_impact_index
+from importer import Importer
+from posting_list import create_indices, np
+from query_processing import QueryProcessor
+from segments import open_index
+from synthetic_corpus import SyntheticCorpus
+
+
+@contextmanager
+def _quiet():
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        yield
+
+
+def _timed(results: Dict[str, float], name: str, f: Callable, *args):
+    """Run f quietly, store its runtime in seconds under name and return its result"""
+    with _quiet():
+        time_stamp = time.perf_counter()
+        result = f(*args)
+        results[name] = time.perf_counter() - time_stamp
+    print(f"[+] {name}: {results[name]:.3f} s", file=sys.stderr)
+    return result
+
+
+def _create_db() -> sqlite3.Connection:
+    with _quiet():
+        return create_db()
+
+
+def benchmark_ingestion(corpus: str, workdir: str, processes: int = None) -> Dict[str, float]:
+    """Time every stage of building the db from the corpus, serially and with the streaming and bulk load pipelines"""
+    results = dict()
+    os.chdir(os.path.join(workdir, "serial"))
+    documents = _timed(results, "import_dir", Importer.import_dir, corpus)
+    connection = _create_db()
+    _timed(results, "insert_documents", insert_documents, connection, documents)
+    _timed(results, "insert_tfs", insert_tfs, connection, documents)
+    _timed(results, "insert_boost", insert_boost, connection, documents)
+    del documents
+    _timed(results, "compute_statistics", compute_statistics, connection)
+    _timed(results, "create_indices", create_indices, connection)
+    connection.close()
+
+    os.chdir(os.path.join(workdir, "streaming"))
+    connection = _create_db()
+    _timed(results, "stream_dir+insert_records", insert_records, connection, Importer.stream_dir(corpus, processes))
+    connection.close()
+
+    os.chdir(os.path.join(workdir, "bulk"))
+    connection = _create_db()
+    # includes the statistics, indices and ANALYZE
+    _timed(results, "bulk_load", bulk_load, connection, Importer.stream_dir(corpus, processes))
+    connection.close()
+    return results
+
+
+def make_queries(corpus: SyntheticCorpus, n: int, min_terms: int, max_terms: int) -> List[str]:
+    """Draw n queries from the vocabulary of the corpus, so frequent terms are frequent in the queries as well"""
+    return [" ".join(corpus.words(corpus.random.randint(min_terms, max_terms))) for _ in range(n)]
+
+
+def benchmark_queries(connection: sqlite3.Connection, queries: List[str], k: int = 10) -> Dict[str, Dict[str, float]]:
+    """Latency distribution in ms of every query processing mode over the queries"""
+    index = open_index(connection)
+    with _quiet():
+        write_impact_index(connection, store=index.store, terms=index.terms)
+    impacts = ImpactOrderedIndex(connection, store=index.store, terms=index.terms)
+    processor = QueryProcessor(connection, index, impacts=impacts)
+    modes = {"exhaustive": {}, "pruning": {"pruning": True}, "impact_ordered": {"impact_ordered": True}}
+    if np is not None:
+        modes["vectorized"] = {"vectorized": True}
+    results = dict()
+    for mode, options in modes.items():
+        for query in queries[:10]:  # warm up the page cache
+            processor.process(query, k, **options)
+        latencies = []
+        for query in queries:
+            time_stamp = time.perf_counter()
+            processor.process(query, k, **options)
+            latencies.append((time.perf_counter() - time_stamp) * 1000)
+        results[mode] = {
+            "mean": sum(latencies) / len(latencies),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies),
+        }
+        print(f"[+] {mode}: p50 {results[mode]['p50']:.2f} ms, p99 {results[mode]['p99']:.2f} ms", file=sys.stderr)
+    return results
+
+
+def compare(old: dict, new: dict, tolerance: float) -> bool:
+    """Print every timing of new next to the one of old, return False if one got slower by more than tolerance"""
+    ok = True
+
+    def walk(old_values, new_values, path):
+        nonlocal ok
+        for key, value in new_values.items():
+            if isinstance(value, dict):
+                walk(old_values.get(key, {}), value, f"{path}{key}.")
+            elif key in old_values and isinstance(value, float) and old_values[key] > 0:
+                ratio = value / old_values[key]
+                regression = ratio > 1 + tolerance
+                ok = ok and not regression
+                print(f"{'REGRESSION ' if regression else ''}{path}{key}: {old_values[key]:.4f} -> {value:.4f} "
+                      f"({ratio:.2f}x)")
+
+    walk(old["ingestion"], new["ingestion"], "ingestion.")
+    walk(old["queries"], new["queries"], "queries.")
+    return ok
+
+
+def run(documents: int, vocabulary: int, zipf: float, seed: int, queries: int, processes: int = None) -> dict:
+    """Generate a corpus, build the db in every way and measure the query latencies"""
+    with tempfile.TemporaryDirectory(prefix="zwo-bench-") as workdir:
+        corpus_dir = os.path.join(workdir, "corpus")
+        for name in ("serial", "streaming", "bulk"):
+            os.mkdir(os.path.join(workdir, name))
+        corpus = SyntheticCorpus(vocabulary, zipf, seed)
+        print(f"[-] generating {documents} documents", file=sys.stderr)
+        corpus.write(corpus_dir, documents)
+
+        cwd = os.getcwd()
+        try:
+            ingestion = benchmark_ingestion(corpus_dir, workdir, processes)
+            connection = open_db(os.path.join(workdir, "bulk", "nyt.sqlite"))
+            query_results = {
+                "short": benchmark_queries(connection, make_queries(corpus, queries, 1, 2)),
+                "long": benchmark_queries(connection, make_queries(corpus, queries, 5, 8)),
+            }
+            connection.close()
+        finally:
+            os.chdir(cwd)
+
+    return {
+        "parameters": {"documents": documents, "vocabulary": vocabulary, "zipf": zipf, "seed": seed,
+                       "queries": queries, "processes": processes},
+        "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                        "machine": platform.machine(), "cpus": os.cpu_count(),
+                        "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "ingestion": ingestion,
+        "queries": query_results,
+    }
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Benchmark ingestion and query processing on a synthetic corpus")
+    arguments.add_argument("--documents", type=int, default=5000)
+    arguments.add_argument("--vocabulary", type=int, default=20000)
+    arguments.add_argument("--zipf", type=float, default=1.0, help="exponent of the Zipf distribution")
+    arguments.add_argument("--seed", type=int, default=2000)
+    arguments.add_argument("--queries", type=int, default=200, help="number of short and of long queries")
+    arguments.add_argument("--processes", type=int, default=None, help="worker processes of the ingestion pipelines")
+    arguments.add_argument("--output", metavar="FILE", help="write the results as json to FILE")
+    arguments.add_argument("--compare", metavar="FILE", help="compare the results with an earlier run")
+    arguments.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown when comparing, 0.2 = 20%%")
+    args = arguments.parse_args()
+
+    results = run(args.documents, args.vocabulary, args.zipf, args.seed, args.queries, args.processes)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as input_:
+            if not compare(json.load(input_), results, args.tolerance):
+                raise SystemExit(1)
@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from constants import ADDITIVE_CONSTANT_DATE_BOOST, TUNABLE_WEIGHT_DATE, TUNABLE_WEIGHT_PAGE
+
+FIRST_DAY = datetime(2000, 1, 1)
+MAX_DAYS = 366
+
+
+def date_boost(date: int) -> float:
+    """Return the boost of a publication date, later documents are boosted more"""
+    str_date = str(date)
+    year = int(str_date[0:4])
+    month = int(str_date[4:6])
+    day = int(str_date[6:8])
+    date_obj = datetime(year, month, day)
+    diff = date_obj - FIRST_DAY
+    return ((diff.days / MAX_DAYS) + ADDITIVE_CONSTANT_DATE_BOOST) * TUNABLE_WEIGHT_DATE
+
+
+def static_boost(page: int, date: int, max_page: int) -> float:
+    """Return the query independent boost of a document, combining the page and the date boost"""
+    return (1 - TUNABLE_WEIGHT_PAGE * (page / max_page)) * date_boost(date)
@@ -0,0 +1,106 @@
+import time
+from collections import Counter
+from typing import Iterable, Tuple, List
+
+from db import DBConnection, compute_statistics, open_db
+from importer import Importer
+from posting_list import create_indices
+from term_dictionary import TermDictionary
+
+# Trade durability for speed while loading. If the load crashes, the db has to be rebuilt from scratch anyway.
+BULK_LOAD_PRAGMAS = (
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -1048576",  # 1 GiB
+)
+DEFAULT_PRAGMAS = (
+    "PRAGMA journal_mode = DELETE",
+    "PRAGMA synchronous = FULL",
+    "PRAGMA locking_mode = NORMAL",
+    "PRAGMA temp_store = DEFAULT",
+)
+# statistics that are accumulated while loading instead of being computed by scanning the tables afterwards
+BULK_STATISTICS = ("create_and_insert_dls", "create_and_insert_dfs", "create_and_insert_d",
+                   "create_and_insert_max_page")
+
+
+def bulk_load(connection: DBConnection, records: Iterable[Tuple[Tuple, Tuple, List[Tuple]]],
+              batch_size: int = 250000, progress_interval: float = 1.0) -> None:
+    """Loads a stream of document records (see Document.convert_to_record) into a freshly created db.
+
+    All tables are written with batched executemany under bulk load pragmas. The dls, dfs, d and max_page statistics
+    are accumulated on the way, the remaining statistics, all indices and ANALYZE run once at the end.
+    """
+    for pragma in BULK_LOAD_PRAGMAS:
+        connection.execute(pragma)
+
+    docs, boosts, tfs = [], [], []
+    dls, dfs = [], Counter()
+    terms = TermDictionary(connection)
+    max_page = None
+    current = 0
+    last_progress = 0.0
+
+    def flush():
+        connection.execute("BEGIN TRANSACTION")
+        connection.executemany("INSERT INTO docs(did, title, url) VALUES (?, ?, ?)", docs)
+        connection.executemany("INSERT INTO boost(did, date, page) VALUES (?, ?, ?)", boosts)
+        connection.executemany("INSERT INTO terms(tid, term) VALUES (?, ?)", terms.new_terms())
+        connection.executemany(
+            "INSERT INTO tfs(did, tid, content_tf, title_tf, abstract_tf) VALUES (?, ?, ?, ?, ?)", tfs)
+        connection.execute("COMMIT")
+        docs.clear()
+        boosts.clear()
+        tfs.clear()
+
+    print()  # print an extra line, because we will delete lines with printing \r
+    for doc, boost, rows in records:
+        rows = terms.convert(rows)
+        docs.append(doc)
+        boosts.append(boost)
+        tfs.extend(rows)
+        if rows:
+            dls.append((boost[0], sum(row[2] + row[3] + row[4] for row in rows)))
+            dfs.update(row[1] for row in rows)
+        if max_page is None or boost[2] > max_page:
+            max_page = boost[2]
+        current += 1
+        if len(tfs) >= batch_size:
+            flush()
+        if time.monotonic() - last_progress >= progress_interval:
+            last_progress = time.monotonic()
+            print(f"\r[{current}] docs loaded", end='')
+    flush()
+    print(f"\r[{current}] docs loaded")
+
+    print("[-] writing accumulated statistics", end="")
+    connection.execute("BEGIN TRANSACTION")
+    connection.execute("CREATE TABLE dls (did INTEGER, len INTEGER)")
+    connection.executemany("INSERT INTO dls(did, len) VALUES (?, ?)", dls)
+    connection.execute("CREATE TABLE dfs (tid INTEGER, df INTEGER)")
+    connection.executemany("INSERT INTO dfs(tid, df) VALUES (?, ?)", dfs.items())
+    connection.execute("CREATE TABLE d (size INTEGER)")
+    connection.execute("INSERT INTO d(size) VALUES (?)", (len(dls),))
+    connection.execute("CREATE TABLE max_page (max_page INTEGER)")
+    connection.execute("INSERT INTO max_page(max_page) VALUES (?)", (max_page,))
+    connection.execute("COMMIT")
+    print("\r[+] writing accumulated statistics")
+
+    compute_statistics(connection, skip=BULK_STATISTICS)
+    create_indices(connection)
+    print("\n[-] analyzing db", end="")
+    connection.execute("ANALYZE")
+    print("\r[+] analyzing db")
+
+    for pragma in DEFAULT_PRAGMAS:
+        connection.execute(pragma)
+    # the exclusive lock is only given up with the next access of the db
+    connection.execute("SELECT size FROM d").fetchone()
+
+
+def bulk_load_dir(directory: str, processes: int = None) -> None:
+    """Bulk loads all Documents of a directory into the freshly created db, including statistics and indices"""
+    with open_db() as connection:
+        bulk_load(connection, Importer.stream_dir(directory, processes))
@@ -0,0 +1,317 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from db import get_segments
+from doc_store import DocumentStore
+from posting_list import DBConnection, END, InvertedIndex, Posting, PostingCursor, np
+from term_dictionary import TermDictionary
+
+POSTINGS_NAME = "nyt.postings"
+BLOCK_SIZE = 128
+
+# File layout:
+#   header | term 0 | term 1 | ... | dictionary
+# Postings reference documents by their docno in the DocumentStore, not by their did.
+# Every term consists of a skip table with one (last_docno, block_offset, exceptions) entry per block, followed by the
+# blocks and the exceptions of the term.
+# A block stores up to BLOCK_SIZE postings as two packed arrays: the docno gaps and the content tfs. The width of each
+# array is chosen per block, so blocks of rare terms with big gaps use 4 bytes and blocks of common terms mostly 1 byte.
+# Most postings have neither a title nor an abstract tf. The few that have one are the exceptions of the term: a header
+# followed by three packed arrays, their positions in the posting list, their title tfs and their abstract tfs.
+# The skip table holds the number of exceptions in the blocks before, so a block finds its exceptions without search.
+# The FieldWeights are applied while decoding.
+# The dictionary at the end holds one fixed size entry per tid of the TermDictionary the file was written with: the
+# offset of the skip table of the term, the offset of its exceptions, its df and its number of blocks. The entry of a
+# term is found at its tid, so opening the file reads nothing but the header. Terms without postings have a df of 0.
+_MAGIC = b"ZWOP"
+_VERSION = 5
+_HEADER = struct.Struct("<4sIIQq")  # magic, version, number of entries, dictionary offset, segment version
+# last docno of the block, offset of the block relative to the end of the skip table, exceptions in the blocks before
+_SKIP = struct.Struct("<III")
+_BLOCK = struct.Struct("<HBB")  # number of postings, typecode of the gaps, typecode of the content tfs
+_EXCEPTIONS = struct.Struct("<IBBB")  # number of exceptions, typecode of the positions, title tfs and abstract tfs
+_ENTRY = struct.Struct("<QQII")  # offset of the term, offset of its exceptions, df, number of blocks
+_TYPECODES = "BHI"
+_SWAP = sys.byteorder == "big"  # the file is always little endian
+_DTYPES = ("<u1", "<u2", "<u4")  # numpy dtypes of the _TYPECODES
+_NO_EXCEPTIONS = (array("B"), array("B"), array("B"))
+
+
+def _pack(values: List[int]) -> Tuple[int, bytes]:
+    """Packs the values into the smallest array type that can hold all of them"""
+    largest = max(values, default=0)
+    for code, typecode in enumerate(_TYPECODES):
+        if largest < 1 << (8 * array(typecode).itemsize):
+            packed = array(typecode, values)
+            if _SWAP:
+                packed.byteswap()
+            return code, packed.tobytes()
+    raise ValueError(f"value {largest} is too large for the posting file")
+
+
+def _unpack(code: int, data) -> array:
+    unpacked = array(_TYPECODES[code], data)
+    if _SWAP:
+        unpacked.byteswap()
+    return unpacked
+
+
+def _size(code: int, count: int) -> int:
+    return count * array(_TYPECODES[code]).itemsize
+
+
+def _encode_term(postings: List[Tuple[int, int, int, int]]) -> Tuple[bytes, int, int]:
+    """Encodes the (docno, content tf, title tf, abstract tf) postings of a single term, which have to be sorted by
+    docno. Returns the encoded term, its number of blocks and the offset of its exceptions in the encoded term."""
+    skips = []
+    blocks = []
+    size = 0
+    last = 0
+    exceptions = [position for position, posting in enumerate(postings) if posting[2] or posting[3]]
+    before = 0  # exceptions in the blocks before
+    for start in range(0, len(postings), BLOCK_SIZE):
+        block = postings[start:start + BLOCK_SIZE]
+        gaps = [block[0][0] - last, *(b[0] - a[0] for a, b in zip(block, block[1:]))]
+        gap_code, gap_bytes = _pack(gaps)
+        tf_code, tf_bytes = _pack([posting[1] for posting in block])
+        skips.append(_SKIP.pack(block[-1][0], size, before))
+        blocks.append(_BLOCK.pack(len(block), gap_code, tf_code) + gap_bytes + tf_bytes)
+        size += _BLOCK.size + len(gap_bytes) + len(tf_bytes)
+        last = block[-1][0]
+        before = bisect_left(exceptions, start + BLOCK_SIZE)
+    position_code, position_bytes = _pack(exceptions)
+    title_code, title_bytes = _pack([postings[position][2] for position in exceptions])
+    abstract_code, abstract_bytes = _pack([postings[position][3] for position in exceptions])
+    data = b"".join(skips) + b"".join(blocks)
+    return (data + _EXCEPTIONS.pack(len(exceptions), position_code, title_code, abstract_code) + position_bytes +
+            title_bytes + abstract_bytes, len(blocks), len(data))
+
+
+def segment_postings_name(segment: int) -> str:
+    """Return the name of the posting file of a segment"""
+    return POSTINGS_NAME if segment == 0 else f"{POSTINGS_NAME}.{segment}"
+
+
+def write_segment_postings(connection: DBConnection, store: DocumentStore = None, directory: str = "") -> None:
+    """Writes the posting files of all segments into the directory of the db"""
+    store = store if store is not None else DocumentStore(connection)
+    terms = TermDictionary(connection)
+    for segment, table, version in get_segments(connection):
+        write_compressed_index(connection, os.path.join(directory, segment_postings_name(segment)), store, table,
+                               version, terms)
+
+
+def write_compressed_index(connection: DBConnection, path: str = POSTINGS_NAME, store: DocumentStore = None,
+                           table: str = "tfs", version: int = None, terms: TermDictionary = None) -> None:
+    """Writes all posting lists of a tfs table into a compressed posting file.
+    The file replaces an existing one at once, so processes still reading the old file are not disturbed."""
+    print(f"\n[-] writing posting file {path}", end="")
+    docnos = (store if store is not None else DocumentStore(connection)).docnos
+    terms = (terms if terms is not None else TermDictionary(connection)).terms
+    version = -1 if version is None else version
+    dictionary = bytearray(len(terms) * _ENTRY.size)
+    with open(path + ".tmp", "wb") as output:
+        output.write(_HEADER.pack(_MAGIC, _VERSION, 0, 0, version))
+        current_tid = None
+        postings = []
+
+        def flush():
+            postings.sort()
+            data, blocks, exceptions = _encode_term(postings)
+            _ENTRY.pack_into(dictionary, current_tid * _ENTRY.size, output.tell(), output.tell() + exceptions,
+                             len(postings), blocks)
+            output.write(data)
+
+        for tid, did, content_tf, title_tf, abstract_tf in connection.execute(
+                f"SELECT tid, did, content_tf, title_tf, abstract_tf FROM {table} ORDER BY tid, did"):
+            if tid != current_tid:
+                if postings:
+                    flush()
+                current_tid = tid
+                postings = []
+            postings.append((docnos[did], content_tf, title_tf, abstract_tf))
+        if postings:
+            flush()
+
+        dictionary_offset = output.tell()
+        output.write(dictionary)
+        output.seek(0)
+        output.write(_HEADER.pack(_MAGIC, _VERSION, len(terms), dictionary_offset, version))
+    os.replace(path + ".tmp", path)
+    print(f"\r[+] writing posting file {path}")
+
+
+class CompressedInvertedIndex(InvertedIndex):
+    """Inverted index reading the posting lists from a memory mapped posting file instead of the tfs table.
+
+    Everything that is not a posting list is still answered by the database and the TermDictionary, so the dfs are
+    the ones of the whole collection, even if the file only covers a segment or a shard of it. The TermDictionary
+    has to be the one of the db the file was written from, as the entries of the terms are looked up by their tids.
+    """
+
+    def __init__(self, connection: DBConnection, path: str = POSTINGS_NAME, store: DocumentStore = None,
+                 terms: TermDictionary = None):
+        super().__init__(connection, store, terms=terms)
+        with open(path, "rb") as input_:
+            self.mm = mmap.mmap(input_.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.entries, self.dictionary_offset, segment_version = _HEADER.unpack_from(self.mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not a posting file of version {_VERSION}")
+        # version of the segment the file was written from, None if unknown
+        self.version = segment_version if segment_version != -1 else None
+
+    def close(self) -> None:
+        self.mm.close()
+
+    def _entry(self, term: str) -> Optional[Tuple[int, int, int, int]]:
+        """Return the offset, df, number of blocks and offset of the exceptions of a term, None if it has no postings"""
+        try:
+            tid = self.terms.tid(term)
+        except KeyError:
+            return None
+        if tid >= self.entries:
+            return None  # added to the db after the file was written
+        offset, exceptions, df, blocks = _ENTRY.unpack_from(self.mm, self.dictionary_offset + tid * _ENTRY.size)
+        return (offset, df, blocks, exceptions) if df else None
+
+    def readIndexList(self, term: str) -> List[Posting]:
+        return [Posting(docno, tf) for docno, tf in self.iterPostings(term)]
+
+    def readIndexArrays(self, term: str) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Return the posting list of a term as two parallel numpy arrays of docnos and tfs, sorted by docno.
+        The blocks are read straight from the mapped file, no posting is touched by the interpreter."""
+        offset, df, blocks, exceptions = self._entry(term) or (0, 0, 0, 0)
+        self.profiler.count("posting lists")
+        self.profiler.count("blocks decoded", blocks)
+        gaps = np.empty(df, dtype=np.int64)
+        tfs = np.empty(df, dtype=np.int64)
+        start = offset + blocks * _SKIP.size
+        position = 0
+        for _ in range(blocks):
+            count, gap_code, tf_code = _BLOCK.unpack_from(self.mm, start)
+            start += _BLOCK.size
+            gaps[position:position + count] = np.frombuffer(self.mm, _DTYPES[gap_code], count, start)
+            start += _size(gap_code, count)
+            tfs[position:position + count] = np.frombuffer(self.mm, _DTYPES[tf_code], count, start)
+            start += _size(tf_code, count)
+            position += count
+        content, title, abstract = self.weights
+        if content != 1:
+            tfs = tfs * content
+        if df:
+            count, position_code, title_code, abstract_code = _EXCEPTIONS.unpack_from(self.mm, exceptions)
+            if count:
+                start = exceptions + _EXCEPTIONS.size
+                positions = np.frombuffer(self.mm, _DTYPES[position_code], count, start)
+                start += _size(position_code, count)
+                title_tfs = np.frombuffer(self.mm, _DTYPES[title_code], count, start).astype(np.float64)
+                start += _size(title_code, count)
+                abstract_tfs = np.frombuffer(self.mm, _DTYPES[abstract_code], count, start).astype(np.float64)
+                tfs = tfs.astype(np.float64)
+                # in the same order as WEIGHTED_TF, so the tfs are exactly the ones of the tfs table
+                tfs[positions] = tfs[positions] + title_tfs * title + abstract_tfs * abstract
+        # every block continues where the previous one ended, so the gaps of all blocks form one running sum
+        return np.cumsum(gaps), tfs
+
+    def readCursor(self, term: str) -> PostingCursor:
+        """Return a cursor over the posting list of a term, which only decodes the blocks it does not skip"""
+        entry = self._entry(term)
+        if entry is None:
+            return PostingCursor([], [])
+        offset, _, blocks, exceptions = entry
+        self.profiler.count("posting lists")
+        return BlockPostingCursor(self, offset, blocks, self._decode_exceptions(exceptions))
+
+    def iterPostings(self, term: str) -> Iterator[Tuple[int, float]]:
+        """Lazily decodes the (docno, tf) pairs of a term, one block at a time"""
+        entry = self._entry(term)
+        if entry is None:
+            return
+        offset, _, blocks, exceptions = entry
+        self.profiler.count("posting lists")
+        exceptions = self._decode_exceptions(exceptions)
+        for block in range(blocks):
+            yield from zip(*self._decode_block(offset, blocks, block, exceptions))
+
+    def _decode_exceptions(self, offset: int) -> Tuple[array, array, array]:
+        """Decodes the positions, title tfs and abstract tfs of the exceptions of a term"""
+        count, position_code, title_code, abstract_code = _EXCEPTIONS.unpack_from(self.mm, offset)
+        if not count:
+            return _NO_EXCEPTIONS
+        start = offset + _EXCEPTIONS.size
+        end = start + _size(position_code, count)
+        positions = _unpack(position_code, self.mm[start:end])
+        start, end = end, end + _size(title_code, count)
+        title_tfs = _unpack(title_code, self.mm[start:end])
+        abstract_tfs = _unpack(abstract_code, self.mm[end:end + _size(abstract_code, count)])
+        return positions, title_tfs, abstract_tfs
+
+    def _decode_block(self, offset: int, blocks: int, block: int,
+                      exceptions: Tuple[array, array, array]) -> Tuple[List[int], Sequence[float]]:
+        self.profiler.count("blocks decoded")
+        base = _SKIP.unpack_from(self.mm, offset + (block - 1) * _SKIP.size)[0] if block else 0
+        _, block_offset, first = _SKIP.unpack_from(self.mm, offset + block * _SKIP.size)
+        start = offset + blocks * _SKIP.size + block_offset
+        count, gap_code, tf_code = _BLOCK.unpack_from(self.mm, start)
+        start += _BLOCK.size
+        end = start + _size(gap_code, count)
+        gaps = _unpack(gap_code, self.mm[start:end])
+        tfs = _unpack(tf_code, self.mm[end:end + _size(tf_code, count)])
+        docnos = list(accumulate(gaps, initial=base))
+        del docnos[0]
+        content, title, abstract = self.weights
+        positions, title_tfs, abstract_tfs = exceptions
+        last = _SKIP.unpack_from(self.mm, offset + (block + 1) * _SKIP.size)[2] if block + 1 < blocks \
+            else len(positions)
+        if content == 1 and first == last:
+            return docnos, tfs  # the tfs are the content tfs already
+        tfs = [tf * content for tf in tfs] if content != 1 else list(tfs)
+        start = block * BLOCK_SIZE  # all blocks but the last one are full
+        for i in range(first, last):
+            # in the same order as WEIGHTED_TF, so the tfs are exactly the ones of the tfs table
+            tfs[positions[i] - start] = tfs[positions[i] - start] + title_tfs[i] * title + abstract_tfs[i] * abstract
+        return docnos, tfs
+
+
+class BlockPostingCursor(PostingCursor):
+    """PostingCursor over a posting list in the posting file. Blocks are decoded when the cursor enters them,
+    advance uses the skip table to jump over blocks without decoding them."""
+
+    def __init__(self, index: CompressedInvertedIndex, offset: int, blocks: int,
+                 exceptions: Tuple[array, array, array]):
+        self.index = index
+        self.offset = offset
+        self.blocks = blocks
+        self.exceptions = exceptions
+        self.last_docnos = [last for last, _, _ in _SKIP.iter_unpack(index.mm[offset:offset + blocks * _SKIP.size])]
+        self._load(0)
+        super().next()
+
+    def _load(self, block: int) -> None:
+        self.block = block
+        self.docnos, self.tfs = self.index._decode_block(self.offset, self.blocks, block, self.exceptions)
+        self.position = -1
+
+    def next(self) -> int:
+        if self.position + 1 >= len(self.docnos) and self.block + 1 < self.blocks:
+            self._load(self.block + 1)
+        return super().next()
+
+    def advance(self, target: int) -> int:
+        if self.docno >= target:
+            return self.docno
+        if target > self.last_docnos[self.block]:
+            block = bisect_left(self.last_docnos, target, self.block + 1)
+            if block == self.blocks:
+                self.position = len(self.docnos)
+                self.docno = END
+                self.tf = 0
+                return END
+            self._load(block)
+        return super().advance(target)
@@ -1,6 +1,9 @@
 import sqlite3
+import constants
+from boost import static_boost
 from parser import Document
-from typing import Sequence, Callable, TypeVar
+from term_dictionary import TermDictionary
+from typing import Sequence, Callable, TypeVar, Iterable, Tuple, List, Collection, Dict
 
 DB_NAME = "nyt.sqlite"
 STATEMENT_CACHE = 100000
@@ -16,14 +19,76 @@ def chunks(seq: Sequence[T], n: int = 1000) -> Sequence[Sequence[T]]:
         yield seq[i:i + n]
 
 
-def compute_statistics(connection: DBConnection) -> None:
-    """Compute the dfs, dsl, d statistics and write them to the db"""
-    for f in STATS_FUNCS.values():
-        f(connection)
+def compute_statistics(connection: DBConnection, skip: Collection[str] = ()) -> None:
+    """Compute the dfs, dsl, d, max_page and static boost statistics and write them to the db.
+    The statistics whose function names are in skip were already computed otherwise and are left out."""
+    for name, f in STATS_FUNCS.items():
+        if name not in skip:
+            f(connection)
+    seal_segment(connection, bump_index_version(connection))
+
+
+def get_index_version(connection: DBConnection) -> int:
+    """Retrieves the version of the index, which changes every time the content of the db changes"""
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def bump_index_version(connection: DBConnection) -> int:
+    """Increments the version of the index, invalidating everything that was derived from an older version"""
+    version = get_index_version(connection) + 1
+    connection.execute(f"PRAGMA user_version = {version}")
+    connection.commit()
+    return version
+
+
+def get_segments(connection: DBConnection) -> List[Tuple[int, str, int]]:
+    """Retrieves the (id, tfs table, version) of all index segments, ordered by id.
+    Segment 0 is the tfs table, every incremental ingest adds a segment with its own tfs table.
+    A segment without version is currently written and not complete yet."""
+    try:
+        return connection.execute("SELECT id, tfs, version FROM segments ORDER BY id").fetchall()
+    except sqlite3.OperationalError:
+        return [(0, "tfs", get_index_version(connection))]  # db created before there were segments
+
+
+def add_segment(connection: DBConnection) -> Tuple[int, str]:
+    """Creates a new, empty segment and returns its id and the name of its tfs table"""
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS segments
+        (id INTEGER PRIMARY KEY,
+        tfs TEXT NOT NULL,
+        version INTEGER)
+    """)
+    connection.execute("INSERT OR IGNORE INTO segments(id, tfs, version) VALUES (0, 'tfs', ?)",
+                       (get_index_version(connection),))
+    id_ = connection.execute("SELECT MAX(id) + 1 FROM segments").fetchone()[0]
+    table = f"tfs_{id_}"
+    connection.execute(f"""
+        CREATE TABLE {table}
+        (did INTEGER,
+        tid INTEGER NOT NULL,
+        content_tf INTEGER,
+        title_tf INTEGER,
+        abstract_tf INTEGER)
+    """)
+    connection.execute("INSERT INTO segments(id, tfs, version) VALUES (?, ?, NULL)", (id_, table))
+    connection.commit()
+    return id_, table
+
+
+def seal_segment(connection: DBConnection, version: int, segment: int = 0) -> None:
+    """Marks a segment whose documents and statistics are complete with the index version, unless it is sealed already.
+    Anything derived from a segment, e.g. its posting file, is only valid for the version of the segment.
+    The segment of an ingest that crashed is never sealed, so it is never read."""
+    try:
+        connection.execute("UPDATE segments SET version = ? WHERE id = ? AND version IS NULL", (version, segment))
+        connection.commit()
+    except sqlite3.OperationalError:
+        pass  # db created before there were segments
 
 
 def create_db(db_name: str = DB_NAME) -> DBConnection:
-    """Creates a new database with given name. Only the empty tables docs and tfs will be present after this."""
+    """Creates a new database with given name. Only the empty tables docs, terms and tfs will be present after this."""
     connection = open_db(db_name)
     connection.execute("""
         CREATE TABLE docs
@@ -31,11 +96,18 @@ def create_db(db_name: str = DB_NAME) -> DBConnection:
         title TEXT NOT NULL, 
         url TEXT NOT NULL)
     """)
+    connection.execute("""
+        CREATE TABLE terms
+        (tid INTEGER PRIMARY KEY,
+        term TEXT NOT NULL)
+    """)
     connection.execute("""
         CREATE TABLE tfs 
         (did INTEGER,
-        term TEXT NOT NULL,
-        tf INTEGER)
+        tid INTEGER NOT NULL,
+        content_tf INTEGER,
+        title_tf INTEGER,
+        abstract_tf INTEGER)
     """)
     connection.execute("""
         CREATE TABLE boost
@@ -43,12 +115,23 @@ def create_db(db_name: str = DB_NAME) -> DBConnection:
         date INTEGER,
         page INTEGER
         )""")
-    print(f"[+] Created db {DB_NAME}")
+    connection.execute("""
+        CREATE TABLE segments
+        (id INTEGER PRIMARY KEY,
+        tfs TEXT NOT NULL,
+        version INTEGER)
+    """)
+    connection.execute("INSERT INTO segments(id, tfs, version) VALUES (0, 'tfs', NULL)")
+    connection.commit()
+    print(f"[+] Created db {db_name}")
     return connection
 
 
-def open_db(db_name: str = DB_NAME) -> DBConnection:
-    """Opens the database with given name"""
+def open_db(db_name: str = DB_NAME, read_only: bool = False) -> DBConnection:
+    """Opens the database with given name. A read-only connection can be used by other threads as well."""
+    if read_only:
+        return sqlite3.connect(f"file:{db_name}?mode=ro", uri=True, cached_statements=STATEMENT_CACHE,
+                               check_same_thread=False)
     return sqlite3.connect(db_name, cached_statements=STATEMENT_CACHE)
 
 
@@ -89,23 +172,68 @@ def insert_tfs(connection: DBConnection, documents: Sequence[Document]) -> None:
     """Inserts all term frequencies into the tfs table"""
     max_ = len(documents)
     current = 0
+    terms = TermDictionary(connection)
     print()  # print an extra line, because we will delete lines with printing \r
     for chunk in chunks(documents):
-        rows = (d.get_tfs_rows() for d in chunk)
+        rows = [terms.convert(d.get_tfs_rows()) for d in chunk]
         connection.execute("BEGIN TRANSACTION")
+        connection.executemany("INSERT INTO terms(tid, term) VALUES (?, ?)", terms.new_terms())
         for row in rows:
             connection.executemany(
-                "INSERT INTO tfs(did, term, tf) VALUES (?, ?, ?)", row)
+                "INSERT INTO tfs(did, tid, content_tf, title_tf, abstract_tf) VALUES (?, ?, ?, ?, ?)", row)
         connection.execute("COMMIT")
         current += len(chunk)
         print(f"\r[{current}/{max_}] doc-tfs done", end='')
     print()
 
 
+def insert_records(connection: DBConnection, records: Iterable[Tuple[Tuple, Tuple, List[Tuple]]],
+                   batch_size: int = 100000, table: str = "tfs") -> None:
+    """Inserts a stream of document records (see Document.convert_to_record) into the docs, boost and tfs tables.
+    The rows are collected and written with one executemany per table as soon as batch_size tfs rows are pending.
+    The tfs rows can be written into the tfs table of another segment. Terms not in the db yet get a new term id."""
+    docs, boosts, tfs = [], [], []
+    current = 0
+    terms = TermDictionary(connection)
+
+    def flush():
+        connection.execute("BEGIN TRANSACTION")
+        connection.executemany("INSERT INTO docs(did, title, url) VALUES (?, ?, ?)", docs)
+        connection.executemany("INSERT INTO boost(did, date, page) VALUES (?, ?, ?)", boosts)
+        connection.executemany("INSERT INTO terms(tid, term) VALUES (?, ?)", terms.new_terms())
+        connection.executemany(
+            f"INSERT INTO {table}(did, tid, content_tf, title_tf, abstract_tf) VALUES (?, ?, ?, ?, ?)", tfs)
+        connection.execute("COMMIT")
+        print(f"\r[{current}] docs done", end='')
+        docs.clear()
+        boosts.clear()
+        tfs.clear()
+
+    print()  # print an extra line, because we will delete lines with printing \r
+    for doc, boost, rows in records:
+        docs.append(doc)
+        boosts.append(boost)
+        tfs.extend(terms.convert(rows))
+        current += 1
+        if len(tfs) >= batch_size:
+            flush()
+    flush()
+    print()
+
+
 def get_headline(connection: DBConnection, did: int):
     """Retrieves the headline of a article in the db"""
     return connection.execute("SELECT title FROM docs WHERE did=:did", (did,)).fetchone()[0]
 
+def get_documents(connection: DBConnection, dids: Collection[int]) -> Dict[int, Tuple[str, str]]:
+    """Retrieves title and url of many articles in the db with as few queries as possible"""
+    documents = dict()
+    for chunk in chunks(list(dids), 900):  # sqlite allows at most 999 parameters per statement
+        documents.update((did, (title, url)) for did, title, url in connection.execute(
+            f"SELECT did, title, url FROM docs WHERE did IN ({', '.join('?' * len(chunk))})", chunk))
+    return documents
+
+
 def get_url(connection: DBConnection, did: int):
     """Retrieves the headline of a article in the db"""
     return connection.execute("SELECT url FROM docs WHERE did=:did", (did,)).fetchone()[0]
@@ -128,18 +256,18 @@ def create_and_insert_dls(connection: DBConnection) -> None:
     print("\n[-] creating table dls", end="")
     connection.execute("""
         CREATE TABLE dls AS
-        SELECT did, SUM(tf) AS len FROM tfs GROUP BY did
+        SELECT did, SUM(content_tf + title_tf + abstract_tf) AS len FROM tfs GROUP BY did
     """)
     print("\r[+] creating table dls")
 
 
 @collection_statistic
 def create_and_insert_dfs(connection: DBConnection) -> None:
-    """Creates and fills the table dfs with terms and their document frequencies"""
+    """Creates and fills the table dfs with term ids and their document frequencies"""
     print("\n[-] creating table dfs", end="")
     connection.execute("""
         CREATE TABLE dfs AS
-        SELECT term, COUNT(tf) AS df FROM tfs GROUP BY term
+        SELECT tid, COUNT(*) AS df FROM tfs GROUP BY tid
     """)
     print("\r[+] creating table dfs")
 
@@ -163,3 +291,162 @@ def create_and_insert_max_page(connection: DBConnection) -> None:
     CREATE TABLE max_page AS
     SELECT MAX(page) AS max_page from boost""")
     print("\r[+] creating table max_page")
+
+
+@collection_statistic
+def create_and_insert_static_boosts(connection: DBConnection) -> None:
+    """Creates and fills the table static_boosts with the precomputed page and date boost of every document"""
+    print("\n[-] creating table static_boosts", end="")
+    connection.execute("DROP TABLE IF EXISTS static_boosts")
+    connection.execute("""
+        CREATE TABLE static_boosts
+        (did INTEGER PRIMARY KEY,
+        boost REAL)
+    """)
+    connection.create_function("static_boost", 3, static_boost, deterministic=True)
+    connection.execute("""
+        INSERT INTO static_boosts(did, boost)
+        SELECT did, static_boost(page, date, (SELECT max_page FROM max_page)) FROM boost
+    """)
+    connection.commit()
+    print("\r[+] creating table static_boosts")
+
+
+# the max impacts of the terms in a tfs table, with the weights in max_impact_weights and of every field
+_MAX_IMPACTS = """
+        SELECT tid, MAX((content_tf * w.content + title_tf * w.title + abstract_tf * w.abstract) * boost),
+            MAX(content_tf * boost), MAX(title_tf * boost), MAX(abstract_tf * boost)
+        FROM {table} JOIN static_boosts ON {table}.did = static_boosts.did JOIN max_impact_weights AS w
+        WHERE true GROUP BY tid
+        ON CONFLICT(tid) DO UPDATE SET max_impact = MAX(max_impact, excluded.max_impact),
+            content = MAX(content, excluded.content), title = MAX(title, excluded.title),
+            abstract = MAX(abstract, excluded.abstract)"""
+
+
+# recomputes the boosts of all documents that have one already
+_UPDATE_STATIC_BOOSTS = """
+        UPDATE static_boosts SET boost = (
+            SELECT static_boost(page, date, (SELECT max_page FROM max_page)) FROM boost
+            WHERE boost.did = static_boosts.did)"""
+
+
+@collection_statistic
+def create_and_insert_max_impacts(connection: DBConnection) -> None:
+    """Creates and fills the table max_impacts with the maximum tf * static boost of every term.
+    Multiplied with the idf this is an upper bound for the score a term can contribute to any document.
+    The tfs are weighted with the field weights in constants.py, which are kept in the table max_impact_weights.
+    The maximum of every field is stored as well, so there is an upper bound for any other weights, too.
+    The postings of all complete segments are included."""
+    print("\n[-] creating table max_impacts", end="")
+    connection.execute("DROP TABLE IF EXISTS max_impacts")
+    connection.execute("DROP TABLE IF EXISTS max_impact_weights")
+    connection.execute("""
+        CREATE TABLE max_impact_weights
+        (content REAL,
+        title REAL,
+        abstract REAL)
+    """)
+    connection.execute("INSERT INTO max_impact_weights(content, title, abstract) VALUES (?, ?, ?)", (
+        constants.TUNABLE_WEIGHT_CONTENT, constants.TUNABLE_WEIGHT_TITLE, constants.TUNABLE_WEIGHT_ABSTRACT))
+    connection.execute("""
+        CREATE TABLE max_impacts
+        (tid INTEGER PRIMARY KEY,
+        max_impact REAL,
+        content REAL,
+        title REAL,
+        abstract REAL)
+    """)
+    for segment, table, version in get_segments(connection):
+        if version is not None or segment == 0:
+            connection.execute(f"""
+                INSERT INTO max_impacts(tid, max_impact, content, title, abstract)
+                {_MAX_IMPACTS.format(table=table)}
+            """)
+    connection.commit()
+    print("\r[+] creating table max_impacts")
+
+
+def update_statistics(connection: DBConnection, table: str, first_rowid: int, segment: int) -> int:
+    """Updates all statistics in place after the documents starting at first_rowid in the boost table were
+    added with their tfs rows in the tfs table of the given segment, then seals the segment. Everything happens in one
+    transaction, so the statistics never include the documents of an ingest that crashed. Except for the static boosts,
+    which depend on the maximum page of the whole collection, the cost only depends on the number of added documents.
+    Returns the new version of the index."""
+    print("\n[-] updating statistics", end="")
+    connection.create_function("static_boost", 3, static_boost, deterministic=True)
+    connection.execute("BEGIN TRANSACTION")
+    connection.execute(f"""
+        INSERT INTO dls(did, len) SELECT did, SUM(content_tf + title_tf + abstract_tf) FROM {table} GROUP BY did
+    """)
+    connection.execute(f"CREATE TEMP TABLE new_dfs AS SELECT tid, COUNT(*) AS df FROM {table} GROUP BY tid")
+    connection.execute("CREATE INDEX temp.new_dfs_idx ON new_dfs(tid)")
+    connection.execute("""
+        UPDATE dfs SET df = df + (SELECT new_dfs.df FROM new_dfs WHERE new_dfs.tid = dfs.tid)
+        WHERE tid IN (SELECT tid FROM new_dfs)
+    """)
+    connection.execute("""
+        INSERT INTO dfs(tid, df) SELECT tid, df FROM new_dfs WHERE tid NOT IN (SELECT tid FROM dfs)
+    """)
+    connection.execute("DROP TABLE temp.new_dfs")
+    connection.execute(f"UPDATE d SET size = size + (SELECT COUNT(DISTINCT did) FROM {table})")
+    max_page = get_max_page(connection)
+    new_max_page = connection.execute("SELECT MAX(page) FROM boost WHERE rowid >= ?", (first_rowid,)).fetchone()[0]
+    tables = [table]
+    if new_max_page is not None and new_max_page > max_page:
+        # the page boost of every document changed, so do it the expensive way
+        print("\r[+] updating statistics, the maximum page changed")
+        print("\n[-] updating statistics", end="")
+        connection.execute("UPDATE max_page SET max_page = ?", (new_max_page,))
+        connection.execute(_UPDATE_STATIC_BOOSTS)
+        connection.execute("DELETE FROM max_impacts")
+        tables += [tfs for id_, tfs, version in get_segments(connection) if version is not None or id_ == 0]
+    connection.execute("""
+        INSERT INTO static_boosts(did, boost)
+        SELECT did, static_boost(page, date, (SELECT max_page FROM max_page)) FROM boost WHERE rowid >= ?
+    """, (first_rowid,))
+    for tfs in tables:
+        connection.execute(f"""
+            INSERT INTO max_impacts(tid, max_impact, content, title, abstract)
+            {_MAX_IMPACTS.format(table=tfs)}
+        """)
+    version = get_index_version(connection) + 1
+    connection.execute(f"PRAGMA user_version = {version}")
+    connection.execute("UPDATE segments SET version = ? WHERE id = ?", (version, segment))
+    connection.execute("COMMIT")
+    print("\r[+] updating statistics")
+    return version
+
+
+def drop_unsealed_segments(connection: DBConnection) -> None:
+    """Removes the segments of ingests that crashed, together with their documents. The statistics are only updated
+    when an ingest completes, so its documents are the ones without a static boost.
+    Only one ingest may run at a time, otherwise the segment of the other one is removed as well."""
+    segments = [(id_, table) for id_, table, version in get_segments(connection) if version is None and id_ != 0]
+    if not segments:
+        return
+    print("\n[-] removing unfinished segments", end="")
+    connection.execute("BEGIN TRANSACTION")
+    for id_, table in segments:
+        connection.execute(f"DROP TABLE IF EXISTS {table}")
+        connection.execute("DELETE FROM segments WHERE id = ?", (id_,))
+    for table in ("docs", "boost", "dls"):
+        connection.execute(f"DELETE FROM {table} WHERE did NOT IN (SELECT did FROM static_boosts)")
+    connection.execute("COMMIT")
+    print(f"\r[+] removing unfinished segments {', '.join(str(id_) for id_, _ in segments)}")
+
+
+def rebuild_static_boosts(connection: DBConnection) -> None:
+    """Recomputes the static_boosts table and the max_impacts depending on it,
+    needed after the page or date weights in constants.py were changed. The field weights are applied at query time.
+    Only the documents that have a boost already get a new one, the documents of a crashed ingest stay without."""
+    print("\n[-] updating table static_boosts", end="")
+    connection.create_function("static_boost", 3, static_boost, deterministic=True)
+    try:
+        connection.execute(_UPDATE_STATIC_BOOSTS)
+        connection.commit()
+        print("\r[+] updating table static_boosts")
+    except sqlite3.OperationalError:
+        # databases created before the static_boosts table existed
+        create_and_insert_static_boosts(connection)
+    create_and_insert_max_impacts(connection)
+    bump_index_version(connection)
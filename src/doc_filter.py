@@ -0,0 +1,66 @@
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Dict, Iterable, Optional
+
+from doc_store import DocumentStore
+
+
+def _bitmaps(keys: Iterable[int], size: int) -> Dict[int, int]:
+    """Return one bitmap per distinct key, bit docno of the bitmap of a key is set if the document has that key"""
+    bits = dict()
+    for docno, key in enumerate(keys):
+        if key not in bits:
+            bits[key] = bytearray((size + 7) // 8)
+        bits[key][docno >> 3] |= 1 << (docno & 7)
+    return {key: int.from_bytes(b, "little") for key, b in bits.items()}
+
+
+class DocumentFilter:
+    """Precomputed bitmaps of the documents of every publication day, month and page, built once from the
+    DocumentStore. A bitmap is an int whose bit docno is set if the document belongs to it, so the documents of a
+    date range or up to a page are selected with a few ORs of whole bitmaps instead of looking at every document.
+    """
+    size: int
+    days: Dict[int, int]
+    months: Dict[int, int]
+    pages: list
+    up_to_page: list
+
+    def __init__(self, store: DocumentStore):
+        self.size = len(store)
+        # dates are stored with the time like 20000131000000, the bitmaps are keyed by the day like 20000131
+        days = [int(str(date)[0:8]) for date in store.dates]
+        self.days = _bitmaps(days, self.size)
+        self.months = _bitmaps((day // 100 for day in days), self.size)
+        pages = _bitmaps(store.pages, self.size)
+        self.pages = sorted(pages)
+        # up_to_page[i] holds all documents on self.pages[i] or a page before
+        self.up_to_page = list(accumulate((pages[page] for page in self.pages), lambda a, b: a | b))
+
+    def select(self, date_from: int = None, date_to: int = None, max_page: int = None) -> Optional[bytes]:
+        """Return the documents published from date_from to date_to (both inclusive, like 20000131) and printed on
+        max_page or a page before, as a bitmap of bytes: bit docno % 8 of byte docno // 8 is set if the document
+        passes. Returns None if no filter is given."""
+        if date_from is None and date_to is None and max_page is None:
+            return None
+        selected = (1 << self.size) - 1
+        if date_from is not None or date_to is not None:
+            low = date_from if date_from is not None else 0
+            high = date_to if date_to is not None else 99999999
+            dates = 0
+            for month, bitmap in self.months.items():
+                if low <= month * 100 and month * 100 + 99 <= high:
+                    dates |= bitmap  # the whole month is inside the range
+                elif low // 100 <= month <= high // 100:
+                    for day in range(max(low, month * 100), min(high, month * 100 + 99) + 1):
+                        dates |= self.days.get(day, 0)
+            selected &= dates
+        if max_page is not None:
+            position = bisect_right(self.pages, max_page)
+            selected &= self.up_to_page[position - 1] if position else 0
+        return selected.to_bytes((self.size + 7) // 8, "little")
+
+
+def passes(mask: bytes, docno: int) -> bool:
+    """Return whether the document passes the filter of a bitmap returned by DocumentFilter.select"""
+    return mask[docno >> 3] >> (docno & 7) & 1 == 1
@@ -0,0 +1,81 @@
+import sqlite3
+from array import array
+from typing import Dict, Optional, Sequence
+
+from boost import static_boost
+
+DBConnection = sqlite3.Connection
+
+
+class DocumentStore:
+    """In-memory store of the per document attributes, loaded once from the boost and dls tables.
+
+    Documents are addressed by a dense document number (docno) from 0 to size - 1,
+    so every attribute is a compact array that is indexed by the docno.
+    Docnos follow the insertion order of the documents, so documents added later never change existing docnos.
+    Documents without a static boost are left out, their ingest is still running or crashed before the statistics
+    were updated.
+    """
+    dids: Sequence[int]
+    pages: Sequence[int]
+    dates: Sequence[int]
+    lengths: Sequence[int]
+    boosts: Sequence[float]
+    # the size of the collection and the maximum page, only known if the store is read from a snapshot
+    collection_size: Optional[int] = None
+    max_page: Optional[int] = None
+    _docnos: Dict[int, int] = None
+
+    def __init__(self, connection: DBConnection):
+        self.dids = array('q')
+        self.pages = array('i')
+        self.dates = array('q')
+        self.lengths = array('i')
+        self.boosts = array('d')
+        try:
+            rows = connection.execute("""
+                SELECT boost.did, boost.page, boost.date, IFNULL(dls.len, 0), static_boosts.boost
+                FROM boost LEFT JOIN dls ON boost.did = dls.did JOIN static_boosts ON boost.did = static_boosts.did
+                ORDER BY boost.rowid
+            """).fetchall()
+        except sqlite3.OperationalError:
+            # databases created before the static_boosts table existed, compute the boosts on the fly
+            max_page = connection.execute("SELECT max_page FROM max_page").fetchone()[0]
+            rows = [(*row, static_boost(row[1], row[2], max_page)) for row in connection.execute("""
+                SELECT boost.did, boost.page, boost.date, IFNULL(dls.len, 0)
+                FROM boost LEFT JOIN dls ON boost.did = dls.did
+                ORDER BY boost.rowid
+            """)]
+        for did, page, date, length, boost in rows:
+            self.dids.append(did)
+            self.pages.append(page)
+            self.dates.append(date)
+            self.lengths.append(length)
+            self.boosts.append(boost)
+
+    @classmethod
+    def from_arrays(cls, dids: Sequence[int], pages: Sequence[int], dates: Sequence[int], lengths: Sequence[int],
+                    boosts: Sequence[float], collection_size: int = None, max_page: int = None) -> "DocumentStore":
+        """Return a store of the given attributes indexed by docno, e.g. views of a snapshot file"""
+        store = cls.__new__(cls)
+        store.dids, store.pages, store.dates, store.lengths, store.boosts = dids, pages, dates, lengths, boosts
+        store.collection_size, store.max_page = collection_size, max_page
+        return store
+
+    def __len__(self):
+        return len(self.dids)
+
+    @property
+    def docnos(self) -> Dict[int, int]:
+        """Maps every did to its docno, built on first use, as answering queries doesn't need it"""
+        if self._docnos is None:
+            self._docnos = {did: docno for docno, did in enumerate(self.dids)}
+        return self._docnos
+
+    def docno(self, did: int) -> int:
+        """Return the document number of a document id"""
+        return self.docnos[did]
+
+    def did(self, docno: int) -> int:
+        """Return the document id of a document number"""
+        return self.dids[docno]
@@ -0,0 +1,208 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from heapq import merge
+from math import ceil, log
+from typing import List, Sequence, Tuple
+
+from db import get_index_version, get_segments
+from doc_store import DocumentStore
+from posting_list import (DEFAULT_WEIGHTS, WEIGHTED_TF, DBConnection, FieldWeights, InvertedIndex, Posting,
+                          PostingCursor, np)
+from term_dictionary import TermDictionary
+
+IMPACTS_NAME = "nyt.impacts"
+LEVELS = 255  # number of quantized impact levels
+
+# File layout:
+#   header | term 0 | term 1 | ... | dictionary
+# The impact of a posting is its contribution to the score of a document, tf * idf * static boost. It is quantized
+# into one of LEVELS levels relative to the largest impact of the collection, max_impact. The tfs are weighted with the
+# FieldWeights the file was written for, so it has to be written again to use other weights.
+# Every term consists of a segment table with one (level, number of postings, offset) entry per level that occurs
+# in its posting list, ordered by descending level, followed by the segments. A segment stores the docnos of its
+# postings as an array of 4 byte integers and their tfs as an array of doubles. The docnos are sorted, so they can be
+# searched without decoding.
+# The dictionary at the end holds one fixed size entry per tid, the offset of the segment table of the term, its df
+# and its number of segments, so the entry of a term is found at its tid. Terms without postings have a df of 0.
+_MAGIC = b"ZWOI"
+_VERSION = 3
+# magic, version, number of entries, dictionary offset, index version, max_impact, content, title and abstract weight
+_HEADER = struct.Struct("<4sIIQqdddd")
+_SEGMENT = struct.Struct("<III")  # level, number of postings, offset of the segment relative to the end of the table
+_ENTRY = struct.Struct("<QII")  # offset of the term, df, number of segments
+_SWAP = sys.byteorder == "big"  # the file is always little endian
+
+
+def _max_impact(terms: TermDictionary, size: int, weights: FieldWeights) -> float:
+    """Return an upper bound of tf * idf * static boost of all postings, using the max impacts of the terms"""
+    return max((log(size / df) * terms.max_impact(tid, weights) for tid, df in enumerate(terms.dfs) if df), default=0.0)
+
+
+def _encode_term(postings: List[Tuple[int, int, float]]) -> Tuple[bytes, int]:
+    """Encodes the (level, docno, tf) triples of a single term, grouped into one segment per level"""
+    postings.sort(key=lambda p: (-p[0], p[1]))
+    table = []
+    segments = []
+    size = 0
+    start = 0
+    while start < len(postings):
+        level = postings[start][0]
+        end = start
+        while end < len(postings) and postings[end][0] == level:
+            end += 1
+        docnos = array("I", (docno for _, docno, _ in postings[start:end]))
+        tfs = array("d", (tf for _, _, tf in postings[start:end]))
+        if _SWAP:
+            docnos.byteswap()
+            tfs.byteswap()
+        table.append(_SEGMENT.pack(level, end - start, size))
+        segments.append(docnos.tobytes() + tfs.tobytes())
+        size += len(segments[-1])
+        start = end
+    return b"".join(table) + b"".join(segments), len(table)
+
+
+def write_impact_index(connection: DBConnection, path: str = IMPACTS_NAME, store: DocumentStore = None,
+                       terms: TermDictionary = None, weights: FieldWeights = DEFAULT_WEIGHTS) -> None:
+    """Writes the impact ordered index of all complete segments of the db, with tfs weighted by the given weights.
+    The impacts depend on the dfs and the size of the collection, so the file is tied to the current index version."""
+    print(f"\n[-] writing impact ordered index {path}", end="")
+    store = store if store is not None else DocumentStore(connection)
+    terms = terms if terms is not None else TermDictionary(connection)
+    docnos, boosts = store.docnos, store.boosts
+    size = connection.execute("SELECT size FROM d").fetchone()[0]
+    max_impact = _max_impact(terms, size, weights)
+    version = get_index_version(connection)
+    tables = [table for segment, table, segment_version in get_segments(connection)
+              if segment_version is not None or segment == 0]
+    union = " UNION ALL ".join(f"SELECT tid, did, {WEIGHTED_TF} AS tf FROM {table}" for table in tables)
+    dictionary = bytearray(len(terms) * _ENTRY.size)
+    with open(path + ".tmp", "wb") as output:
+        output.write(_HEADER.pack(_MAGIC, _VERSION, 0, 0, version, max_impact, *weights))
+        current_tid = None
+        postings = []
+
+        def flush():
+            data, segments = _encode_term(postings)
+            _ENTRY.pack_into(dictionary, current_tid * _ENTRY.size, output.tell(), len(postings), segments)
+            output.write(data)
+
+        for tid, did, tf in connection.execute(f"SELECT tid, did, tf FROM ({union}) ORDER BY tid",
+                                               weights * len(tables)):
+            if tid != current_tid:
+                if postings:
+                    flush()
+                current_tid = tid
+                postings = []
+                term_specific_constant = log(size / terms.dfs[tid])
+            docno = docnos[did]
+            impact = tf * term_specific_constant * boosts[docno]
+            level = min(LEVELS, max(1, ceil(impact / max_impact * LEVELS))) if max_impact > 0 else 1
+            postings.append((level, docno, tf))
+        if postings:
+            flush()
+
+        dictionary_offset = output.tell()
+        output.write(dictionary)
+        output.seek(0)
+        output.write(_HEADER.pack(_MAGIC, _VERSION, len(terms), dictionary_offset, version, max_impact, *weights))
+    os.replace(path + ".tmp", path)
+    print(f"\r[+] writing impact ordered index {path}")
+
+
+class ImpactOrderedIndex(InvertedIndex):
+    """Inverted index reading the posting lists grouped by descending impact from a memory mapped impact file.
+
+    Score-at-a-time query processing reads the segments of the highest impacts first, see
+    QueryProcessor.process_impact_ordered. The plain posting lists are available as well, merged from the segments.
+    The entries of the terms are looked up by their tids in the TermDictionary of the db the file was written from.
+    """
+    max_impact: float
+
+    def __init__(self, connection: DBConnection, path: str = IMPACTS_NAME, store: DocumentStore = None,
+                 terms: TermDictionary = None):
+        super().__init__(connection, store, terms=terms)
+        with open(path, "rb") as input_:
+            self.mm = mmap.mmap(input_.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.entries, self.dictionary_offset, index_version, self.max_impact, *weights = \
+            _HEADER.unpack_from(self.mm, 0)
+        self.weights = FieldWeights(*weights)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not an impact ordered index of version {_VERSION}")
+        if index_version != get_index_version(connection):
+            # the dfs and boosts the impacts were computed from changed
+            raise ValueError(f"{path} was written for an older version of the index")
+
+    def close(self) -> None:
+        self.mm.close()
+
+    def weigh(self, weights: FieldWeights) -> None:
+        if weights != self.weights:
+            raise ValueError("the impact ordered index was written for other field weights")
+
+    def bound(self, level: int) -> float:
+        """Return the upper bound of the impacts of a level"""
+        # the margin makes sure rounding never turns the upper bound into something smaller than a real impact
+        return level * self.max_impact / LEVELS * (1 + 1e-9)
+
+    def getSegments(self, term: str) -> List[Tuple[int, Sequence[int], Sequence[int]]]:
+        """Return the (level, docnos, tfs) segments of a term ordered by descending level.
+        The docnos of a segment are sorted, docnos and tfs are read straight from the mapped file."""
+        try:
+            tid = self.terms.tid(term)
+        except KeyError:
+            return []
+        if tid >= self.entries:
+            return []  # added to the db after the file was written
+        offset, df, segments = _ENTRY.unpack_from(self.mm, self.dictionary_offset + tid * _ENTRY.size)
+        if not df:
+            return []
+        self.profiler.count("posting lists")
+        start = offset + segments * _SEGMENT.size
+        result = []
+        for level, count, segment_offset in _SEGMENT.iter_unpack(self.mm[offset:start]):
+            position = start + segment_offset
+            result.append((level, self._view("I", position, count), self._view("d", position + 4 * count, count)))
+        return result
+
+    def _view(self, typecode: str, position: int, count: int) -> Sequence:
+        size = count * array(typecode).itemsize
+        if _SWAP:
+            values = array(typecode, self.mm[position:position + size])
+            values.byteswap()
+            return values
+        return memoryview(self.mm)[position:position + size].cast(typecode)
+
+    def readIndexList(self, term: str) -> List[Posting]:
+        segments = [zip(docnos, tfs) for _, docnos, tfs in self.getSegments(term)]
+        return [Posting(docno, tf) for docno, tf in merge(*segments)]
+
+    def readIndexArrays(self, term: str) -> Tuple["np.ndarray", "np.ndarray"]:
+        segments = self.getSegments(term)
+        docnos = np.array([docno for _, segment, _ in segments for docno in segment], dtype=np.int64)
+        tfs = np.array([tf for _, _, segment in segments for tf in segment], dtype=np.float64)
+        order = np.argsort(docnos, kind="stable")
+        return docnos[order], tfs[order]
+
+    def readCursor(self, term: str) -> PostingCursor:
+        postings = self.readIndexList(term)
+        return PostingCursor([p.docno for p in postings], [p.tf for p in postings])
+
+
+def open_impact_index(connection: DBConnection, store: DocumentStore = None, terms: TermDictionary = None,
+                      weights: FieldWeights = DEFAULT_WEIGHTS) -> "ImpactOrderedIndex":
+    """Open the impact ordered index, None if it has not been written for the current version of the index and the
+    given weights"""
+    if not os.path.isfile(IMPACTS_NAME):
+        return None
+    try:
+        index = ImpactOrderedIndex(connection, IMPACTS_NAME, store, terms)
+    except ValueError:
+        return None
+    if index.weights != weights:
+        index.close()
+        return None
+    return index
@@ -1,12 +1,31 @@
 import os
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
 from pathlib import Path
-from typing import List
+from typing import Iterable, Iterator, List, Tuple
 from parser import Parser, Document
 
+Record = Tuple[Tuple, Tuple, List[Tuple]]
+
+
+def _parse_records(paths: List[Path]) -> List[Record]:
+    """Parses a chunk of xml files into records, runs inside the worker processes"""
+    return [Parser.parse(p).convert_to_record() for p in paths]
+
 
 class Importer:
     """Importer class used for finding all xml files in a given directory"""
 
+    @staticmethod
+    def iter_dir(path: str) -> Iterator[Path]:
+        """Lazily yields the paths of all xml files in a directory and all its subdirectories"""
+        for dirname, _, files in os.walk(path):
+            for f in files:
+                p = Path(dirname).joinpath(f)
+                if p.suffix == ".xml":
+                    yield p
+
     @staticmethod
     def import_dir(path: str) -> List[Document]:
         """
@@ -16,10 +35,38 @@ class Importer:
         :return: a list with all paths of xml files
         """
         results: List[Document] = []
-        for dirname, _, files in os.walk(path):
-            for f in files:
-                p = Path(dirname).joinpath(f)
-                if p.suffix == ".xml":
-                    print(f"File: {p} with size {p.stat().st_size} bytes")
-                    results.append(Parser.parse(p))  # we don't insert them right now, we insert them in chunks later
+        for p in Importer.iter_dir(path):
+            print(f"File: {p} with size {p.stat().st_size} bytes")
+            results.append(Parser.parse(p))  # we don't insert them right now, we insert them in chunks later
         return results
+
+    @staticmethod
+    def stream_dir(path: str, processes: int = None, chunksize: int = 64) -> Iterator[Record]:
+        """
+        Parses all xml files in a directory and all its subdirectories with a pool of worker processes
+        and yields one record per document, see Document.convert_to_record.
+        Only a few chunks per worker are in flight at any time, so the memory stays bounded
+        no matter how many files there are.
+        :param path: a directory
+        :param processes: number of worker processes, defaults to the number of cores
+        :param chunksize: number of files a worker parses per task
+        """
+        return Importer.stream_paths(Importer.iter_dir(path), processes, chunksize)
+
+    @staticmethod
+    def stream_paths(paths: Iterable[Path], processes: int = None, chunksize: int = 64) -> Iterator[Record]:
+        """Parses the given xml files with a pool of worker processes like stream_dir, e.g. a part of a directory"""
+        processes = processes or os.cpu_count() or 1
+        paths = iter(paths)
+        with Pool(processes) as pool:
+            max_pending = 2 * processes
+            pending = deque()
+            while True:
+                while len(pending) < max_pending:
+                    chunk = list(islice(paths, chunksize))
+                    if not chunk:
+                        break
+                    pending.append(pool.apply_async(_parse_records, (chunk,)))
+                if not pending:
+                    break
+                yield from pending.popleft().get()
@@ -2,9 +2,8 @@ import re
 import xml.etree.ElementTree as XML
 from collections import Counter
 from dataclasses import dataclass
-from typing import Sequence, Union, Iterable, Tuple, List
+from typing import Sequence, Optional, Tuple, List
 from pathlib import Path
-import constants
 
 
 @dataclass
@@ -14,7 +13,7 @@ class Document:
     title: str
     url: str
     abstract: str
-    content: Sequence[str]
+    content: Sequence[str]  # the paragraphs of the full text
     content_counter: Counter
     title_counter: Counter
     abstract_counter: Counter
@@ -28,9 +27,7 @@ class Document:
         self.abstract = abstract
         self.content = content
         # count term frequencies on initialization, saving us a lot of time later.
-        self.content_counter = Counter(self.content)
-        self.title_counter = Counter(Parser.tokenize([self.title]))
-        self.abstract_counter = Counter(Parser.tokenize([self.abstract]))
+        self.content_counter, self.title_counter, self.abstract_counter = Parser.count_terms(content, title, abstract)
         self.date = int(date.replace("T", ""))
         self.page = int(page)
 
@@ -42,12 +39,17 @@ class Document:
         """Converts the document into a tuple, ready to be inserted into the docs table"""
         return self.id, self.title, self.url
 
-    def get_tfs_rows(self) -> Iterable:
-        """Returns all rows for the tfs table of this document"""
-        for term in self.content_counter.keys():
-            yield (self.id, term, self.content_counter[term] * constants.TUNABLE_WEIGHT_CONTENT +
-                   self.title_counter[term] * constants.TUNABLE_WEIGHT_TITLE + self.abstract_counter[
-                       term] * constants.TUNABLE_WEIGHT_ABSTRACT)
+    def convert_to_record(self) -> Tuple[Tuple, Tuple, List[Tuple]]:
+        """Converts the document into a compact record of its docs row, its boost row and its tfs rows.
+        Unlike the document itself, the record holds no tokens or counters, so it is cheap to keep and to pickle."""
+        return self.convert_to_tuple(), (self.id, self.date, self.page), self.get_tfs_rows()
+
+    def get_tfs_rows(self) -> List[Tuple]:
+        """Returns all rows for the tfs table of this document, every row holds the tfs of the term in the content,
+        the title and the abstract. The field weights are only applied at query time, see FieldWeights."""
+        # Counter.get skips the __missing__ call of Counter[term] for the terms that are not in the title or abstract
+        id_, title, abstract = self.id, self.title_counter.get, self.abstract_counter.get
+        return [(id_, term, tf, title(term, 0), abstract(term, 0)) for term, tf in self.content_counter.items()]
 
 
 class Parser:
@@ -57,18 +59,21 @@ class Parser:
     # such as full stops, non - alphanumeric characters etc. Next, we use a negative lookbehind to find acronyms and
     # exclude them from the matches. An acronym as consisting at least two upper or lowercase characters, each followed
     # by a dot, followed by a whitespace.
-    __TOKENIZE_REGEX = r'[^a-zA-Z0-9 ]+(?<!( |\.)[a-zA-Z]\.)'
+    __TOKENIZE_REGEX = r'[^a-zA-Z0-9 ]+(?<!(?: |\.)[a-zA-Z]\.)'
     __COMPILED_REGEX = re.compile(__TOKENIZE_REGEX)
+    # Joins the paragraphs, so they are cleaned in one go. The NUL character is removed like any other punctuation,
+    # but keeps the lookbehind from seeing the end of the previous paragraph, just like at the start of a string.
+    __PARAGRAPH_SEPARATOR = " \x00"
+    # Joins the fields of a document, so they are cleaned in one go as well. The group separator can't occur in xml,
+    # so it is left out of the characters to remove and the cleaned text is split into the fields at it again.
+    # Like the NUL character, it keeps the lookbehind from seeing the end of the previous field.
+    __FIELD_SEPARATOR = " \x1d"
+    __FIELDS_REGEX = re.compile(r'[^a-zA-Z0-9 \x1d]+(?<!(?: |\.)[a-zA-Z]\.)')
 
     @staticmethod
     def parse(path: Path) -> Document:
-        """Takes a XML Document and parses it to a Document. Performs tokenization for the content as well"""
-        with path.open('r') as input_:
-            prospective_doc = _nytcorpus_to_document(XML.parse(input_))
-
-        content = Parser.tokenize(prospective_doc[3])
-        return Document(prospective_doc[0], prospective_doc[1], prospective_doc[2], content, prospective_doc[4],
-                        prospective_doc[5], prospective_doc[6])
+        """Takes a XML Document and parses it to a Document, which counts the terms of its fields"""
+        return Document(*_nytcorpus_to_document(path))
 
     @staticmethod
     def tokenize(content: List[str]) -> List[str]:
@@ -76,35 +81,83 @@ class Parser:
 
         # Replace non alphanumeric while keeping abbreviations with whitespace.
         # Uses a "negative" regex, matching only the things that need to be removed,
-        # instead of finding the things to keep.
-        cleaned = (re.sub(Parser.__COMPILED_REGEX, " ", s) for s in content)
-        # Lowercase and split at whitespace.
-        return ' '.join([par.lower() for par in cleaned]).split()
+        # instead of finding the things to keep. All paragraphs are cleaned, lowercased and split in a single pass,
+        # the tokens are the same as the ones of every paragraph on its own.
+        cleaned = Parser.__COMPILED_REGEX.sub(" ", Parser.__PARAGRAPH_SEPARATOR.join(content))
+        # Lowercase and split at whitespace. Only ascii characters are left, so lowercasing can't add any.
+        return cleaned.lower().split()
 
-
-def _nytcorpus_to_document(root: Union[XML.Element, XML.ElementTree]) -> Tuple[int, str, str, List[str], str, str, int]:
+    @staticmethod
+    def count_terms(content: List[str], title: str, abstract: str) -> Tuple[Counter, Counter, Counter]:
+        """Returns the term counts of the paragraphs of the content, the title and the abstract of a document.
+        All fields are cleaned, lowercased and split in a single pass, the terms are the same as the ones of tokenize.
+        Counter counts the terms in C straight from the split, so no Python code runs per term."""
+        text = Parser.__FIELD_SEPARATOR.join((Parser.__PARAGRAPH_SEPARATOR.join(content), title, abstract))
+        content, title, abstract = Parser.__FIELDS_REGEX.sub(" ", text).lower().split("\x1d")
+        return Counter(content.split()), Counter(title.split()), Counter(abstract.split())
+
+
+# the xml is fed to the parser in chunks of this many bytes
+_CHUNK_SIZE = 1 << 16
+
+
+def _nytcorpus_elements(path: Path) -> Tuple[Optional[XML.Element], Optional[XML.Element], Optional[List[str]]]:
+    """Streams the xml of a news article through an incremental parser and extracts the head element, the first
+    paragraph of the abstracts and the paragraphs of the full text, as soon as their elements are complete.
+    The elements of the body are cleared once they are read, the lead paragraphs and everything else are dropped
+    right away. None for a missing head, abstract or body."""
+    parser = XML.XMLPullParser(events=("end",))
+    head = abstract = None
+    content = []
+    body = False
+    with path.open("rb") as input_:
+        for chunk in iter(lambda: input_.read(_CHUNK_SIZE), b""):
+            parser.feed(chunk)
+            for _, element in parser.read_events():
+                tag = element.tag
+                if tag == "body.content":
+                    content.extend(par.text for block in element if block.get("class") == "full_text"
+                                   for par in block.findall("p"))
+                    element.clear()
+                elif tag == "body.head":
+                    if abstract is None:
+                        # just like the XPath ./body.head/abstract/p over all body.heads
+                        abstract = next((par for section in element.findall("abstract")
+                                         for par in section.findall("p")), None)
+                    element.clear()
+                elif tag == "body":
+                    body = True
+                    element.clear()
+                elif tag == "head" and head is None:
+                    head = element
+    parser.close()
+    return head, abstract, content if body else None
+
+
+def _nytcorpus_to_document(path: Path) -> Tuple[int, str, str, List[str], str, str, int]:
     """ Simple XML parsing function that extracts our Document object from a given news article.
 
         The content field of the returned document will not be tokenized.
         They are still a Sequence of strings, each string representing a new paragraph.
+        Only children are looked up by their tag, which doesn't need the slow XPath implementation of ElementTree.
     """
     from sys import stderr
-    head = root.find("./head")
-    body = root.find("./body")
-    docdata = head.find("./docdata")
-    pubdata = head.find("./pubdata")
+    head, abstract, content = _nytcorpus_elements(path)
     id_ = "-1"  # fallback value
     date = ""
     page = -1
     try:
-        id_ = docdata.find("./doc-id").get('id-string')
-        title = head.find("./title")
+        docdata = head.find("docdata")
+        pubdata = head.find("pubdata")
+        id_ = docdata.find("doc-id").get('id-string')
+        title = head.find("title")
         if title is None:
             print("Document {} had no title.".format(id_), file=stderr)
             title = "NO TITLE FOUND"
         else:
             title = title.text
-        abstract = body.find("./body.head/abstract/p")
+        if content is None:
+            raise AttributeError("the article has no body")
         if abstract is None:
             abstract = ""
         else:
@@ -113,15 +166,9 @@ def _nytcorpus_to_document(root: Union[XML.Element, XML.ElementTree]) -> Tuple[i
                 abstract = ""
         url = pubdata.get('ex-ref')
         date = pubdata.get("date.publication")
-        try:
-            page = int(head.find("./meta[@name='print_page_number']").get("content"))
-        except AttributeError:
-            page = 100
-        # Already cleans out all the HTML Elements
-        content = [*[par.text for par in body.findall(
-            "./body.content/*[@class='full_text']/p")]]  # , *
-        #  [par.text for par in body.findall(
-        #     "./body.content/*[@class='lead_paragraph']/p")]]
+        page = next((int(meta.get("content")) for meta in head.findall("meta")
+                     if meta.get("name") == "print_page_number"), 100)
+        # the lead_paragraph blocks are left out, the HTML Elements are cleaned out already
     except AttributeError as attr:
         # We can't do much if finding a url or the content fails.
         print("Attribute error for document ID: " + id_, file=stderr)
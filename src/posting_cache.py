@@ -0,0 +1,134 @@
+import heapq
+import threading
+from array import array
+from collections import defaultdict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+Postings = Tuple[array, array]  # the docnos ('q') and the tfs ('d') of a whole posting list
+
+# rough size of the bookkeeping of an entry besides its arrays, so many tiny lists can't exceed the budget either
+_ENTRY_OVERHEAD = 256
+
+
+def postings_size(postings: Postings) -> int:
+    """Return the number of bytes a posting list takes in the cache"""
+    docnos, tfs = postings
+    return docnos.itemsize * len(docnos) + tfs.itemsize * len(tfs) + _ENTRY_OVERHEAD
+
+
+class PostingCache:
+    """Memory bounded cache of whole posting lists, which can be shared by several indexes and threads.
+
+    The posting lists take at most budget bytes. Every list is worth its length times the number of times its term
+    was looked up, i.e. roughly the work it saves. If a new list doesn't fit, the lists worth the least are evicted,
+    but only if they are worth less than the new one, otherwise the new one is not cached. Pinned lists are never
+    evicted. The tfs are already weighted, so the lists are cached per term and field weights.
+    """
+    budget: int
+    size: int
+    entries: Dict[Tuple[str, Hashable], Postings]
+    frequencies: Dict[str, int]
+    pinned: set
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.size = 0
+        self.entries = dict()
+        self.frequencies = defaultdict(int)
+        self.pinned = set()
+        # min heap of (worth, key) of the entries that can be evicted, worths only grow, so outdated ones are smaller
+        self.heap: List[Tuple[int, Tuple[str, Hashable]]] = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _worth(self, key: Tuple[str, Hashable]) -> int:
+        return len(self.entries[key][0]) * self.frequencies[key[0]]
+
+    def get(self, term: str, weights: Hashable) -> Optional[Postings]:
+        """Return the cached posting list of a term for the given weights, None if it is not cached.
+        Every call counts as a look up of the term, cached or not."""
+        with self.lock:
+            self.frequencies[term] += 1
+            postings = self.entries.get((term, weights))
+            if postings is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return postings
+
+    def admits(self, term: str, length: int) -> bool:
+        """Return whether a posting list of the given length would be cached now, without reading it first"""
+        with self.lock:
+            needed = 16 * length + _ENTRY_OVERHEAD
+            if needed > self.budget:
+                return False
+            if self.size + needed <= self.budget:
+                return True
+            # the top of the heap may be outdated, but never worth more than the entry really is
+            return bool(self.heap) and self.heap[0][0] < length * self.frequencies[term]
+
+    def put(self, term: str, weights: Hashable, postings: Postings, pin: bool = False) -> bool:
+        """Cache the posting list of a term for the given weights, evicting the lists worth less than it if needed.
+        Pinned lists are never evicted, they are only cached if they fit into the free space.
+        Returns whether the list is cached."""
+        key = (term, weights)
+        needed = postings_size(postings)
+        with self.lock:
+            if key in self.entries:
+                return True
+            if self.size + needed > self.budget and (pin or not self._evict(needed, len(postings[0]) *
+                                                                            self.frequencies[term])):
+                return False
+            self.entries[key] = postings
+            self.size += needed
+            if pin:
+                self.pinned.add(key)
+            else:
+                heapq.heappush(self.heap, (self._worth(key), key))
+            return True
+
+    def _evict(self, needed: int, worth: int) -> bool:
+        """Evicts the entries worth the least until needed bytes are free, if they are all worth less than worth"""
+        victims = []
+        freed = 0
+        while self.size - freed + needed > self.budget:
+            if not self.heap:
+                break
+            entry_worth, key = heapq.heappop(self.heap)
+            if key not in self.entries:
+                continue  # evicted already
+            if entry_worth != self._worth(key):
+                heapq.heappush(self.heap, (self._worth(key), key))
+                continue
+            if entry_worth >= worth:
+                heapq.heappush(self.heap, (entry_worth, key))
+                break
+            victims.append((entry_worth, key))
+            freed += postings_size(self.entries[key])
+        if self.size - freed + needed > self.budget:
+            for victim in victims:
+                heapq.heappush(self.heap, victim)
+            return False
+        for _, key in victims:
+            self.size -= postings_size(self.entries.pop(key))
+        self.evictions += len(victims)
+        return True
+
+    def clear(self) -> None:
+        """Drop all posting lists, the pinned ones as well"""
+        with self.lock:
+            self.entries.clear()
+            self.pinned.clear()
+            self.heap.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"lists": len(self.entries), "pinned": len(self.pinned), "bytes": self.size, "budget": self.budget,
+                "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions}
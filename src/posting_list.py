@@ -1,42 +1,225 @@
 import sqlite3
+import sys
 import heapq
+from array import array
+from bisect import bisect_left
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import constants
+from doc_store import DocumentStore
+from posting_cache import PostingCache, Postings
+from profiling import NULL_PROFILER, Profiler
+from snapshot import write_snapshot
+from term_dictionary import TermDictionary
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the vectorized query processing
+    np = None
 
 DBConnection = sqlite3.Connection
+END = sys.maxsize  # docno of an exhausted PostingCursor
+WEIGHTED_TF = "content_tf * ? + title_tf * ? + abstract_tf * ?"  # sql of the tf, the FieldWeights are its parameters
+
+
+class FieldWeights(NamedTuple):
+    """Weights of the fields of a document. The tf of a posting is the weighted sum of the tfs of its fields,
+    computed whenever a posting list is read, so the weights can be changed without building the index again."""
+    content: float
+    title: float
+    abstract: float
+
+
+DEFAULT_WEIGHTS = FieldWeights(constants.TUNABLE_WEIGHT_CONTENT, constants.TUNABLE_WEIGHT_TITLE,
+                               constants.TUNABLE_WEIGHT_ABSTRACT)
 
 
 @dataclass(order=True, frozen=True)
 class Posting:
-    """Definition of a single posting"""
-    did: int
+    """Definition of a single posting. The document is referenced by its docno in the DocumentStore."""
+    docno: int
     tf: int = field(compare=False)
-    page: int = field(compare=False)
-    date: int = field(compare=False)
 
     def __repr__(self):
-        return f'{self.did}|{self.tf}'
+        return f'{self.docno}|{self.tf}'
+
+
+class PostingCursor:
+    """Cursor over a docno sorted posting list, used for document-at-a-time query processing.
+    The cursor starts on the first posting, docno and tf always describe the current posting."""
+    docno: int
+    tf: int
+
+    def __init__(self, docnos: Sequence[int], tfs: Sequence[int]):
+        self.docnos = docnos
+        self.tfs = tfs
+        self.position = -1
+        self.next()
+
+    def next(self) -> int:
+        """Moves to the next posting and returns its docno"""
+        self.position += 1
+        if self.position < len(self.docnos):
+            self.docno = self.docnos[self.position]
+            self.tf = self.tfs[self.position]
+        else:
+            self.docno = END
+            self.tf = 0
+        return self.docno
+
+    def advance(self, target: int) -> int:
+        """Moves to the first posting with a docno >= target and returns its docno.
+        Gallops ahead in steps of doubling size first, so targets close to the current posting are found quickly."""
+        if self.docno >= target:
+            return self.docno
+        low = self.position + 1
+        step = 1
+        high = low
+        while high < len(self.docnos) and self.docnos[high] < target:
+            low = high + 1
+            high += step
+            step *= 2
+        self.position = bisect_left(self.docnos, target, low, min(high, len(self.docnos))) - 1
+        return self.next()
 
 
 class InvertedIndex:
     connection: DBConnection
+    store: DocumentStore
+    terms: TermDictionary
+    table: str
+    profiler: Profiler = NULL_PROFILER
+    weights: FieldWeights = DEFAULT_WEIGHTS
+    cache: PostingCache = None
 
-    def __init__(self, connection: DBConnection):
+    def __init__(self, connection: DBConnection, store: DocumentStore = None, table: str = "tfs",
+                 terms: TermDictionary = None):
         self.connection = connection
+        self.store = store if store is not None else DocumentStore(connection)
+        self.terms = terms if terms is not None else TermDictionary(connection)
+        self.table = table  # the tfs table of the segment to read the posting lists from
+
+    def profile(self, profiler: Profiler) -> None:
+        """Record counters like the number of fetched posting lists with the given profiler"""
+        self.profiler = profiler
+
+    def weigh(self, weights: FieldWeights) -> None:
+        """Weigh the field tfs of the postings with the given weights from now on"""
+        self.weights = weights
+
+    def cachePostings(self, cache: PostingCache) -> None:
+        """Serve the posting lists from the given cache from now on. The lists that are not cached yet are added
+        when they are read, if they are worth more than the ones they would push out."""
+        self.cache = cache
+
+    def pinPostings(self, count: int) -> int:
+        """Read the posting lists of the count terms with the highest dfs into the cache and keep them there for good,
+        as long as they fit. Returns the number of pinned lists."""
+        pinned = 0
+        for tid in heapq.nlargest(count, range(len(self.terms)), key=self.terms.dfs.__getitem__):
+            if self.terms.dfs[tid] and self.cache.put(self.terms.terms[tid], self.weights,
+                                                      self.readPostings(self.terms.terms[tid]), pin=True):
+                pinned += 1
+        return pinned
+
+    def _cached(self, term: str) -> Optional[Postings]:
+        """Return the posting list of a term from the cache, reading it into the cache first if it is worth it.
+        None if there is no cache or the list is not worth caching."""
+        cache = self.cache
+        if cache is None:
+            return None
+        postings = cache.get(term, self.weights)
+        if postings is not None:
+            self.profiler.count("posting cache hits")
+            return postings
+        self.profiler.count("posting cache misses")
+        tid = self.terms.tids.get(term)
+        if tid is None or not cache.admits(term, self.terms.dfs[tid]):
+            return None
+        postings = self.readPostings(term)
+        cache.put(term, self.weights, postings)
+        return postings
 
     def getIndexList(self, term: str) -> List[Posting]:
+        postings = self._cached(term)
+        if postings is None:
+            return self.readIndexList(term)
+        return [Posting(docno, tf) for docno, tf in zip(*postings)]
+
+    def getIndexArrays(self, term: str) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Return the posting list of a term as two parallel numpy arrays of docnos and tfs, sorted by docno"""
+        postings = self._cached(term)
+        if postings is None:
+            return self.readIndexArrays(term)
+        return np.frombuffer(postings[0], dtype=np.int64), np.frombuffer(postings[1], dtype=np.float64)
+
+    def getCursor(self, term: str) -> PostingCursor:
+        """Return a cursor over the posting list of a term"""
+        postings = self._cached(term)
+        if postings is None:
+            return self.readCursor(term)
+        return PostingCursor(*postings)
+
+    def getPostings(self, term: str) -> Postings:
+        """Return the posting list of a term as two parallel arrays of docnos and tfs, sorted by docno"""
+        postings = self._cached(term)
+        if postings is None:
+            return self.readPostings(term)
+        return postings
+
+    def readPostings(self, term: str) -> Postings:
+        """Read the whole posting list of a term from the index, bypassing the cache"""
+        if np is not None:
+            docnos, tfs = self.readIndexArrays(term)
+            return array("q", docnos.astype(np.int64).tobytes()), array("d", tfs.astype(np.float64).tobytes())
+        postings = self.readIndexList(term)
+        return array("q", [p.docno for p in postings]), array("d", [p.tf for p in postings])
+
+    def readIndexList(self, term: str) -> List[Posting]:
         h = []
-        for did, tf in self.connection.execute("SELECT did, tf FROM tfs where term = ?", (term,)):
-            heapq.heappush(h, Posting(did, tf, self.getPage(did), self.getDate(did)))
+        docnos = self.store.docnos
+        # unknown terms have no tid, which matches no row
+        tid = self.terms.tids.get(term)
+        for did, tf in self.connection.execute(f"SELECT did, {WEIGHTED_TF} FROM {self.table} where tid = ?",
+                                               (*self.weights, tid)):
+            heapq.heappush(h, Posting(docnos[did], tf))
+        self.profiler.count("posting lists")
 
         return [heapq.heappop(h) for _ in range(len(h))]
 
+    def readIndexArrays(self, term: str) -> Tuple["np.ndarray", "np.ndarray"]:
+        docnos = self.store.docnos
+        tid = self.terms.tids.get(term)
+        rows = self.connection.execute(f"SELECT did, {WEIGHTED_TF} FROM {self.table} where tid = ?",
+                                       (*self.weights, tid)).fetchall()
+        self.profiler.count("posting lists")
+        docno_array = np.fromiter((docnos[did] for did, _ in rows), dtype=np.int64, count=len(rows))
+        tf_array = np.fromiter((tf for _, tf in rows), dtype=np.float64, count=len(rows))
+        order = np.argsort(docno_array, kind="stable")
+        return docno_array[order], tf_array[order]
+
+    def readCursor(self, term: str) -> PostingCursor:
+        postings = self.readIndexList(term)
+        return PostingCursor([p.docno for p in postings], [p.tf for p in postings])
+
+    def getMaxImpact(self, term: str) -> float:
+        """Return the maximum tf * static boost of all postings of a term, an upper bound for its score divided by idf.
+        The bound holds for any weights, but it is only exact for the weights in constants.py at indexing time."""
+        if self.terms.max_impacts is None:
+            raise sqlite3.OperationalError("no such table: max_impacts")
+        return self.terms.max_impact(self.terms.tid(term), self.weights)
+
     def getDF(self, term: str) -> int:
-        """Return the document frequency for a given term."""
-        r = self.connection.execute("""
-            SELECT df from dfs WHERE term = ?
-        """, (term,))
-        return int(r.fetchone()[0])
+        """Return the document frequency for a given term, looked up in the TermDictionary."""
+        try:
+            df = self.terms.dfs[self.terms.tid(term)]
+        except KeyError:
+            df = 0
+        if not df:
+            # the dfs table used to fail on unknown terms with a TypeError, callers rely on that
+            raise TypeError(f"unknown term {term}")
+        return df
 
     def getPage(self, did: int) -> int:
         """Return the page of a document"""
@@ -61,10 +244,11 @@ class InvertedIndex:
         return int(r.fetchone()[0])
 
 
-def create_indices(connection: DBConnection):
+def create_indices(connection: DBConnection, directory: str = ""):
+    """Creates the indices of the db and writes the snapshot of its statistics into the given directory"""
     print("\n[-] creating index tfs_idx", end="")
     connection.execute("""
-        CREATE INDEX tfs_idx ON tfs(term, did)
+        CREATE INDEX tfs_idx ON tfs(tid, did)
     """)
     print("\r[+] creating index tfs_idx")
     print("\n[-] creating index docs_idx", end="")
@@ -74,7 +258,7 @@ def create_indices(connection: DBConnection):
     print("\r[+] creating index docs_idx")
     print("\n[-] creating index dfs_idx", end="")
     connection.execute("""
-        CREATE INDEX dfs_idx ON dfs(term, df)
+        CREATE INDEX dfs_idx ON dfs(tid, df)
     """)
     print("\r[+] creating index dfs_idx")
     print("\n[-] creating index dls_idx", end="")
@@ -87,3 +271,4 @@ def create_indices(connection: DBConnection):
             CREATE INDEX boost_idx ON boost(did, date, page)
         """)
     print("\r[+] creating index boost_idx")
+    write_snapshot(connection, directory=directory)
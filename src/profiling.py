@@ -0,0 +1,140 @@
+import sqlite3
+import time
+from collections import defaultdict
+from typing import Dict
+
+DBConnection = sqlite3.Connection
+
+# order of the stages in the reports, stages not listed here are reported after them
+STAGES = ("tokenize", "filter", "cache", "df", "postings", "scoring", "top k", "metadata")
+
+
+class _Stage:
+    """Context manager adding the time spent inside it to a stage of a Profiler"""
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullProfiler:
+    """Profiler that records nothing, used when profiling is disabled. Every call is a no-op."""
+    enabled = False
+    _stage = _NullStage()
+
+    def begin(self) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+    def stage(self, name: str) -> _NullStage:
+        return self._stage
+
+    def count(self, name: str, n: int = 1) -> None:
+        pass
+
+    def trace(self, connection: DBConnection) -> None:
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Profiler(NullProfiler):
+    """Records the time spent in every stage of query processing and counters like the number of scored postings.
+
+    The stages and counters of the current query are kept in last, the ones of all queries since the creation of
+    the profiler are summed up in totals. A query starts with begin and ends with end.
+    """
+    enabled = True
+    last: Dict[str, float]
+    totals: Dict[str, float]
+    counters: Dict[str, int]
+    total_counters: Dict[str, int]
+    queries: int
+
+    def __init__(self):
+        self.last = defaultdict(float)
+        self.totals = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.total_counters = defaultdict(int)
+        self.queries = 0
+
+    def begin(self) -> None:
+        """Starts a new query, forgetting the stages and counters of the previous one"""
+        self.last.clear()
+        self.counters.clear()
+
+    def end(self) -> None:
+        self.queries += 1
+
+    def stage(self, name: str) -> _Stage:
+        """Return a context manager timing the code inside it as the given stage"""
+        return _Stage(self, name)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        self.last[name] += seconds
+        self.totals[name] += seconds
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+        self.total_counters[name] += n
+
+    def trace(self, connection: DBConnection) -> None:
+        """Counts every sql statement executed on the connection"""
+        connection.set_trace_callback(lambda _: self.count("sql statements"))
+
+    def merge(self, other: "Profiler") -> None:
+        """Adds the totals of another profiler to the totals of this one"""
+        self.queries += other.queries
+        # the other profiler may still be in use by another thread, so its totals are copied first
+        for name, seconds in list(other.totals.items()):
+            self.totals[name] += seconds
+        for name, n in list(other.total_counters.items()):
+            self.total_counters[name] += n
+
+    def stats(self) -> dict:
+        """Return the totals of all queries, e.g. for dumping them as json"""
+        return {
+            "queries": self.queries,
+            "stages_ms": {name: self.totals[name] * 1000 for name in _ordered(self.totals)},
+            "counters": dict(sorted(self.total_counters.items())),
+        }
+
+    def report(self, totals: bool = False) -> str:
+        """Return a human readable breakdown of the last query, or of all queries if totals is set"""
+        stages, counters = (self.totals, self.total_counters) if totals else (self.last, self.counters)
+        total = sum(stages.values())
+        lines = [f"{'stage':<16}{'ms':>10}{'%':>8}"]
+        for name in _ordered(stages):
+            lines.append(f"{name:<16}{stages[name] * 1000:>10.3f}{stages[name] / total * 100 if total else 0:>8.1f}")
+        lines.append(f"{'total':<16}{total * 1000:>10.3f}")
+        if totals:
+            lines.append(f"{'queries':<16}{self.queries:>10}")
+        for name, n in sorted(counters.items()):
+            lines.append(f"{name:<16}{n:>10}")
+        return "\n".join(lines)
+
+
+def _ordered(stages: Dict[str, float]):
+    return sorted(stages, key=lambda name: STAGES.index(name) if name in STAGES else len(STAGES))
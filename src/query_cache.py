@@ -0,0 +1,86 @@
+import os
+import pickle
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from db import DBConnection, get_index_version
+
+CACHE_NAME = "nyt.cache"
+CacheKey = Tuple[Tuple[str, ...], int, bool, Tuple[float, ...]]
+
+
+class QueryCache:
+    """Cache for query results, keyed by the tokenized query, k, whether all terms have to match and the field weights.
+
+    Holds at most max_size results and evicts the least recently used one first. Results older than ttl seconds
+    are treated as missing. All results are dropped as soon as the index version of the db changes, e.g. after a
+    re-ingest. If a path is given, the cache is loaded from it and can be written back with save.
+    """
+
+    def __init__(self, connection: DBConnection, max_size: int = 10000, ttl: float = None, path: str = None):
+        self.connection = connection
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.entries: "OrderedDict[CacheKey, Tuple[float, List[Tuple[int, float]]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.version = get_index_version(connection)
+        if path is not None and os.path.isfile(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, terms: List[str], k: int, conjunctive: bool = False,
+            weights: Tuple[float, ...] = ()) -> Optional[List[Tuple[int, float]]]:
+        """Return the cached (did, score) results for the query terms and k, None if they are not cached"""
+        self._validate()
+        key = (tuple(terms), k, conjunctive, tuple(weights))
+        entry = self.entries.get(key)
+        if entry is None or (self.ttl is not None and time.time() - entry[0] > self.ttl):
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, terms: List[str], k: int, results: List[Tuple[int, float]], conjunctive: bool = False,
+            weights: Tuple[float, ...] = ()) -> None:
+        """Cache the (did, score) results for the query terms and k"""
+        key = (tuple(terms), k, conjunctive, tuple(weights))
+        self.entries[key] = (time.time(), results)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0, "index_version": self.version}
+
+    def _validate(self) -> None:
+        version = get_index_version(self.connection)
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def load(self) -> None:
+        """Load the entries from the cache file, unless they belong to another index version"""
+        with open(self.path, "rb") as input_:
+            version, entries = pickle.load(input_)
+        if version == self.version:
+            self.entries = entries
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def save(self) -> None:
+        """Write the entries to the cache file"""
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as output:
+            pickle.dump((self.version, self.entries), output, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.path)
@@ -1,18 +1,30 @@
 import sqlite3
 import heapq
-from datetime import datetime
+from bisect import bisect_left
+from collections import deque
+from itertools import accumulate
 from math import log
-from typing import List
+from typing import List, Optional
 from dataclasses import dataclass, field
 
-from constants import ADDITIVE_CONSTANT_DATE_BOOST, TUNABLE_WEIGHT_DATE, TUNABLE_WEIGHT_PAGE
+from boost import date_boost
 from db import get_max_page
+from doc_filter import DocumentFilter, passes
+from impact_index import ImpactOrderedIndex
 from parser import Parser
-from posting_list import InvertedIndex
+from posting_list import DEFAULT_WEIGHTS, END, FieldWeights, InvertedIndex, Posting, np
+from profiling import NULL_PROFILER, Profiler
+from query_cache import QueryCache
 
 DBConnection = sqlite3.Connection
 
 
+def check_k(k: int) -> None:
+    """Raise a ValueError unless k is -1 for all results or the number of results to return"""
+    if k < -1:
+        raise ValueError(f"k has to be -1 for all results or at least 0, not {k}")
+
+
 @dataclass(order=True)
 class Accumulator:
     did: int = field(compare=False)
@@ -38,51 +50,405 @@ class Accumulator:
 
 class QueryProcessor:
 
-    def __init__(self, connection: DBConnection):
-        self.index = InvertedIndex(connection)
-        self.collection_size = self.index.getSize()
-        self.max_page = get_max_page(connection)
-        self.first_day = datetime(2000, 1, 1)
-        self.max_days = 366
+    def __init__(self, connection: DBConnection, index: InvertedIndex = None, cache: QueryCache = None,
+                 profiler: Profiler = None, impacts: ImpactOrderedIndex = None, weights: FieldWeights = None):
+        # any InvertedIndex can be passed in, e.g. a CompressedInvertedIndex. By default the tfs table is used.
+        self.index = index if index is not None else InvertedIndex(connection)
+        self.cache = cache
+        self.impacts = impacts  # only needed for impact ordered processing
+        # the field tfs of every posting are weighted with these, the defaults are the weights in constants.py
+        self.weights = weights if weights is not None else DEFAULT_WEIGHTS
+        self.index.weigh(self.weights)
+        if impacts is not None:
+            impacts.weigh(self.weights)
+        # profiling is off by default, the NULL_PROFILER ignores every stage and counter
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+        if profiler is not None:
+            profiler.trace(connection)
+            self.index.profile(profiler)
+            if impacts is not None:
+                impacts.profile(profiler)
+        self.store = self.index.store
+        # a store read from the snapshot knows both, which saves the queries on startup
+        self.collection_size = self.store.collection_size
+        if self.collection_size is None:
+            self.collection_size = self.index.getSize()
+        self.max_page = self.store.max_page
+        if self.max_page is None:
+            self.max_page = get_max_page(connection)
+        self.document_filter = None  # built on the first filtered query
+
+    def select(self, date_from: int = None, date_to: int = None, max_page: int = None) -> Optional[bytes]:
+        """Return the bitmap of the documents passing the filters, see DocumentFilter.select"""
+        if date_from is None and date_to is None and max_page is None:
+            return None
+        with self.profiler.stage("filter"):
+            if self.document_filter is None:
+                self.document_filter = DocumentFilter(self.store)
+            return self.document_filter.select(date_from, date_to, max_page)
 
-    def process(self, query: str, k: int = -1) -> List[Accumulator]:
+    def process(self, query: str, k: int = -1, pruning: bool = False, vectorized: bool = False,
+                impact_ordered: bool = False, budget: int = None, conjunctive: bool = False, date_from: int = None,
+                date_to: int = None, max_page: int = None) -> List[Accumulator]:
         """Process a query string and return the weighted results.
             @param: query - the query string
             @param: k - number of top k results to return, if empty, default of -1 is used, indicating all results.  
+                    Any other negative k raises a ValueError.
+            @param: pruning - use MaxScore to skip postings that can't make it into the top k, only used if k != -1
+            @param: vectorized - score whole posting lists with numpy instead, takes precedence over pruning
+            @param: impact_ordered - score the postings with the highest impacts first and stop as soon as the top k
+                    are known, needs the impact ordered index and takes precedence over the others if k != -1
+            @param: budget - score at most this many postings in impact ordered processing, the results are
+                    approximate then
+            @param: conjunctive - only return documents containing all query terms, takes precedence over the others
+            @param: date_from, date_to - only return documents published in this range, both inclusive, like 20000131
+            @param: max_page - only return documents printed on this page or a page before
         """
-        terms = Parser.tokenize([query])
+        check_k(k)
+        profiler = self.profiler
+        profiler.begin()
+        with profiler.stage("tokenize"):
+            terms = Parser.tokenize([query])
+        profiler.count("terms", len(terms))
+        mask = self.select(date_from, date_to, max_page)
+        # approximate results must not end up in the cache, neither do filtered ones
+        cache = self.cache if budget is None and mask is None else None
+        if cache is not None:
+            with profiler.stage("cache"):
+                cached = cache.get(terms, k, conjunctive, self.weights)
+            if cached is not None:
+                profiler.count("cache hits")
+                profiler.end()
+                # Accumulators are mutable, so the cache only holds their values
+                return [Accumulator(did=did, score=score) for did, score in cached]
+            profiler.count("cache misses")
+        results = self.process_terms(terms, k, pruning, vectorized, impact_ordered, budget, conjunctive, mask)
+        if cache is not None:
+            with profiler.stage("cache"):
+                cache.put(terms, k, [(acc.did, acc.score) for acc in results], conjunctive, self.weights)
+        profiler.end()
+        return results
+
+    def process_terms(self, terms: List[str], k: int = -1, pruning: bool = False, vectorized: bool = False,
+                      impact_ordered: bool = False, budget: int = None,
+                      conjunctive: bool = False, mask: bytes = None) -> List[Accumulator]:
+        """Process already tokenized query terms, see process. Only the documents set in the mask returned by
+        select are scored, the postings of all others are skipped."""
+        if conjunctive:
+            return self.process_conjunctive(terms, k, mask)
+        if impact_ordered and k != -1:
+            return self.process_impact_ordered(terms, k, budget, mask)
+        if vectorized:
+            return self.process_vectorized(terms, k, mask)
+        if pruning and k != -1:
+            try:
+                return self.process_maxscore(terms, k, mask)
+            except sqlite3.OperationalError:
+                pass  # the db has no max_impacts table yet, fall back to scoring every posting
         results = dict()
+        dids, boosts = self.store.dids, self.store.boosts
+        profiler = self.profiler
 
         # print(f'Processing terms: {terms}')
 
         for t in terms:
             try:
-                df = self.index.getDF(t)
+                with profiler.stage("df"):
+                    df = self.index.getDF(t)
             except TypeError:
                 continue
-            plist = self.index.getIndexList(t)
+            with profiler.stage("postings"):
+                if mask is None:
+                    plist = self.index.getIndexList(t)
+                else:
+                    # the postings outside the filter are skipped before a Posting is built for them
+                    docnos, tfs = self.index.getPostings(t)
+                    plist = [Posting(docno, tf) for docno, tf in zip(docnos, tfs) if passes(mask, docno)]
+            profiler.count("postings scored", len(plist))
             term_specific_constant = log(self.collection_size / df)
-            for posting in plist:
-                boost_value = (1 - TUNABLE_WEIGHT_PAGE * (posting.page / self.max_page)) * self.get_date_boost(
-                    posting.date)
-                acc = self.score(posting.did, posting.tf, term_specific_constant, boost_value)
-                try:  # Try to sum up the values
-                    results[posting.did] += acc
-                except KeyError:  # No posting for this did has been seen yet.
-                    results[posting.did] = acc
-
-        if k == -1:
-            return sorted(results.values(), reverse=True)
-        return heapq.nlargest(k, results.values())
-
-    def get_date_boost(self, date: int) -> float:
-        str_date = str(date)
-        year = int(str_date[0:4])
-        month = int(str_date[4:6])
-        day = int(str_date[6:8])
-        date_obj = datetime(year, month, day)
-        diff = date_obj - self.first_day
-        return ((diff.days / self.max_days) + ADDITIVE_CONSTANT_DATE_BOOST) * TUNABLE_WEIGHT_DATE
+            with profiler.stage("scoring"):
+                for posting in plist:
+                    # page and date boost are precomputed per document, see create_and_insert_static_boosts
+                    acc = self.score(dids[posting.docno], posting.tf, term_specific_constant, boosts[posting.docno])
+                    try:  # Try to sum up the values
+                        results[posting.docno] += acc
+                    except KeyError:  # No posting for this docno has been seen yet.
+                        results[posting.docno] = acc
+
+        with profiler.stage("top k"):
+            if k == -1:
+                return sorted(results.values(), reverse=True)
+            return heapq.nlargest(k, results.values())
+
+    def process_vectorized(self, terms: List[str], k: int = -1, mask: bytes = None) -> List[Accumulator]:
+        """Term-at-a-time processing with numpy, returns the same results as process.
+
+        Every posting list is fetched as parallel docno and tf arrays and its scores are added into a dense
+        score array indexed by docno. The top k are selected with argpartition, so Accumulators are only built
+        for the returned results.
+        """
+        if np is None:
+            raise ImportError("vectorized query processing requires numpy")
+        check_k(k)
+        profiler = self.profiler
+        boosts = np.frombuffer(self.store.boosts, dtype=np.float64)
+        scores = np.zeros(len(self.store), dtype=np.float64)
+        seen = np.zeros(len(self.store), dtype=bool)
+        if mask is not None:
+            mask = np.unpackbits(np.frombuffer(mask, dtype=np.uint8), bitorder="little")[:len(self.store)].view(bool)
+
+        for t in terms:
+            try:
+                with profiler.stage("df"):
+                    df = self.index.getDF(t)
+            except TypeError:
+                continue
+            with profiler.stage("postings"):
+                docnos, tfs = self.index.getIndexArrays(t)
+                if mask is not None:
+                    passing = mask[docnos]
+                    docnos, tfs = docnos[passing], tfs[passing]
+            profiler.count("postings scored", len(docnos))
+            term_specific_constant = log(self.collection_size / df)
+            with profiler.stage("scoring"):
+                # every docno occurs only once per posting list, so fancy indexing adds up correctly
+                scores[docnos] += tfs * term_specific_constant * boosts[docnos]
+                seen[docnos] = True
+
+        with profiler.stage("top k"):
+            candidates = np.flatnonzero(seen)
+            candidate_scores = scores[candidates]
+            if k != -1 and k < len(candidates):
+                top = np.argpartition(-candidate_scores, k - 1)[:k]
+                candidates, candidate_scores = candidates[top], candidate_scores[top]
+            order = np.argsort(-candidate_scores, kind="stable")
+            dids = self.store.dids
+            return [Accumulator(did=dids[docno], score=score)
+                    for docno, score in zip(candidates[order].tolist(), candidate_scores[order].tolist())]
+
+    def process_maxscore(self, terms: List[str], k: int, mask: bytes = None) -> List[Accumulator]:
+        """Document-at-a-time top k processing with MaxScore dynamic pruning.
+
+        The query terms are sorted by the upper bound of their score. Once the kth best score is known, the terms
+        whose upper bounds sum up to less than that threshold are non-essential: a document only containing them
+        can't make it into the top k, so only the postings of the essential terms are enumerated and the cursors of
+        the non-essential terms just skip forward to those documents. Returns the same top k as process.
+        """
+        check_k(k)
+        if k == 0:
+            return []
+        profiler = self.profiler
+        lists = []
+        for position, t in enumerate(terms):
+            try:
+                with profiler.stage("df"):
+                    df = self.index.getDF(t)
+            except TypeError:
+                continue
+            term_specific_constant = log(self.collection_size / df)
+            with profiler.stage("postings"):
+                # the margin makes sure rounding never turns the upper bound into something smaller than a real score
+                upper_bound = term_specific_constant * self.index.getMaxImpact(t) * (1 + 1e-9)
+                lists.append((upper_bound, position, term_specific_constant, self.index.getCursor(t)))
+        lists.sort(key=lambda l: l[0])
+        bounds = list(accumulate(l[0] for l in lists))
+        dids, boosts = self.store.dids, self.store.boosts
+
+        top = []  # min heap of (score, docno)
+        threshold = -1.0  # every document makes it into the top k until k documents are found
+        first = 0  # lists[:first] are non-essential
+        scored = 0  # postings scored, the cursors skip the others
+        with profiler.stage("scoring"):
+            while first < len(lists):
+                docno = min(l[3].docno for l in lists[first:])
+                if docno == END:
+                    break
+                if mask is not None and not passes(mask, docno):
+                    for _, _, _, cursor in lists[first:]:
+                        if cursor.docno == docno:
+                            cursor.next()
+                    continue
+                found = []
+                for _, position, term_specific_constant, cursor in lists[first:]:
+                    if cursor.docno == docno:
+                        found.append((position, cursor.tf * term_specific_constant * boosts[docno]))
+                        cursor.next()
+                partial = sum(s for _, s in found)
+                for i in range(first - 1, -1, -1):
+                    if partial + bounds[i] <= threshold:
+                        break
+                    _, position, term_specific_constant, cursor = lists[i]
+                    if cursor.advance(docno) == docno:
+                        score = cursor.tf * term_specific_constant * boosts[docno]
+                        found.append((position, score))
+                        partial += score
+                scored += len(found)
+                if partial <= threshold:
+                    continue
+                # sum up in query order, just like process does, so the scores are exactly the same
+                found.sort()
+                score = sum(s for _, s in found)
+                if len(top) < k:
+                    heapq.heappush(top, (score, docno))
+                elif score > top[0][0]:
+                    heapq.heapreplace(top, (score, docno))
+                if len(top) == k:
+                    threshold = top[0][0]
+                    while first < len(lists) and bounds[first] <= threshold:
+                        first += 1
+        profiler.count("postings scored", scored)
+
+        with profiler.stage("top k"):
+            return [Accumulator(did=dids[docno], score=score) for score, docno in sorted(top, reverse=True)]
+
+    def process_conjunctive(self, terms: List[str], k: int = -1, mask: bytes = None) -> List[Accumulator]:
+        """Document-at-a-time processing of the documents containing all query terms.
+
+        The posting lists are intersected from the rarest term to the most common one. The cursor of the rarest term
+        proposes the next document and the cursors of the other terms skip forward to it, so the posting lists of
+        common terms are mostly skipped. Matching documents are scored like in process.
+        """
+        check_k(k)
+        if k == 0:
+            return []
+        profiler = self.profiler
+        cursors = dict()  # term -> (df, term_specific_constant, cursor)
+        for t in terms:
+            if t in cursors:
+                continue
+            try:
+                with profiler.stage("df"):
+                    df = self.index.getDF(t)
+            except TypeError:
+                return []  # no document contains an unknown term
+            with profiler.stage("postings"):
+                cursors[t] = (df, log(self.collection_size / df), self.index.getCursor(t))
+        if not cursors:
+            return []
+        order = [cursor for _, _, cursor in sorted(cursors.values(), key=lambda c: c[0])]
+        lead, others = order[0], order[1:]
+        query = [cursors[t][1:] for t in terms]  # (term_specific_constant, cursor) of every term in query order
+        boosts = self.store.boosts
+
+        top = []  # min heap of (score, docno)
+        matches = 0
+        with profiler.stage("scoring"):
+            docno = lead.docno
+            while docno != END:
+                if mask is not None and not passes(mask, docno):
+                    docno = lead.next()
+                    continue
+                for cursor in others:
+                    found = cursor.advance(docno)
+                    if found != docno:
+                        docno = lead.advance(found)
+                        break
+                else:
+                    matches += 1
+                    score = sum(cursor.tf * term_specific_constant * boosts[docno]
+                                for term_specific_constant, cursor in query)
+                    if k == -1 or len(top) < k:
+                        heapq.heappush(top, (score, docno))
+                    elif score > top[0][0]:
+                        heapq.heapreplace(top, (score, docno))
+                    docno = lead.next()
+        profiler.count("postings scored", matches * len(terms))
+
+        with profiler.stage("top k"):
+            dids = self.store.dids
+            return [Accumulator(did=dids[docno], score=score) for score, docno in sorted(top, reverse=True)]
+
+    def process_impact_ordered(self, terms: List[str], k: int, budget: int = None,
+                               mask: bytes = None) -> List[Accumulator]:
+        """Score-at-a-time top k processing over the impact ordered index.
+
+        The segments of all query terms are scored in the order of their impact bounds, highest first. Processing
+        stops as soon as the kth best partial score is higher than anything a document outside the top k could still
+        reach, i.e. its partial score plus the bounds of the segments not scored yet. The scores of the top k are
+        completed by looking them up in the remaining segments, so the results are the same as the ones of process.
+        With a budget, at most that many postings are scored, which bounds the latency of queries of very frequent
+        terms, but the top k are approximate then.
+        """
+        if self.impacts is None:
+            raise ValueError("impact ordered processing requires an ImpactOrderedIndex")
+        check_k(k)
+        if k == 0:
+            return []
+        profiler = self.profiler
+        boosts = self.store.boosts
+        pending = [deque() for _ in terms]  # (bound, docnos, tfs) of the segments not scored yet, per query term
+        constants = [0.0] * len(terms)
+        with profiler.stage("postings"):
+            for position, t in enumerate(terms):
+                try:
+                    df = self.impacts.getDF(t)
+                except TypeError:
+                    continue
+                constants[position] = log(self.collection_size / df)
+                for level, docnos, tfs in self.impacts.getSegments(t):
+                    pending[position].append((self.impacts.bound(level), docnos, tfs))
+        order = sorted(((segment[0], position) for position in range(len(terms)) for segment in pending[position]),
+                       key=lambda s: (-s[0], s[1]))
+        remaining = [p[0][0] if p else 0.0 for p in pending]  # highest score a term can still add to a document
+
+        contributions = dict()  # docno -> the score of every query term, summed up in query order in the end
+        scores = dict()  # docno -> partial score
+        scored = 0
+        stopped = False
+        with profiler.stage("scoring"):
+            for i, (bound, position) in enumerate(order):
+                if budget is not None and scored >= budget:
+                    stopped = True
+                    break
+                _, docnos, tfs = pending[position].popleft()
+                if budget is not None and scored + len(docnos) > budget:
+                    # score only the first part of the segment, the rest stays pending
+                    split = budget - scored
+                    pending[position].appendleft((bound, docnos[split:], tfs[split:]))
+                    docnos, tfs = docnos[:split], tfs[:split]
+                term_specific_constant = constants[position]
+                for docno, tf in zip(docnos, tfs):
+                    if mask is not None and not passes(mask, docno):
+                        continue
+                    score = tf * term_specific_constant * boosts[docno]
+                    try:
+                        contributions[docno][position] = score
+                        scores[docno] += score
+                    except KeyError:
+                        contributions[docno] = [0.0] * len(terms)
+                        contributions[docno][position] = score
+                        scores[docno] = score
+                scored += len(docnos)
+                remaining[position] = pending[position][0][0] if pending[position] else 0.0
+                # the top k can only be settled once all segments of the same bound are scored
+                if i + 1 < len(order) and order[i + 1][0] == bound or len(scores) < k:
+                    continue
+                rest = sum(remaining)
+                best = heapq.nlargest(k + 1, scores.values())
+                if best[k - 1] > rest and (len(best) == k or best[k - 1] > best[k] + rest):
+                    stopped = True
+                    break
+        profiler.count("postings scored", scored)
+
+        with profiler.stage("top k"):
+            candidates = heapq.nlargest(k, scores, key=scores.get) if stopped else list(scores)
+            for docno in candidates:
+                # every document occurs at most once per term, so it is only searched in the terms it has no score of
+                for position, segments in enumerate(pending):
+                    if contributions[docno][position] == 0.0:
+                        for _, docnos, tfs in segments:
+                            j = bisect_left(docnos, docno)
+                            if j < len(docnos) and docnos[j] == docno:
+                                contributions[docno][position] = tfs[j] * constants[position] * boosts[docno]
+                                break
+            dids = self.store.dids
+            # sum up in query order, just like process does, so the scores are exactly the same
+            return heapq.nlargest(k, (Accumulator(did=dids[docno], score=sum(contributions[docno]))
+                                      for docno in candidates))
+
+    @staticmethod
+    def get_date_boost(date: int) -> float:
+        return date_boost(date)
 
     @staticmethod
     def score(did: int, tf: int, term_specific_constant: float, boost_value: float):
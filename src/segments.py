@@ -0,0 +1,176 @@
+import os
+import subprocess
+import sys
+from typing import List, Sequence, Tuple
+
+from compressed_index import POSTINGS_NAME, CompressedInvertedIndex, segment_postings_name, write_compressed_index
+from db import (DBConnection, add_segment, bump_index_version, drop_unsealed_segments, get_segments, insert_records,
+                open_db, seal_segment, update_statistics)
+from doc_store import DocumentStore
+from importer import Importer
+from posting_list import END, FieldWeights, InvertedIndex, Posting, PostingCursor, np
+from profiling import Profiler
+from snapshot import load_snapshot, refresh_snapshot
+from term_dictionary import TermDictionary
+
+# an ingest starts a merge in the background once there are more segments than this
+MAX_SEGMENTS = 8
+
+
+class ChainedCursor(PostingCursor):
+    """PostingCursor over several cursors, each one covering a range of docnos after the one of its predecessor"""
+
+    def __init__(self, cursors: Sequence[PostingCursor]):
+        self.cursors = cursors
+        self.current = 0
+        self._sync()
+
+    def _sync(self) -> None:
+        while self.current < len(self.cursors) and self.cursors[self.current].docno == END:
+            self.current += 1
+        if self.current < len(self.cursors):
+            self.docno = self.cursors[self.current].docno
+            self.tf = self.cursors[self.current].tf
+        else:
+            self.docno = END
+            self.tf = 0
+
+    def next(self) -> int:
+        if self.current < len(self.cursors):
+            self.cursors[self.current].next()
+            self._sync()
+        return self.docno
+
+    def advance(self, target: int) -> int:
+        if self.docno >= target:
+            return self.docno
+        while self.current < len(self.cursors) and self.cursors[self.current].advance(target) == END:
+            self.current += 1
+        self._sync()
+        return self.docno
+
+
+class SegmentedIndex(InvertedIndex):
+    """Inverted index over several segments, each one read by its own index.
+
+    Documents get their docnos in insertion order, so the docnos of a segment are all greater than the ones of
+    the segments before it and the posting lists of the segments are simply concatenated.
+    The dfs and all other statistics are the ones of the whole collection in the db.
+    """
+    parts: List[InvertedIndex]
+
+    def __init__(self, connection: DBConnection, parts: List[InvertedIndex], store: DocumentStore,
+                 terms: TermDictionary = None):
+        super().__init__(connection, store, terms=terms)
+        self.parts = parts
+
+    def profile(self, profiler: Profiler) -> None:
+        # the parts fetch the posting lists, so they do the counting, the cache is consulted before
+        super().profile(profiler)
+        for part in self.parts:
+            part.profile(profiler)
+
+    def weigh(self, weights: FieldWeights) -> None:
+        super().weigh(weights)
+        for part in self.parts:
+            part.weigh(weights)
+
+    def readIndexList(self, term: str) -> List[Posting]:
+        return [posting for part in self.parts for posting in part.getIndexList(term)]
+
+    def readIndexArrays(self, term: str) -> Tuple["np.ndarray", "np.ndarray"]:
+        arrays = [part.getIndexArrays(term) for part in self.parts]
+        return np.concatenate([docnos for docnos, _ in arrays]), np.concatenate([tfs for _, tfs in arrays])
+
+    def readCursor(self, term: str) -> PostingCursor:
+        return ChainedCursor([part.getCursor(term) for part in self.parts])
+
+
+def open_index(connection: DBConnection, store: DocumentStore = None, terms: TermDictionary = None,
+               directory: str = "") -> InvertedIndex:
+    """Open an index over all complete segments of the db, whose posting files are in the given directory.
+    Every segment is read from its posting file if that was written for the current content of the segment,
+    from its tfs table otherwise. All segments share the DocumentStore and the TermDictionary, which are read from the
+    snapshot in the directory if it belongs to the current version of the index."""
+    if store is None and terms is None:
+        store, terms = load_snapshot(connection, directory)
+    store = store if store is not None else DocumentStore(connection)
+    terms = terms if terms is not None else TermDictionary(connection)
+    parts = []
+    for segment, table, version in get_segments(connection):
+        if version is None and segment != 0:
+            continue  # still being ingested
+        index = None
+        path = os.path.join(directory, segment_postings_name(segment))
+        if version is not None and os.path.isfile(path):
+            try:
+                index = CompressedInvertedIndex(connection, path, store, terms)
+            except ValueError:
+                pass  # posting file of an older format
+            else:
+                if index.version is not None and index.version != version:
+                    index.close()  # written for an older content of the segment
+                    index = None
+        parts.append(index if index is not None else InvertedIndex(connection, store, table, terms))
+    return parts[0] if len(parts) == 1 else SegmentedIndex(connection, parts, store, terms)
+
+
+def ingest_dir(directory: str, processes: int = None) -> None:
+    """Adds all Documents of a directory to an existing db as a new segment and updates the statistics in place.
+    The cost only depends on the number of new documents, not on the size of the collection.
+    The leftovers of an ingest that crashed are removed first, so it can simply be started again."""
+    with open_db() as connection:
+        drop_unsealed_segments(connection)
+        first_rowid = connection.execute("SELECT IFNULL(MAX(rowid), 0) + 1 FROM boost").fetchone()[0]
+        segment, table = add_segment(connection)
+        insert_records(connection, Importer.stream_dir(directory, processes), table=table)
+        print(f"\n[-] creating index {table}_idx", end="")
+        connection.execute(f"CREATE INDEX {table}_idx ON {table}(tid, did)")
+        print(f"\r[+] creating index {table}_idx")
+        version = update_statistics(connection, table, first_rowid, segment)
+        if os.path.isfile(POSTINGS_NAME):
+            write_compressed_index(connection, segment_postings_name(segment), table=table, version=version)
+        refresh_snapshot(connection)
+        if len(get_segments(connection)) > MAX_SEGMENTS:
+            merge_in_background()
+
+
+def merge_segments(connection: DBConnection) -> None:
+    """Merges all complete segments into segment 0 and rewrites its posting file, if there is one.
+
+    Every segment is moved in its own transaction, so processes opening the index in the meantime see every
+    document exactly once. Processes that opened the index before the merge have to open it again.
+    """
+    # segments without version are still being ingested
+    segments = [segment for segment in get_segments(connection)[1:] if segment[2] is not None]
+    if not segments:
+        return
+    # the content of segment 0 changes, so its posting file can't be used until it is written again
+    connection.execute("UPDATE segments SET version = NULL WHERE id = 0")
+    connection.commit()
+    for segment, table, _ in segments:
+        print(f"\n[-] merging segment {segment}", end="")
+        connection.execute("BEGIN TRANSACTION")
+        connection.execute(f"""
+            INSERT INTO tfs(did, tid, content_tf, title_tf, abstract_tf)
+            SELECT did, tid, content_tf, title_tf, abstract_tf FROM {table}
+        """)
+        connection.execute("DELETE FROM segments WHERE id = ?", (segment,))
+        connection.execute(f"DROP TABLE {table}")
+        connection.execute("COMMIT")
+        print(f"\r[+] merging segment {segment}")
+    version = bump_index_version(connection)
+    seal_segment(connection, version)
+    if os.path.isfile(POSTINGS_NAME):
+        write_compressed_index(connection, POSTINGS_NAME, version=version)
+        for segment, _, _ in segments:
+            if os.path.isfile(segment_postings_name(segment)):
+                os.remove(segment_postings_name(segment))
+    refresh_snapshot(connection)
+
+
+def merge_in_background() -> subprocess.Popen:
+    """Starts merging the segments in a detached process, which keeps running after this process exits"""
+    print("[+] merging segments in the background")
+    return subprocess.Popen([sys.executable, os.path.dirname(os.path.abspath(__file__)), "--merge"],
+                            stdout=subprocess.DEVNULL, start_new_session=True)
@@ -0,0 +1,193 @@
+import json
+import os
+import queue
+import signal
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from db import DBConnection, get_documents, open_db
+from doc_filter import DocumentFilter
+from posting_cache import PostingCache
+from posting_list import np
+from profiling import Profiler
+from query_processing import QueryProcessor
+from segments import open_index
+from snapshot import load_snapshot
+
+
+class ProcessorPool:
+    """Pool of warm QueryProcessors, each with its own read-only connection.
+    The DocumentStore, the TermDictionary and the DocumentFilter are shared. With profile, every processor records its
+    stages with its own Profiler. With a cache budget in bytes, the posting lists of frequent terms are kept in a
+    PostingCache shared by all processors, the lists of the pinned terms with the highest dfs are read into it right
+    away."""
+
+    def __init__(self, size: int, profile: bool = False, cache_budget: int = None, pinned: int = 0):
+        self.processors: "queue.Queue[Tuple[DBConnection, QueryProcessor]]" = queue.Queue()
+        self.profilers = []
+        self.cache = PostingCache(cache_budget) if cache_budget else None
+        store = terms = document_filter = None
+        for _ in range(size):
+            connection = open_db(read_only=True)
+            if store is None:
+                store, terms = load_snapshot(connection)
+                document_filter = DocumentFilter(store)
+            index = open_index(connection, store, terms)
+            if self.cache is not None:
+                index.cachePostings(self.cache)
+                if pinned and not len(self.cache):
+                    print(f"[+] pinned the posting lists of {index.pinPostings(pinned)} terms")
+            profiler = Profiler() if profile else None
+            if profiler is not None:
+                self.profilers.append(profiler)
+            processor = QueryProcessor(connection, index, profiler=profiler)
+            processor.document_filter = document_filter
+            self.processors.put((connection, processor))
+
+    def stats(self) -> dict:
+        """Return the profiling totals of all processors of the pool and the statistics of the posting cache"""
+        total = Profiler()
+        for profiler in self.profilers:
+            total.merge(profiler)
+        stats = total.stats() if self.profilers else dict()
+        if self.cache is not None:
+            stats["posting_cache"] = self.cache.stats()
+        return stats
+
+    @contextmanager
+    def processor(self) -> Iterator[Tuple[DBConnection, QueryProcessor]]:
+        """Borrow a processor, blocks until one is free"""
+        borrowed = self.processors.get()
+        try:
+            yield borrowed
+        finally:
+            self.processors.put(borrowed)
+
+
+# query parameters of the filters and the matching options of QueryProcessor.process
+FILTER_PARAMETERS = {"from": "date_from", "to": "date_to", "max_page": "max_page"}
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """Answers GET /search?q=<query>&k=<number of results> with the results as json, op=and only returns documents
+    containing all query terms. from=<YYYYMMDD>, to=<YYYYMMDD> and max_page=<page> only return documents published in
+    that date range or printed on that page or a page before.
+    GET /stats returns the profiling totals of the process, if the server profiles its queries, and the hit rate of
+    the posting cache, if there is one."""
+    server: "SearchServer"
+
+    def do_GET(self):
+        time_stamp = time.perf_counter()
+        url = urlparse(self.path)
+        if url.path == "/stats" and (self.server.pool.profilers or self.server.pool.cache is not None):
+            self.send_json(200, {"pid": os.getpid(), **self.server.pool.stats()})
+            return
+        if url.path != "/search":
+            self.send_json(404, {"error": "unknown path, use /search?q=<query>"})
+            return
+        parameters = parse_qs(url.query)
+        query = parameters.get("q", [""])[0]
+        try:
+            k = int(parameters.get("k", ["10"])[0])
+        except ValueError:
+            self.send_json(400, {"error": "k has to be a number"})
+            return
+        if k != -1 and k < 1:
+            self.send_json(400, {"error": "k has to be -1 for all results or at least 1"})
+            return
+        filters = dict()
+        for name, option in FILTER_PARAMETERS.items():
+            if name in parameters:
+                try:
+                    filters[option] = int(parameters[name][0])
+                except ValueError:
+                    self.send_json(400, {"error": f"{name} has to be a number"})
+                    return
+
+        conjunctive = parameters.get("op", ["or"])[0].lower() == "and"
+
+        with self.server.pool.processor() as (connection, processor):
+            search_stamp = time.perf_counter()
+            accumulators = processor.process(query, k, pruning=True, vectorized=np is not None,
+                                             conjunctive=conjunctive, **filters)
+            metadata_stamp = time.perf_counter()
+            with processor.profiler.stage("metadata"):
+                documents = get_documents(connection, [acc.did for acc in accumulators])
+        end_stamp = time.perf_counter()
+
+        self.timing = {
+            "wait_ms": (search_stamp - time_stamp) * 1000,
+            "search_ms": (metadata_stamp - search_stamp) * 1000,
+            "metadata_ms": (end_stamp - metadata_stamp) * 1000,
+            "total_ms": (end_stamp - time_stamp) * 1000,
+        }
+        self.send_json(200, {
+            "query": query,
+            "k": k,
+            "op": "and" if conjunctive else "or",
+            "filters": {name: filters[option] for name, option in FILTER_PARAMETERS.items() if option in filters},
+            "results": [{"rank": rank + 1, "did": acc.did, "score": acc.score,
+                         "url": documents[acc.did][1], "title": documents[acc.did][0]}
+                        for rank, acc in enumerate(accumulators)],
+            "timing": self.timing,
+        })
+
+    def send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if getattr(self, "timing", None):
+            self.send_header("Server-Timing", ", ".join(f"{name[:-3]};dur={value:.3f}"
+                                                        for name, value in self.timing.items()))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format_, *args):
+        timing = getattr(self, "timing", None)
+        suffix = f" {timing['total_ms']:.2f} ms" if timing else ""
+        super().log_message(format_ + suffix, *args)
+
+
+class SearchServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+    pool: ProcessorPool
+
+
+def serve(host: str = "127.0.0.1", port: int = 8080, workers: int = 1, threads: int = 4,
+          profile: bool = False, cache_budget: int = None, pinned: int = 0) -> None:
+    """Serve search requests over http.
+
+    The listening socket is created once and shared by all forked worker processes, so all cores can be used.
+    Every process answers requests with its own pool of query processors.
+    With profile, the processors record the time spent in every stage, which is served under /stats.
+    Every process keeps the posting lists of frequent terms in a cache of cache_budget bytes, see ProcessorPool.
+    """
+    server = SearchServer((host, port), SearchHandler)
+    children = []
+    for _ in range(workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            children = None
+            break
+        children.append(pid)
+    # connections must not be shared across forks, so every process opens its own after forking
+    server.pool = ProcessorPool(threads, profile, cache_budget, pinned)
+    if children is not None:
+        print(f"[+] serving on http://{host}:{port}/search with {workers} processes")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for pid in children or ():
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
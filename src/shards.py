@@ -0,0 +1,130 @@
+import heapq
+import os
+from collections import Counter
+from multiprocessing import Pool
+from operator import itemgetter
+from typing import Dict, List, Sequence, Tuple
+
+from compressed_index import write_segment_postings
+from db import (DB_NAME, DBConnection, bump_index_version, compute_statistics, create_db, get_documents,
+                get_max_page, insert_records, open_db, rebuild_static_boosts, seal_segment)
+from importer import Importer
+from posting_list import DEFAULT_WEIGHTS, FieldWeights, create_indices
+from query_processing import Accumulator, QueryProcessor
+from segments import open_index
+from snapshot import write_snapshot
+
+SHARDS_DIR = "nyt.shards"
+
+
+def shard_directories(directory: str = SHARDS_DIR) -> List[str]:
+    """Return the directories of all shards, every one contains a complete db with its posting files"""
+    shards = sorted((name for name in os.listdir(directory) if name.isdigit()), key=int)
+    return [os.path.join(directory, name) for name in shards]
+
+
+def build_shards(corpus: str, shards: int, processes: int = None, directory: str = SHARDS_DIR) -> None:
+    """Partitions the documents of the corpus round robin across the given number of shard dbs.
+
+    Every shard is a complete index of its documents. The dfs, the size of the collection and the maximum page
+    are replaced by the ones of the whole collection afterwards, so every shard scores its documents exactly like
+    a single db would.
+    """
+    paths = list(Importer.iter_dir(corpus))
+    directories = [os.path.join(directory, str(shard)) for shard in range(shards)]
+    for shard, shard_directory in enumerate(directories):
+        print(f"\n[-] building shard {shard}")
+        os.makedirs(shard_directory)
+        with create_db(os.path.join(shard_directory, DB_NAME)) as connection:
+            insert_records(connection, Importer.stream_paths(paths[shard::shards], processes))
+            compute_statistics(connection)
+            create_indices(connection, shard_directory)
+    connections = [open_db(os.path.join(shard_directory, DB_NAME)) for shard_directory in directories]
+    try:
+        globalize_statistics(connections)
+        for connection, shard_directory in zip(connections, directories):
+            write_segment_postings(connection, directory=shard_directory)
+            # the global statistics changed the version of the index
+            write_snapshot(connection, directory=shard_directory)
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def globalize_statistics(connections: Sequence[DBConnection]) -> None:
+    """Replaces the dfs, the collection size and the maximum page of every shard with the ones of all shards"""
+    print("\n[-] computing global statistics", end="")
+    dfs = Counter()
+    for connection in connections:
+        dfs.update(dict(connection.execute("SELECT terms.term, dfs.df FROM dfs JOIN terms USING (tid)")))
+    size = sum(connection.execute("SELECT size FROM d").fetchone()[0] for connection in connections)
+    max_page = max(get_max_page(connection) for connection in connections)
+    for connection in connections:
+        local_max_page = get_max_page(connection)
+        connection.execute("BEGIN TRANSACTION")
+        connection.executemany("UPDATE dfs SET df = ? WHERE tid = ?", (
+            (dfs[term], tid) for tid, term in connection.execute("SELECT tid, term FROM terms").fetchall()))
+        connection.execute("UPDATE d SET size = ?", (size,))
+        connection.execute("UPDATE max_page SET max_page = ?", (max_page,))
+        connection.execute("COMMIT")
+        if local_max_page != max_page:
+            rebuild_static_boosts(connection)  # the page boosts depend on the maximum page
+        seal_segment(connection, bump_index_version(connection))
+    print("\r[+] computing global statistics")
+
+
+# open shards of a worker process, per field weights
+_processors: Dict[Tuple[str, FieldWeights], Tuple[DBConnection, QueryProcessor]] = dict()
+
+
+def _process_shard(shard: str, query: str, k: int, weights: FieldWeights, options: dict) -> List[Tuple[int, float]]:
+    """Process a query on a single shard with the given field weights, runs inside the worker processes"""
+    if (shard, weights) not in _processors:
+        connection = open_db(os.path.join(shard, DB_NAME), read_only=True)
+        _processors[shard, weights] = connection, QueryProcessor(connection, open_index(connection, directory=shard),
+                                                                  weights=weights)
+    return [(acc.did, acc.score) for acc in _processors[shard, weights][1].process(query, k, **options)]
+
+
+class ShardedQueryProcessor:
+    """Processes every query on all shards in parallel and merges the top k of the shards into the global top k.
+
+    The shards are searched by a pool of worker processes, so a single query can use all cores. The scores are the
+    same as the ones of a single db, as every shard knows the statistics of the whole collection.
+    The field tfs are weighted with the given weights, by default with the ones in constants.py.
+    """
+
+    def __init__(self, directory: str = SHARDS_DIR, processes: int = None, weights: FieldWeights = None):
+        self.shards = shard_directories(directory)
+        self.weights = weights if weights is not None else DEFAULT_WEIGHTS
+        self.pool = Pool(processes or min(len(self.shards), os.cpu_count() or 1))
+        self.connections = [open_db(os.path.join(shard, DB_NAME), read_only=True) for shard in self.shards]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        self.pool.terminate()
+        for connection in self.connections:
+            connection.close()
+
+    def process(self, query: str, k: int = -1, **options) -> List[Accumulator]:
+        """Process a query on all shards, takes the same options as QueryProcessor.process"""
+        shard_results = self.pool.starmap(_process_shard,
+                                          ((shard, query, k, self.weights, options) for shard in self.shards))
+        results = (result for shard in shard_results for result in shard)
+        if k == -1:
+            merged = sorted(results, key=itemgetter(1), reverse=True)
+        else:
+            merged = heapq.nlargest(k, results, key=itemgetter(1))
+        return [Accumulator(did=did, score=score) for did, score in merged]
+
+    def get_documents(self, dids: Sequence[int]) -> Dict[int, Tuple[str, str]]:
+        """Retrieves title and url of the documents from the shards they are stored in"""
+        documents = dict()
+        for connection in self.connections:
+            documents.update(get_documents(connection, dids))
+        return documents
@@ -0,0 +1,170 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Iterator, Optional, Tuple
+
+from db import DBConnection, get_index_version, get_max_page
+from doc_store import DocumentStore
+from term_dictionary import FIELDS, TermDictionary
+
+SNAPSHOT_NAME = "nyt.snapshot"
+
+# File layout:
+#   header | 8 byte arrays | 4 byte arrays | terms
+# The snapshot holds everything a process loads from the db before it can answer queries: the DocumentStore, the
+# TermDictionary, the size of the collection and the maximum page. Every attribute is stored as a little endian array,
+# so it is used straight from the mapped file without being copied or parsed. The 8 byte arrays are the dids, dates and
+# boosts of the documents, the dfs, the max impacts and the max impacts of every field of the terms, and the offsets of
+# the terms. The 4 byte arrays are the pages and the lengths of the documents and the tids ordered by their term. The
+# terms are stored utf-8 encoded one after the other, the term of tid i from offset i to offset i + 1. A term is looked
+# up with a binary search in the tids ordered by their term, so no dict of all terms has to be built.
+# All arrays start at a multiple of 8 bytes, as the header takes 80 bytes.
+_MAGIC = b"ZWOS"
+_VERSION = 2
+# magic, version, index version, number of documents, number of terms, size of the collection, maximum page, whether
+# there are max impacts and the weights of the fields the max impacts were computed with
+_HEADER = struct.Struct("<4sIqQQqqI4xddd")
+_SWAP = sys.byteorder == "big"  # the file is always little endian
+
+
+class _Terms(Sequence):
+    """The terms of a snapshot ordered by tid, every term is decoded when it is accessed"""
+
+    def __init__(self, mm: mmap.mmap, offsets: Sequence[int], start: int):
+        self.mm = mm
+        self.offsets = offsets
+        self.start = start  # offset of the terms in the file
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, tid: int) -> str:
+        if isinstance(tid, slice):
+            return [self[i] for i in range(*tid.indices(len(self)))]
+        if not 0 <= tid < len(self):
+            raise IndexError(tid)
+        return str(self.encoded(tid), "utf-8")
+
+    def encoded(self, tid: int) -> bytes:
+        return self.mm[self.start + self.offsets[tid]:self.start + self.offsets[tid + 1]]
+
+
+class _Tids(Mapping):
+    """Maps the terms of a snapshot to their tids with a binary search in the tids ordered by their term"""
+
+    def __init__(self, terms: _Terms, order: Sequence[int]):
+        self.terms = terms
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.terms)
+
+    def __getitem__(self, term: str) -> int:
+        if not isinstance(term, str):
+            raise KeyError(term)
+        encoded = term.encode("utf-8")
+        low, high = 0, len(self.order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.terms.encoded(self.order[middle]) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.order) and self.terms.encoded(self.order[low]) == encoded:
+            return self.order[low]
+        raise KeyError(term)
+
+
+def _bytes(values: Sequence, typecode: str) -> bytes:
+    packed = array(typecode, values)
+    if _SWAP:
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def write_snapshot(connection: DBConnection, store: DocumentStore = None, terms: TermDictionary = None,
+                   directory: str = "") -> None:
+    """Writes the DocumentStore and the TermDictionary of the current version of the index into the snapshot file.
+    The file replaces an existing one at once, so processes still reading the old file are not disturbed."""
+    path = os.path.join(directory, SNAPSHOT_NAME)
+    print(f"\n[-] writing snapshot {path}", end="")
+    store = store if store is not None else DocumentStore(connection)
+    terms = terms if terms is not None else TermDictionary(connection)
+    encoded = [term.encode("utf-8") for term in terms.terms]
+    offsets = [0]
+    for term in encoded:
+        offsets.append(offsets[-1] + len(term))
+    order = sorted(range(len(encoded)), key=encoded.__getitem__)
+    max_impacts = terms.max_impacts is not None
+    weights = terms.max_impact_weights if max_impacts else (0.0,) * len(FIELDS)
+    sections = [_bytes(store.dids, "q"), _bytes(store.dates, "q"), _bytes(store.boosts, "d"), _bytes(terms.dfs, "q")]
+    if max_impacts:
+        sections += [_bytes(terms.max_impacts, "d"), *(_bytes(impacts, "d") for impacts in terms.field_max_impacts)]
+    sections += [_bytes(offsets, "Q"), _bytes(store.pages, "i"), _bytes(store.lengths, "i"), _bytes(order, "I"),
+                 *encoded]
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as output:
+        output.write(_HEADER.pack(_MAGIC, _VERSION, get_index_version(connection), len(store), len(terms),
+                                  connection.execute("SELECT size FROM d").fetchone()[0], get_max_page(connection),
+                                  max_impacts, *weights))
+        output.writelines(sections)
+    os.replace(temporary, path)
+    print(f"\r[+] writing snapshot {path}")
+
+
+def open_snapshot(connection: DBConnection, directory: str = "") -> Optional[Tuple[DocumentStore, TermDictionary]]:
+    """Return the DocumentStore and the TermDictionary of the snapshot, None if there is no snapshot of the current
+    version of the index. Both are read-only, their arrays are views of the mapped file. The store knows the size of
+    the collection and the maximum page as well."""
+    path = os.path.join(directory, SNAPSHOT_NAME)
+    if not os.path.isfile(path) or os.path.getsize(path) < _HEADER.size:
+        return None
+    with open(path, "rb") as input_:
+        mm = mmap.mmap(input_.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, index_version, documents, term_count, collection_size, max_page, max_impacts, *weights = \
+        _HEADER.unpack_from(mm, 0)
+    if magic != _MAGIC or version != _VERSION or index_version != get_index_version(connection):
+        mm.close()
+        return None
+    position = _HEADER.size
+
+    def view(typecode: str, count: int) -> Sequence:
+        nonlocal position
+        size = count * array(typecode).itemsize
+        if _SWAP:
+            values = array(typecode, mm[position:position + size])
+            values.byteswap()
+        else:
+            values = memoryview(mm)[position:position + size].cast(typecode)
+        position += size
+        return values
+
+    dids, dates, boosts, dfs = view("q", documents), view("q", documents), view("d", documents), view("q", term_count)
+    impacts = [view("d", term_count) for _ in range(1 + len(FIELDS))] if max_impacts else None
+    offsets = view("Q", term_count + 1)
+    pages, lengths, order = view("i", documents), view("i", documents), view("I", term_count)
+    store = DocumentStore.from_arrays(dids, pages, dates, lengths, boosts, collection_size, max_page)
+    terms = _Terms(mm, offsets, position)
+    terms = TermDictionary.from_arrays(terms, _Tids(terms, order), dfs, impacts, tuple(weights))
+    return store, terms
+
+
+def load_snapshot(connection: DBConnection, directory: str = "") -> Tuple[DocumentStore, TermDictionary]:
+    """Return the DocumentStore and the TermDictionary from the snapshot, or from the db if there is no snapshot of the
+    current version of the index"""
+    snapshot = open_snapshot(connection, directory)
+    if snapshot is None:
+        return DocumentStore(connection), TermDictionary(connection)
+    return snapshot
+
+
+def refresh_snapshot(connection: DBConnection, directory: str = "") -> None:
+    """Writes the snapshot again after the index changed, if there is one"""
+    if os.path.isfile(os.path.join(directory, SNAPSHOT_NAME)):
+        write_snapshot(connection, directory=directory)
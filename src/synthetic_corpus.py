@@ -0,0 +1,108 @@
+import argparse
+import itertools
+import random
+from datetime import date, timedelta
+from pathlib import Path
+from typing import List
+from xml.sax.saxutils import escape, quoteattr
+
+# Some tokens the tokenizer has to handle with care, mixed into the generated text
+_SPECIAL_TOKENS = ["U.S.", "N.Y.", "A.", "e.g.", "it's", "well-known", "$100", "9/11", "(AP)", "--", "end."]
+
+_ARTICLE = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE nitf SYSTEM "http://www.nitf.org/IPTC/NITF/3.3/specification/dtd/nitf-3-3.dtd">
+<nitf change.date="June 10, 2005" change.time="19:30" version="-//IPTC//DTD NITF 3.3//EN">
+  <head>
+    <title>{title}</title>
+{page}    <docdata>
+      <doc-id id-string="{id}"/>
+    </docdata>
+    <pubdata date.publication="{date}T000000" ex-ref={url} item-length="{length}" name="The New York Times" unit-of-measure="word"/>
+  </head>
+  <body>
+{abstract}    <body.content>
+      <block class="lead_paragraph">
+{lead}
+      </block>
+      <block class="full_text">
+{paragraphs}
+      </block>
+    </body.content>
+  </body>
+</nitf>
+"""
+
+
+class SyntheticCorpus:
+    """Generator for articles in the format of the New York Times corpus with a Zipf distributed vocabulary"""
+
+    def __init__(self, vocabulary_size: int = 20000, zipf_exponent: float = 1.0, seed: int = 2000):
+        self.random = random.Random(seed)
+        self.vocabulary = [self._word(rank) for rank in range(vocabulary_size)]
+        weights = [1 / (rank + 1) ** zipf_exponent for rank in range(vocabulary_size)]
+        # choices() would accumulate the weights again on every call
+        self.cum_weights = list(itertools.accumulate(weights))
+
+    @staticmethod
+    def _word(rank: int) -> str:
+        """A pronounceable, unique word for every rank"""
+        syllables = ["ka", "lo", "mi", "re", "su", "ta", "no", "vi", "de", "ga", "po", "shi", "ne", "ru", "ba", "zo"]
+        word = ""
+        rank += 1
+        while rank:
+            rank, syllable = divmod(rank, len(syllables))
+            word += syllables[syllable]
+        return word
+
+    def words(self, n: int) -> List[str]:
+        """n words drawn from the Zipf distribution"""
+        return self.random.choices(self.vocabulary, cum_weights=self.cum_weights, k=n)
+
+    def sentence(self, n: int) -> str:
+        words = self.words(n)
+        if self.random.random() < 0.3:
+            words.insert(self.random.randrange(len(words) + 1), self.random.choice(_SPECIAL_TOKENS))
+        return " ".join(words).capitalize() + self.random.choice([".", ".", ".", "?", "!", ","])
+
+    def paragraph(self) -> str:
+        return " ".join(self.sentence(self.random.randint(4, 25)) for _ in range(self.random.randint(1, 5)))
+
+    def article(self, id_: int, day: date) -> str:
+        """A single article as xml"""
+        paragraphs = [self.paragraph() for _ in range(self.random.randint(1, 12))]
+        page = "" if self.random.random() < 0.05 else \
+            f'    <meta content="{self.random.randint(1, 60)}" name="print_page_number"/>\n'
+        abstract = "" if self.random.random() < 0.3 else \
+            f"    <body.head>\n      <abstract>\n        <p>{escape(self.sentence(20))}</p>\n      </abstract>\n" \
+            f"    </body.head>\n"
+        return _ARTICLE.format(
+            title=escape(self.sentence(self.random.randint(2, 10)).rstrip(".?!,")),
+            page=page,
+            id=id_,
+            date=day.strftime("%Y%m%d"),
+            url=quoteattr(f"http://query.nytimes.com/gst/fullpage.html?res={id_:08X}"),
+            length=sum(len(p.split()) for p in paragraphs),
+            abstract=abstract,
+            lead="\n".join(f"        <p>{escape(p)}</p>" for p in paragraphs[:1]),
+            paragraphs="\n".join(f"        <p>{escape(p)}</p>" for p in paragraphs),
+        )
+
+    def write(self, directory: str, documents: int, first_id: int = 1165027) -> None:
+        """Writes the articles into directory/MM/DD/<id>.xml, the layout of the corpus, spread over the year 2000"""
+        first_day = date(2000, 1, 1)
+        for i in range(documents):
+            day = first_day + timedelta(days=self.random.randrange(366))
+            path = Path(directory, f"{day.month:02d}", f"{day.day:02d}")
+            path.mkdir(parents=True, exist_ok=True)
+            path.joinpath(f"{first_id + i}.xml").write_text(self.article(first_id + i, day), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Generate a synthetic New York Times corpus")
+    arguments.add_argument("directory")
+    arguments.add_argument("--documents", type=int, default=10000)
+    arguments.add_argument("--vocabulary", type=int, default=20000)
+    arguments.add_argument("--zipf", type=float, default=1.0, help="exponent of the Zipf distribution")
+    arguments.add_argument("--seed", type=int, default=2000)
+    args = arguments.parse_args()
+    SyntheticCorpus(args.vocabulary, args.zipf, args.seed).write(args.directory, args.documents)
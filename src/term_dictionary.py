@@ -0,0 +1,104 @@
+import sqlite3
+from array import array
+from typing import Iterable, List, Mapping, Optional, Sequence, Tuple
+
+DBConnection = sqlite3.Connection
+FIELDS = ("content", "title", "abstract")  # the fields of a document with their own tfs
+
+
+class TermDictionary:
+    """In-memory dictionary of all terms, loaded once from the terms, dfs and max_impacts tables.
+
+    Every term has a dense term id (tid) from 0 to size - 1, the tfs tables store the tid instead of the term.
+    The df and the max impact of a term are compact arrays indexed by the tid, so looking them up needs no sql.
+    The max impacts are computed with the max_impact_weights, the field_max_impacts hold the ones of every field.
+    """
+    tids: Mapping[str, int]
+    terms: Sequence[str]
+    dfs: Sequence[int]
+    max_impacts: Optional[Sequence[float]]
+    field_max_impacts: List[Sequence[float]]
+    max_impact_weights: Tuple[float, float, float]
+
+    def __init__(self, connection: DBConnection):
+        try:
+            self.terms = [term for term, in connection.execute("SELECT term FROM terms ORDER BY tid")]
+        except sqlite3.OperationalError:
+            raise sqlite3.OperationalError("the db was created before there were term ids, please create it again")
+        self.tids = {term: tid for tid, term in enumerate(self.terms)}
+        self.new = []  # (tid, term) of the terms added since the last call of new_terms
+        self.dfs = array('q', bytes(8 * len(self.terms)))
+        try:
+            for tid, df in connection.execute("SELECT tid, df FROM dfs"):
+                self.dfs[tid] = df
+        except sqlite3.OperationalError:
+            pass  # the statistics are not computed yet
+        try:
+            self.max_impacts = array('d', bytes(8 * len(self.terms)))
+            self.field_max_impacts = [array('d', bytes(8 * len(self.terms))) for _ in FIELDS]
+            for tid, max_impact, *field_max_impacts in connection.execute(
+                    f"SELECT tid, max_impact, {', '.join(FIELDS)} FROM max_impacts"):
+                self.max_impacts[tid] = max_impact
+                for field, field_max_impact in enumerate(field_max_impacts):
+                    self.field_max_impacts[field][tid] = field_max_impact
+            self.max_impact_weights = connection.execute(
+                f"SELECT {', '.join(FIELDS)} FROM max_impact_weights").fetchone()
+        except sqlite3.OperationalError:
+            self.max_impacts = None  # db created before the max_impacts table existed
+
+    @classmethod
+    def from_arrays(cls, terms: Sequence[str], tids: Mapping[str, int], dfs: Sequence[int],
+                    max_impacts: Optional[List[Sequence[float]]],
+                    max_impact_weights: Tuple[float, float, float]) -> "TermDictionary":
+        """Return a read-only dictionary of the given terms and arrays indexed by tid, e.g. views of a snapshot file.
+        max_impacts holds the max impacts followed by the ones of every field, None if there are none."""
+        dictionary = cls.__new__(cls)
+        dictionary.terms, dictionary.tids, dictionary.dfs, dictionary.new = terms, tids, dfs, []
+        dictionary.max_impacts = max_impacts[0] if max_impacts is not None else None
+        dictionary.field_max_impacts = max_impacts[1:] if max_impacts is not None else []
+        dictionary.max_impact_weights = max_impact_weights
+        return dictionary
+
+    def __len__(self):
+        return len(self.terms)
+
+    def tid(self, term: str) -> int:
+        """Return the term id of a term, raises a KeyError for unknown terms"""
+        return self.tids[term]
+
+    def add(self, term: str) -> int:
+        """Return the term id of a term, unknown terms get the next free one"""
+        try:
+            return self.tids[term]
+        except KeyError:
+            tid = self.tids[term] = len(self.terms)
+            self.terms.append(term)
+            self.dfs.append(0)
+            if self.max_impacts is not None:
+                self.max_impacts.append(0.0)
+                for field_max_impacts in self.field_max_impacts:
+                    field_max_impacts.append(0.0)
+            self.new.append((tid, term))
+            return tid
+
+    def max_impact(self, tid: int, weights: Tuple[float, float, float]) -> float:
+        """Return an upper bound of the tf * static boost of all postings of a term, with the tfs of the fields weighted
+        by the given weights. The weighted sum of the max impacts of the fields is one, the max impact scaled by the
+        largest ratio of the weights to the max_impact_weights another one, which is exact for the same weights."""
+        bound = sum(weight * impacts[tid] for weight, impacts in zip(weights, self.field_max_impacts))
+        ratios = list(zip(weights, self.max_impact_weights))
+        if all(weight <= 0 or computed > 0 for weight, computed in ratios):
+            scale = max((weight / computed for weight, computed in ratios if computed > 0), default=0.0)
+            bound = min(bound, scale * self.max_impacts[tid])
+        return bound
+
+    def convert(self, rows: Iterable[Tuple[int, str, int, int, int]]) -> List[Tuple[int, int, int, int, int]]:
+        """Converts (did, term, content_tf, title_tf, abstract_tf) rows of the tfs table into rows with the tid instead
+        of the term, adding unknown terms"""
+        return [(did, self.add(term), content_tf, title_tf, abstract_tf)
+                for did, term, content_tf, title_tf, abstract_tf in rows]
+
+    def new_terms(self) -> List[Tuple[int, str]]:
+        """Return the (tid, term) rows of the terms added since the last call, to insert them into the terms table"""
+        new, self.new = self.new, []
+        return new
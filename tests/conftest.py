@@ -0,0 +1,50 @@
+import os
+import sys
+
+# the modules in src import each other by their bare names
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import pytest
+
+from db import DB_NAME, open_db
+from helpers import build
+from impact_index import IMPACTS_NAME, ImpactOrderedIndex
+from importer import Importer
+from posting_list import InvertedIndex
+from query_processing import QueryProcessor
+from segments import open_index
+from synthetic_corpus import SyntheticCorpus
+
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory):
+    """Two parts of a small synthetic corpus, the second one is ingested into the segmented index"""
+    root = tmp_path_factory.mktemp("corpus")
+    SyntheticCorpus(vocabulary_size=300, seed=1).write(str(root / "a"), 150)
+    SyntheticCorpus(vocabulary_size=300, seed=2).write(str(root / "b"), 60, first_id=2000000)
+    return root
+
+
+@pytest.fixture(scope="session")
+def single(corpus, tmp_path_factory):
+    """The directory and a connection of an index of the whole corpus"""
+    directory = str(tmp_path_factory.mktemp("single"))
+    build(directory, Importer.iter_dir(str(corpus)))
+    connection = open_db(os.path.join(directory, DB_NAME))
+    yield directory, connection
+    connection.close()
+
+
+@pytest.fixture(scope="session")
+def exhaustive(single):
+    """Processes the queries term-at-a-time over the tfs table"""
+    return QueryProcessor(single[1], InvertedIndex(single[1]))
+
+
+@pytest.fixture(scope="session")
+def compressed(single):
+    """Processes the queries over the posting file, the impact ordered index and the snapshot"""
+    directory, connection = single
+    index = open_index(connection, directory=directory)
+    impacts = ImpactOrderedIndex(connection, os.path.join(directory, IMPACTS_NAME), index.store, index.terms)
+    return QueryProcessor(connection, index, impacts=impacts)
@@ -0,0 +1,35 @@
+"""Queries and helpers shared by the tests"""
+import os
+
+import pytest
+
+from compressed_index import write_segment_postings
+from db import DB_NAME, compute_statistics, create_db, insert_records
+from impact_index import IMPACTS_NAME, write_impact_index
+from parser import Parser
+from posting_list import create_indices
+from synthetic_corpus import SyntheticCorpus
+
+# the queries are made of the words of the given Zipf ranks, frequent and rare ones, repeated and unknown ones
+QUERIES = [" ".join(SyntheticCorpus._word(rank) if rank >= 0 else "nosuchterm" for rank in ranks)
+           for ranks in [(0,), (1, 2), (3, 7, 50), (4, 10, 4), (5, 120), (2, 9, 11, 30), (-1, 1), (-1,)]]
+KS = [-1, 0, 1, 10]
+
+
+def build(directory, paths):
+    """Builds a complete index of the articles in paths with posting files, impact ordered index and snapshot"""
+    with create_db(os.path.join(directory, DB_NAME)) as connection:
+        insert_records(connection, (Parser.parse(path).convert_to_record() for path in paths))
+        compute_statistics(connection)
+        create_indices(connection, directory)
+        write_segment_postings(connection, directory=directory)
+        write_impact_index(connection, os.path.join(directory, IMPACTS_NAME))
+    connection.close()
+
+
+def assert_same(results, expected, k):
+    """The scores have to match, the documents as well, unless they tie at the end of the top k"""
+    assert [acc.score for acc in results] == pytest.approx([acc.score for acc in expected], rel=1e-12)
+    if k == -1:
+        assert sorted((acc.did, acc.score) for acc in results) == \
+               pytest.approx(sorted((acc.did, acc.score) for acc in expected), rel=1e-12)
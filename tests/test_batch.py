@@ -0,0 +1,83 @@
+"""Batch mode has to return the results of the QueryProcessor, written in the requested format."""
+import io
+import json
+
+import pytest
+
+from batch import batch, open_batch_index, percentile, process_chunk, run_batch
+from db import get_documents
+from helpers import QUERIES, assert_same
+from posting_list import DEFAULT_WEIGHTS
+from query_processing import Accumulator
+
+OPTIONS = [
+    pytest.param({}, id="default"),
+    pytest.param({"conjunctive": True}, id="conjunctive"),
+    pytest.param({"impact_ordered": True}, id="impact-ordered"),
+    pytest.param({"impact_ordered": True, "budget": 50}, id="budget"),
+    pytest.param({"date_from": 20000301, "date_to": 20000930, "max_page": 20}, id="filters"),
+]
+
+
+@pytest.fixture
+def in_db(single, monkeypatch):
+    """Runs the test inside the directory of the db, like the batch mode"""
+    monkeypatch.chdir(single[0])
+    return single[1]
+
+
+def test_percentile():
+    values = [float(value) for value in range(100, 0, -1)]
+    assert [percentile(values, p) for p in (0, 1, 50, 95, 99, 100)] == [1, 1, 50, 95, 99, 100]
+    assert [percentile([4, 1, 3, 2], p) for p in (25, 26, 50, 51, 75, 100)] == [1, 2, 2, 3, 3, 4]
+    assert percentile([7], 99) == 7
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+@pytest.mark.parametrize("options", OPTIONS)
+def test_run_batch(in_db, compressed, options, processes):
+    results = run_batch(QUERIES, 10, processes, chunk_size=3, **options)
+    assert [result.query for result in results] == QUERIES
+    for result in results:
+        assert_same([Accumulator(did, score) for did, score in result.results],
+                    compressed.process(result.query, 10, **options), 10)
+
+
+def test_cache_budget(in_db, compressed):
+    """The posting lists shared by the queries of a process never take more than the budget"""
+    index, _ = open_batch_index(in_db, 4096, DEFAULT_WEIGHTS)
+    for result in process_chunk(in_db, index, None, QUERIES * 3, 10):
+        assert_same([Accumulator(did, score) for did, score in result.results],
+                    compressed.process(result.query, 10), 10)
+    assert 0 < len(index.cache) and 0 < index.cache.size <= 4096
+
+
+def test_tsv(in_db, capsys):
+    output = io.StringIO()
+    batch(io.StringIO("\n".join(QUERIES[:3]) + "\n\n"), output, k=5)
+    lines = output.getvalue().splitlines()
+    assert lines[0] == "query\trank\tscore\tdid\turl\ttitle"
+    rows = [line.split("\t") for line in lines[1:]]
+    assert {row[0] for row in rows} == set(QUERIES[:3])
+    documents = get_documents(in_db, {int(row[3]) for row in rows})
+    for query in QUERIES[:3]:
+        hits = [row for row in rows if row[0] == query]
+        assert [int(row[1]) for row in hits] == list(range(1, 6))
+        assert [float(row[2]) for row in hits] == sorted((float(row[2]) for row in hits), reverse=True)
+        for row in hits:
+            assert row[4:] == [documents[int(row[3])][1], documents[int(row[3])][0]]
+    assert "3 queries in" in capsys.readouterr().err
+
+
+def test_json(in_db, compressed):
+    output = io.StringIO()
+    batch(io.StringIO("\n".join(QUERIES)), output, k=3, format_="json")
+    results = json.loads(output.getvalue())
+    assert [result["query"] for result in results] == QUERIES
+    for result in results:
+        assert result["latency"] >= 0
+        expected = compressed.process(result["query"], 3)
+        assert [hit["rank"] for hit in result["results"]] == list(range(1, len(expected) + 1))
+        assert [hit["did"] for hit in result["results"]] == [acc.did for acc in expected]
+        documents = get_documents(in_db, [acc.did for acc in expected])
+        assert [(hit["title"], hit["url"]) for hit in result["results"]] == [documents[acc.did] for acc in expected]
@@ -0,0 +1,67 @@
+"""The bulk load has to produce the same tables as the normal build, only the tids may be assigned differently."""
+import pytest
+
+from bulk_load import bulk_load_dir
+from db import create_db, open_db
+from helpers import QUERIES, assert_same
+from posting_list import InvertedIndex
+from query_processing import QueryProcessor
+
+
+@pytest.fixture(scope="module", params=[1, 2], ids=["1 process", "2 processes"])
+def bulk(corpus, tmp_path_factory, request):
+    """A connection of a db of the whole corpus built in bulk load mode"""
+    directory = tmp_path_factory.mktemp("bulk")
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(directory)
+        create_db().close()
+        bulk_load_dir(str(corpus), request.param)
+        connection = open_db()
+    yield connection
+    connection.close()
+
+
+def rows(connection, query):
+    return sorted(connection.execute(query).fetchall())
+
+
+# the tables keyed by term instead of tid
+BY_TERM = {
+    "terms": "SELECT term FROM terms",
+    "tfs": "SELECT did, term, content_tf, title_tf, abstract_tf FROM tfs JOIN terms USING (tid)",
+    "dfs": "SELECT term, df FROM dfs JOIN terms USING (tid)",
+    "max_impacts": "SELECT term, max_impact, content, title, abstract FROM max_impacts JOIN terms USING (tid)",
+}
+
+
+@pytest.mark.parametrize("table", ["docs", "boost", "dls", "d", "max_page", "static_boosts", "max_impact_weights"])
+def test_tables(single, bulk, table):
+    expected = rows(single[1], f"SELECT * FROM {table}")
+    assert expected
+    assert rows(bulk, f"SELECT * FROM {table}") == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("table", BY_TERM)
+def test_tables_by_term(single, bulk, table):
+    expected = rows(single[1], BY_TERM[table])
+    assert expected
+    assert rows(bulk, BY_TERM[table]) == pytest.approx(expected)
+
+
+def test_tids(bulk):
+    """The tids are dense and unique"""
+    tids = [tid for tid, in bulk.execute("SELECT tid FROM terms ORDER BY tid")]
+    assert tids == list(range(len(tids)))
+
+
+def test_pragmas(bulk):
+    """The bulk load pragmas don't outlast the load"""
+    assert bulk.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    assert bulk.execute("PRAGMA locking_mode").fetchone()[0] == "normal"
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_queries(bulk, exhaustive, query):
+    processor = QueryProcessor(bulk, InvertedIndex(bulk))
+    for k in (-1, 10):
+        assert_same(processor.process(query, k), exhaustive.process(query, k), k)
@@ -0,0 +1,24 @@
+"""Conjunctive processing has to return the documents of the exhaustive top k that contain all terms."""
+import pytest
+
+from helpers import KS, QUERIES, assert_same
+from parser import Parser
+
+
+@pytest.mark.parametrize("k", KS)
+@pytest.mark.parametrize("query", QUERIES)
+def test_conjunctive(exhaustive, compressed, query, k):
+    terms = set(Parser.tokenize([query]))
+    index = exhaustive.index
+    docnos = [{posting.docno for posting in index.getIndexList(term)} for term in terms]
+    matching = {index.store.dids[docno] for docno in set.intersection(*docnos)}
+    expected = [acc for acc in exhaustive.process(query, -1) if acc.did in matching]
+    expected = expected if k == -1 else expected[:k]
+    assert_same(exhaustive.process(query, k, conjunctive=True), expected, k)
+    assert_same(compressed.process(query, k, conjunctive=True), expected, k)
+
+
+@pytest.mark.parametrize("k", [-2, -1000])
+def test_invalid_k(compressed, k):
+    with pytest.raises(ValueError):
+        compressed.process(QUERIES[1], k, conjunctive=True)
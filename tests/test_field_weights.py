@@ -0,0 +1,68 @@
+"""Searching with other field weights has to return the same results as an index built with those weights."""
+import os
+
+import pytest
+
+import constants
+from db import DB_NAME, open_db
+from helpers import KS, QUERIES, assert_same, build
+from impact_index import ImpactOrderedIndex, write_impact_index
+from importer import Importer
+from posting_list import FieldWeights, InvertedIndex, np
+from query_processing import QueryProcessor
+from segments import open_index
+
+WEIGHTS = [FieldWeights(1.0, 0.0, 0.0), FieldWeights(0.0, 1.0, 1.0), FieldWeights(0.5, 4.0, 1.5)]
+ENGINES = [
+    pytest.param({}, id="exhaustive"),
+    pytest.param({"pruning": True}, id="maxscore"),
+    pytest.param({"vectorized": True}, id="vectorized",
+                 marks=pytest.mark.skipif(np is None, reason="vectorized query processing requires numpy")),
+    pytest.param({"impact_ordered": True}, id="impact-ordered"),
+    pytest.param({"conjunctive": True}, id="conjunctive"),
+]
+
+
+@pytest.fixture(scope="module", params=WEIGHTS, ids=str)
+def rebuilt(request, corpus, tmp_path_factory):
+    """The weights and an index built with them as the tunable weights in constants.py"""
+    weights = request.param
+    directory = str(tmp_path_factory.mktemp("rebuilt"))
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(constants, "TUNABLE_WEIGHT_CONTENT", weights.content)
+        patch.setattr(constants, "TUNABLE_WEIGHT_TITLE", weights.title)
+        patch.setattr(constants, "TUNABLE_WEIGHT_ABSTRACT", weights.abstract)
+        build(directory, Importer.iter_dir(str(corpus)))
+    connection = open_db(os.path.join(directory, DB_NAME))
+    yield weights, QueryProcessor(connection, InvertedIndex(connection), weights=weights)
+    connection.close()
+
+
+@pytest.fixture(scope="module")
+def weighted(single, rebuilt, tmp_path_factory):
+    """Processes the queries with the weights over the index built with the default weights"""
+    weights = rebuilt[0]
+    directory, connection = single
+    index = open_index(connection, directory=directory)
+    path = str(tmp_path_factory.mktemp("impacts") / "nyt.impacts")
+    write_impact_index(connection, path, index.store, index.terms, weights)
+    impacts = ImpactOrderedIndex(connection, path, index.store, index.terms)
+    return QueryProcessor(connection, index, impacts=impacts, weights=weights)
+
+
+@pytest.mark.parametrize("k", KS)
+@pytest.mark.parametrize("options", ENGINES)
+@pytest.mark.parametrize("query", QUERIES)
+def test_weights(rebuilt, weighted, query, k, options):
+    expected = rebuilt[1].process(query, k, conjunctive=options.get("conjunctive", False))
+    assert_same(weighted.process(query, k, **options), expected, k)
+
+
+def test_max_impacts(rebuilt, weighted):
+    """The max impacts of the default weights bound the ones computed with the weights"""
+    weights, expected = rebuilt
+    terms, exact = weighted.index.terms, expected.index.terms
+    assert list(terms.terms) == list(exact.terms)
+    for tid in range(len(terms)):
+        assert terms.max_impact(tid, weights) >= exact.max_impacts[tid] * (1 - 1e-12)
+        assert exact.max_impact(tid, weights) == pytest.approx(exact.max_impacts[tid], rel=1e-12)
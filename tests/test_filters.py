@@ -0,0 +1,44 @@
+"""Filtered queries have to return the unfiltered results of the documents passing the filter."""
+import pytest
+
+from helpers import KS, QUERIES, assert_same
+from posting_list import np
+
+ENGINES = [
+    pytest.param({}, id="exhaustive"),
+    pytest.param({"pruning": True}, id="maxscore"),
+    pytest.param({"vectorized": True}, id="vectorized",
+                 marks=pytest.mark.skipif(np is None, reason="vectorized query processing requires numpy")),
+    pytest.param({"impact_ordered": True}, id="impact-ordered"),
+    pytest.param({"conjunctive": True}, id="conjunctive"),
+]
+FILTERS = [
+    dict(date_from=20000315),
+    dict(date_to=20000620),
+    dict(date_from=20000405, date_to=20000418),
+    dict(date_from=20000301, date_to=20000930, max_page=20),
+    dict(max_page=10),
+    dict(max_page=100),  # articles without a page count as printed on page 100
+    dict(date_from=20010101),
+]
+
+
+def passes(store, docno, date_from=None, date_to=None, max_page=None):
+    day = store.dates[docno] // 1000000  # the dates are stored with the time like 20000131000000
+    return (date_from is None or day >= date_from) and (date_to is None or day <= date_to) and \
+           (max_page is None or store.pages[docno] <= max_page)
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("k", KS)
+@pytest.mark.parametrize("options", ENGINES)
+@pytest.mark.parametrize("query", QUERIES)
+def test_filters(exhaustive, compressed, query, k, options, filters):
+    store = exhaustive.store
+    passing = {store.dids[docno] for docno in range(len(store)) if passes(store, docno, **filters)}
+    conjunctive = options.get("conjunctive", False)
+    expected = [acc for acc in exhaustive.process(query, -1, conjunctive=conjunctive) if acc.did in passing]
+    expected = expected if k == -1 else expected[:k]
+    assert_same(compressed.process(query, k, **options, **filters), expected, k)
+    if "impact_ordered" not in options:
+        assert_same(exhaustive.process(query, k, **options, **filters), expected, k)
@@ -0,0 +1,16 @@
+"""Impact ordered processing has to return the same top k as the exhaustive term-at-a-time path."""
+import pytest
+
+from helpers import KS, QUERIES, assert_same
+
+
+@pytest.mark.parametrize("k", KS)
+@pytest.mark.parametrize("query", QUERIES)
+def test_impact_ordered(exhaustive, compressed, query, k):
+    assert_same(compressed.process(query, k, impact_ordered=True), exhaustive.process(query, k), k)
+
+
+@pytest.mark.parametrize("k", [-2, -1000])
+def test_invalid_k(compressed, k):
+    with pytest.raises(ValueError):
+        compressed.process(QUERIES[1], k, impact_ordered=True)
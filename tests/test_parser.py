@@ -0,0 +1,68 @@
+"""The tokens and term counts have to be the ones of the original tokenizer, which cleaned every paragraph alone."""
+import random
+import re
+import xml.etree.ElementTree as XML
+from collections import Counter
+
+import pytest
+
+from importer import Importer
+from parser import Parser
+
+_OLD_REGEX = re.compile(r'[^a-zA-Z0-9 ]+(?<!( |\.)[a-zA-Z]\.)')
+
+PARAGRAPHS = [
+    [],
+    [""],
+    ["U.S. troops", "e.g. the A. B. C. end."],
+    ["ends with A.", "B. starts the next one"],
+    ["ends with a.", ".b starts", "A", ".", "x.y.z. and U.S.A.", " a. b."],
+    ["well-known $100 9/11 (AP) -- it's", "tab\tand\nnewline", "Ünïcödé ÉTÉ straße İstanbul"],
+    ["...", "a.", "A. ", " .A.", "z.Z.", "AB. cd. E.F"],
+]
+
+
+def old_tokenize(paragraphs):
+    return " ".join(_OLD_REGEX.sub(" ", paragraph).lower() for paragraph in paragraphs).split()
+
+
+def fuzzed(seed):
+    """Random paragraphs of characters that can occur in the xml, dense in dots, spaces and single letters"""
+    generator = random.Random(seed)
+    alphabet = "aAbZz09 ..--'\t\néÄß$"
+    return [["".join(generator.choices(alphabet, k=generator.randrange(12))) for _ in range(generator.randrange(5))]
+            for _ in range(5000)]
+
+
+@pytest.mark.parametrize("paragraphs", PARAGRAPHS)
+def test_tokenize(paragraphs):
+    assert Parser.tokenize(paragraphs) == old_tokenize(paragraphs)
+
+
+@pytest.mark.parametrize("paragraphs", PARAGRAPHS)
+def test_count_terms(paragraphs):
+    assert_counts(paragraphs)
+
+
+def assert_counts(paragraphs):
+    title, abstract = " ".join(paragraphs[:1]), " ".join(paragraphs[-1:])
+    assert Parser.count_terms(paragraphs, title, abstract) == \
+           (Counter(old_tokenize(paragraphs)), Counter(old_tokenize([title])), Counter(old_tokenize([abstract])))
+
+
+def test_fuzzed():
+    for paragraphs in fuzzed(2000):
+        assert Parser.tokenize(paragraphs) == old_tokenize(paragraphs)
+        assert_counts(paragraphs)
+
+
+def test_parse(corpus):
+    for path in Importer.iter_dir(str(corpus)):
+        document = Parser.parse(path)
+        root = XML.parse(path).getroot()
+        content = [par.text for par in root.findall("./body/body.content/block[@class='full_text']/p")]
+        abstract = root.find("./body/body.head/abstract/p")
+        assert document.content == content
+        assert document.content_counter == Counter(old_tokenize(content))
+        assert document.title_counter == Counter(old_tokenize([root.find("./head/title").text]))
+        assert document.abstract_counter == Counter(old_tokenize([abstract.text if abstract is not None else ""]))
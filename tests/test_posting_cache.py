@@ -0,0 +1,90 @@
+"""The posting cache has to stay within its budget, evict the lists worth the least first and keep pinned lists."""
+from array import array
+
+import pytest
+
+from helpers import QUERIES, assert_same
+from posting_cache import PostingCache, postings_size
+from posting_list import DEFAULT_WEIGHTS, InvertedIndex
+from query_processing import QueryProcessor
+
+
+def postings(length):
+    return array("q", range(length)), array("d", [1.0] * length)
+
+
+def looked_up(cache, term, times):
+    for _ in range(times):
+        cache.get(term, DEFAULT_WEIGHTS)
+
+
+def test_budget():
+    cache = PostingCache(3 * postings_size(postings(10)))
+    for i in range(20):
+        looked_up(cache, f"t{i}", i % 4 + 1)
+        cache.put(f"t{i}", DEFAULT_WEIGHTS, postings(10))
+        assert cache.size <= cache.budget
+        assert cache.size == sum(postings_size(entry) for entry in cache.entries.values())
+    assert len(cache) == 3
+    assert not cache.put("huge", DEFAULT_WEIGHTS, postings(10000))
+    assert not cache.admits("huge", 10000)
+
+
+def test_eviction_order():
+    cache = PostingCache(3 * postings_size(postings(10)))
+    for term, times in (("a", 3), ("b", 1), ("c", 2)):
+        looked_up(cache, term, times)
+        assert cache.put(term, DEFAULT_WEIGHTS, postings(10))
+    # d is worth more than b only
+    looked_up(cache, "d", 2)
+    assert cache.admits("d", 10)
+    assert cache.put("d", DEFAULT_WEIGHTS, postings(10))
+    assert set(key for key, _ in cache.entries) == {"a", "c", "d"}
+    # e is worth as much as the least worth entries, so nothing is evicted for it
+    looked_up(cache, "e", 2)
+    assert not cache.admits("e", 10)
+    assert not cache.put("e", DEFAULT_WEIGHTS, postings(10))
+    # look ups make an entry worth more, c is worth the least now
+    looked_up(cache, "d", 5)
+    looked_up(cache, "e", 1)
+    assert cache.put("e", DEFAULT_WEIGHTS, postings(10))
+    assert set(key for key, _ in cache.entries) == {"a", "d", "e"}
+    assert cache.evictions == 2
+
+
+def test_pinning():
+    cache = PostingCache(2 * postings_size(postings(10)))
+    assert cache.put("pinned", DEFAULT_WEIGHTS, postings(10), pin=True)
+    looked_up(cache, "other", 1)
+    assert cache.put("other", DEFAULT_WEIGHTS, postings(10))
+    # pinned lists only take free space, they never evict
+    assert not cache.put("late", DEFAULT_WEIGHTS, postings(10), pin=True)
+    looked_up(cache, "frequent", 100)
+    assert cache.put("frequent", DEFAULT_WEIGHTS, postings(10))
+    assert set(key for key, _ in cache.entries) == {"pinned", "frequent"}
+    assert cache.stats()["pinned"] == 1
+
+
+def test_weights():
+    cache = PostingCache(10 * postings_size(postings(10)))
+    cache.put("a", DEFAULT_WEIGHTS, postings(10))
+    assert cache.get("a", DEFAULT_WEIGHTS) is not None
+    assert cache.get("a", (1.0, 0.0, 0.0)) is None
+
+
+@pytest.mark.parametrize("pinned", [0, 5])
+@pytest.mark.parametrize("budget", [2000, 100000])
+def test_processor(single, exhaustive, budget, pinned):
+    """Queries over cached posting lists return the same results"""
+    connection = single[1]
+    index = InvertedIndex(connection)
+    index.cachePostings(PostingCache(budget))
+    if pinned:
+        # the lists of the most frequent terms don't fit into the small budget
+        assert (0 < index.pinPostings(pinned) <= pinned) == (budget > 2000)
+    processor = QueryProcessor(connection, index)
+    for options in ({}, {"pruning": True}, {"max_page": 20}):
+        for query in QUERIES * 2:
+            assert_same(processor.process(query, 10, **options), exhaustive.process(query, 10, **options), 10)
+    assert index.cache.size <= budget
+    assert index.cache.hits > 0
@@ -0,0 +1,93 @@
+"""The query cache has to return the results of the current version of the index only."""
+import sqlite3
+
+import pytest
+
+import query_cache
+from db import DB_NAME, bump_index_version, open_db
+from helpers import QUERIES, build
+from importer import Importer
+from posting_list import FieldWeights, InvertedIndex
+from query_cache import QueryCache
+from query_processing import QueryProcessor
+
+RESULTS = [(1, 2.0), (3, 1.0)]
+
+
+@pytest.fixture
+def connection():
+    connection = sqlite3.connect(":memory:")
+    yield connection
+    connection.close()
+
+
+def test_keys(connection):
+    cache = QueryCache(connection)
+    cache.put(["a", "b"], 10, RESULTS)
+    assert cache.get(["a", "b"], 10) == RESULTS
+    assert cache.get(["b", "a"], 10) is None
+    assert cache.get(["a", "b"], 5) is None
+    assert cache.get(["a", "b"], 10, conjunctive=True) is None
+    assert cache.get(["a", "b"], 10, weights=FieldWeights(1.0, 0.0, 0.0)) is None
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_lru(connection):
+    cache = QueryCache(connection, max_size=2)
+    cache.put(["a"], 10, RESULTS)
+    cache.put(["b"], 10, RESULTS)
+    cache.get(["a"], 10)
+    cache.put(["c"], 10, RESULTS)
+    assert len(cache) == 2
+    assert cache.get(["b"], 10) is None
+    assert cache.get(["a"], 10) == cache.get(["c"], 10) == RESULTS
+
+
+def test_ttl(connection, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(query_cache.time, "time", lambda: now[0])
+    cache = QueryCache(connection, ttl=60)
+    cache.put(["a"], 10, RESULTS)
+    now[0] += 60
+    assert cache.get(["a"], 10) == RESULTS
+    now[0] += 1
+    assert cache.get(["a"], 10) is None
+
+
+def test_index_version(connection):
+    cache = QueryCache(connection)
+    cache.put(["a"], 10, RESULTS)
+    bump_index_version(connection)
+    assert cache.get(["a"], 10) is None
+    assert len(cache) == 0 and cache.version == 1
+    cache.put(["a"], 10, RESULTS)
+    assert cache.get(["a"], 10) == RESULTS
+
+
+def test_file(connection, tmp_path):
+    path = str(tmp_path / "cache")
+    cache = QueryCache(connection, path=path)
+    cache.put(["a"], 10, RESULTS)
+    cache.save()
+    assert QueryCache(connection, path=path).get(["a"], 10) == RESULTS
+    bump_index_version(connection)
+    assert len(QueryCache(connection, path=path)) == 0
+
+
+def test_processor(corpus, tmp_path):
+    """A processor answers repeated queries from the cache until the index changes"""
+    build(str(tmp_path), Importer.iter_dir(str(corpus / "a")))
+    connection = open_db(str(tmp_path / DB_NAME))
+    cache = QueryCache(connection)
+    processor = QueryProcessor(connection, InvertedIndex(connection), cache)
+    expected = processor.process(QUERIES[2], 10)
+    assert processor.process(QUERIES[2], 10) == expected
+    assert (cache.hits, cache.misses) == (1, 1)
+    # filtered results are not cached
+    processor.process(QUERIES[2], 10, max_page=10)
+    assert len(cache) == 1
+    bump_index_version(connection)
+    assert [(acc.did, acc.score) for acc in processor.process(QUERIES[2], 10)] == \
+           [(acc.did, acc.score) for acc in expected]
+    assert (cache.hits, cache.misses) == (1, 2)
+    connection.close()
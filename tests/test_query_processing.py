@@ -0,0 +1,25 @@
+"""MaxScore has to return the same top k as the exhaustive term-at-a-time path."""
+import pytest
+
+from helpers import KS, QUERIES, assert_same
+
+ENGINES = [pytest.param({}, id="exhaustive"), pytest.param({"pruning": True}, id="maxscore")]
+
+
+@pytest.mark.parametrize("k", KS)
+@pytest.mark.parametrize("options", ENGINES)
+@pytest.mark.parametrize("query", QUERIES)
+def test_engines(exhaustive, compressed, query, k, options):
+    expected = exhaustive.process(query, k)
+    assert expected or k == 0 or query == "nosuchterm"
+    assert_same(compressed.process(query, k, **options), expected, k)
+    assert_same(exhaustive.process(query, k, **options), expected, k)
+    if k == 0:
+        assert expected == []
+
+
+@pytest.mark.parametrize("options", ENGINES)
+@pytest.mark.parametrize("k", [-2, -1000])
+def test_invalid_k(compressed, k, options):
+    with pytest.raises(ValueError):
+        compressed.process(QUERIES[1], k, **options)
@@ -0,0 +1,75 @@
+"""An index with ingested segments has to return the same top k as an index built of all documents at once."""
+import itertools
+
+import pytest
+
+import db
+import segments
+from db import DB_NAME, get_segments, open_db
+from helpers import KS, QUERIES, assert_same, build
+from importer import Importer
+from posting_list import np
+from query_processing import QueryProcessor
+from segments import ingest_dir, open_index
+
+ENGINES = [
+    pytest.param({}, id="exhaustive"),
+    pytest.param({"pruning": True}, id="maxscore"),
+    pytest.param({"vectorized": True}, id="vectorized",
+                 marks=pytest.mark.skipif(np is None, reason="vectorized query processing requires numpy")),
+]
+
+
+@pytest.fixture(scope="module")
+def segmented(corpus, tmp_path_factory):
+    directory = tmp_path_factory.mktemp("segmented")
+    build(str(directory), Importer.iter_dir(str(corpus / "a")))
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(directory)
+        ingest_dir(str(corpus / "b"), 1)
+    connection = open_db(str(directory / DB_NAME))
+    yield QueryProcessor(connection, open_index(connection, directory=str(directory)))
+    connection.close()
+
+
+@pytest.mark.parametrize("k", KS)
+@pytest.mark.parametrize("options", ENGINES)
+@pytest.mark.parametrize("query", QUERIES)
+def test_segments(exhaustive, segmented, query, k, options):
+    assert_same(segmented.process(query, k, **options), exhaustive.process(query, k), k)
+
+
+def crash_inserting(patch):
+    """Crashes after some of the documents were inserted"""
+    def insert_records(connection, records, table):
+        def crash():
+            raise KeyboardInterrupt
+        db.insert_records(connection, itertools.chain(itertools.islice(records, 30), iter(crash, None)), 1, table)
+    patch.setattr(segments, "insert_records", insert_records)
+
+
+def crash_updating(patch):
+    """Crashes in the middle of updating the statistics"""
+    def get_max_page(connection):
+        raise KeyboardInterrupt
+    patch.setattr(db, "get_max_page", get_max_page)
+
+
+@pytest.mark.parametrize("crash", [crash_inserting, crash_updating])
+def test_crashed_ingest(corpus, exhaustive, tmp_path, monkeypatch, crash):
+    build(str(tmp_path), Importer.iter_dir(str(corpus / "a")))
+    monkeypatch.chdir(tmp_path)
+    with monkeypatch.context() as patch:
+        crash(patch)
+        with pytest.raises(KeyboardInterrupt):
+            ingest_dir(str(corpus / "b"), 1)
+    ingest_dir(str(corpus / "b"), 1)
+    with open_db() as connection:
+        assert all(version is not None for _, _, version in get_segments(connection))
+        for table in ("docs", "boost", "dls", "static_boosts"):
+            assert connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 210
+        processor = QueryProcessor(connection, open_index(connection))
+        for query, k in itertools.product(QUERIES, KS):
+            assert_same(processor.process(query, k), exhaustive.process(query, k), k)
+            assert_same(processor.process(query, k, pruning=True), exhaustive.process(query, k), k)
+    connection.close()
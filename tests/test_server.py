@@ -0,0 +1,83 @@
+"""The server has to reject invalid k and filters and answer valid queries like the query processors do."""
+import json
+import os
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import pytest
+
+from helpers import QUERIES
+from server import ProcessorPool, SearchHandler, SearchServer
+
+
+@pytest.fixture(scope="module")
+def server(single):
+    """A server with a posting cache, answering on a free port"""
+    cwd = os.getcwd()
+    os.chdir(single[0])
+    try:
+        pool = ProcessorPool(2, profile=True, cache_budget=1 << 20)
+    finally:
+        os.chdir(cwd)
+    server = SearchServer(("127.0.0.1", 0), SearchHandler)
+    server.pool = pool
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    while not pool.processors.empty():
+        pool.processors.get()[0].close()
+
+
+def get(server, path, **parameters):
+    """Return the status and the json body of a request"""
+    url = f"{server}{path}?{urllib.parse.urlencode(parameters)}"
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+@pytest.mark.parametrize("parameters", [
+    {"k": "abc"}, {"k": "1.5"}, {"k": "0"}, {"k": "-2"}, {"k": "-1000"},
+    {"from": "2000-01-01"}, {"to": "x"}, {"max_page": "first"},
+])
+def test_invalid(server, parameters):
+    status, body = get(server, "/search", q=QUERIES[1], **parameters)
+    assert status == 400
+    assert "error" in body
+
+
+def test_unknown_path(server):
+    assert get(server, "/nothing")[0] == 404
+
+
+@pytest.mark.parametrize("parameters", [
+    {}, {"k": "1"}, {"k": "-1"}, {"op": "and"}, {"max_page": "20"}, {"from": "20000201", "to": "20000630"},
+])
+@pytest.mark.parametrize("query", QUERIES)
+def test_search(server, exhaustive, query, parameters):
+    status, body = get(server, "/search", q=query, **parameters)
+    assert status == 200
+    k = int(parameters.get("k", 10))
+    options = {"date_from": "from", "date_to": "to", "max_page": "max_page"}
+    filters = {option: int(parameters[name]) for option, name in options.items() if name in parameters}
+    expected = exhaustive.process(query, k, conjunctive=parameters.get("op") == "and", **filters)
+    assert body["k"] == k
+    assert body["op"] == parameters.get("op", "or")
+    assert body["filters"] == {name: int(parameters[name]) for name in options.values() if name in parameters}
+    assert [result["rank"] for result in body["results"]] == list(range(1, len(expected) + 1))
+    for result, acc in zip(body["results"], expected):
+        assert result["score"] == pytest.approx(acc.score)
+
+
+def test_stats(server):
+    get(server, "/search", q=QUERIES[0])
+    status, body = get(server, "/stats")
+    assert status == 200
+    assert body["pid"] == os.getpid()
+    assert "posting_cache" in body
@@ -0,0 +1,42 @@
+"""A sharded index has to return the same top k as a single index of all documents."""
+import pytest
+
+from helpers import KS, QUERIES, assert_same
+from posting_list import FieldWeights, InvertedIndex, np
+from query_processing import QueryProcessor
+from shards import ShardedQueryProcessor, build_shards
+
+ENGINES = [
+    pytest.param({}, id="exhaustive"),
+    pytest.param({"pruning": True}, id="maxscore"),
+    pytest.param({"vectorized": True}, id="vectorized",
+                 marks=pytest.mark.skipif(np is None, reason="vectorized query processing requires numpy")),
+]
+
+
+@pytest.fixture(scope="module")
+def shards(corpus, tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("sharded") / "shards")
+    build_shards(str(corpus), 3, 1, directory)
+    return directory
+
+
+@pytest.fixture(scope="module")
+def sharded(shards):
+    with ShardedQueryProcessor(shards, 1) as processor:
+        yield processor
+
+
+@pytest.mark.parametrize("k", KS)
+@pytest.mark.parametrize("options", ENGINES)
+@pytest.mark.parametrize("query", QUERIES)
+def test_shards(exhaustive, sharded, query, k, options):
+    assert_same(sharded.process(query, k, **options), exhaustive.process(query, k), k)
+
+
+@pytest.mark.parametrize("weights", [FieldWeights(1.0, 0.0, 0.0), FieldWeights(0.5, 3.0, 2.0)])
+def test_weights(single, shards, weights):
+    expected = QueryProcessor(single[1], InvertedIndex(single[1]), weights=weights)
+    with ShardedQueryProcessor(shards, 1, weights) as processor:
+        for query in QUERIES:
+            assert_same(processor.process(query, 10, pruning=True), expected.process(query, 10), 10)
@@ -0,0 +1,112 @@
+"""The snapshot has to hold exactly what is loaded from the db, and only for the version of the index it was written
+for. The posting files are read with the snapshot's TermDictionary, which looks up the entries of the terms by tid."""
+import os
+import struct
+
+import pytest
+
+import compressed_index
+from compressed_index import POSTINGS_NAME, CompressedInvertedIndex, write_compressed_index
+from db import DB_NAME, bump_index_version, get_max_page, open_db
+from doc_store import DocumentStore
+from helpers import QUERIES, build
+from impact_index import IMPACTS_NAME, ImpactOrderedIndex
+from importer import Importer
+from parser import Parser
+from posting_list import END, InvertedIndex
+from snapshot import SNAPSHOT_NAME, open_snapshot, write_snapshot
+from synthetic_corpus import SyntheticCorpus
+from term_dictionary import TermDictionary
+
+TERMS = [term for query in QUERIES for term in Parser.tokenize([query])] + ["", "zz", "été"]
+
+
+@pytest.fixture
+def index(corpus, tmp_path):
+    """The directory and a connection of an index of the first part of the corpus, which the test may change"""
+    build(str(tmp_path), Importer.iter_dir(str(corpus / "a")))
+    connection = open_db(str(tmp_path / DB_NAME))
+    yield str(tmp_path), connection
+    connection.close()
+
+
+def pairs(postings):
+    return [(posting.docno, posting.tf) for posting in postings]
+
+
+def test_round_trip(index):
+    directory, connection = index
+    write_snapshot(connection, directory=directory)
+    store, terms = open_snapshot(connection, directory)
+    expected_store, expected_terms = DocumentStore(connection), TermDictionary(connection)
+    for attribute in ("dids", "pages", "dates", "lengths", "boosts"):
+        assert list(getattr(store, attribute)) == list(getattr(expected_store, attribute))
+    assert store.docnos == expected_store.docnos
+    assert store.collection_size == connection.execute("SELECT size FROM d").fetchone()[0]
+    assert store.max_page == get_max_page(connection)
+    assert list(terms.terms) == list(expected_terms.terms)
+    assert terms.terms[1:3] == expected_terms.terms[1:3]
+    assert list(terms.dfs) == list(expected_terms.dfs)
+    assert list(terms.max_impacts) == list(expected_terms.max_impacts)
+    assert [list(impacts) for impacts in terms.field_max_impacts] == \
+           [list(impacts) for impacts in expected_terms.field_max_impacts]
+    assert tuple(terms.max_impact_weights) == tuple(expected_terms.max_impact_weights)
+    for term in TERMS:
+        assert terms.tids.get(term) == expected_terms.tids.get(term)
+    assert all(terms.tid(term) == tid for tid, term in enumerate(expected_terms.terms))
+
+
+def test_stale(index):
+    directory, connection = index
+    write_snapshot(connection, directory=directory)
+    assert open_snapshot(connection, directory) is not None
+    bump_index_version(connection)
+    assert open_snapshot(connection, directory) is None
+    write_snapshot(connection, directory=directory)
+    assert open_snapshot(connection, directory) is not None
+
+
+def test_other_format(index):
+    directory, connection = index
+    write_snapshot(connection, directory=directory)
+    with open(os.path.join(directory, SNAPSHOT_NAME), "r+b") as snapshot:
+        snapshot.seek(4)
+        snapshot.write(struct.pack("<I", 1))
+    assert open_snapshot(connection, directory) is None
+
+
+def test_postings(index):
+    """The posting lists read with the tids of the snapshot are the ones of the tfs table"""
+    directory, connection = index
+    write_snapshot(connection, directory=directory)
+    store, terms = open_snapshot(connection, directory)
+    postings = CompressedInvertedIndex(connection, os.path.join(directory, POSTINGS_NAME), store, terms)
+    impacts = ImpactOrderedIndex(connection, os.path.join(directory, IMPACTS_NAME), store, terms)
+    expected = InvertedIndex(connection)
+    for term in TERMS:
+        assert pairs(postings.getIndexList(term)) == pairs(impacts.getIndexList(term)) == \
+               pairs(expected.getIndexList(term))
+
+
+def test_new_terms(index):
+    """Terms added to the db after a posting file was written have no postings in it"""
+    directory, connection = index
+    terms = TermDictionary(connection)
+    path = os.path.join(directory, POSTINGS_NAME)
+    write_compressed_index(connection, path, terms=terms)
+    terms.add("addedlater")
+    postings = CompressedInvertedIndex(connection, path, terms=terms)
+    assert postings.getIndexList("addedlater") == []
+    assert postings.getCursor("addedlater").docno == END
+    word = SyntheticCorpus._word(0)
+    assert pairs(postings.getIndexList(word)) == pairs(InvertedIndex(connection).getIndexList(word))
+
+
+def test_old_posting_file(index, monkeypatch):
+    directory, connection = index
+    path = os.path.join(directory, POSTINGS_NAME)
+    monkeypatch.setattr(compressed_index, "_VERSION", 4)
+    write_compressed_index(connection, path)
+    monkeypatch.undo()
+    with pytest.raises(ValueError):
+        CompressedInvertedIndex(connection, path)
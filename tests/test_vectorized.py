@@ -0,0 +1,21 @@
+"""The vectorized path has to return the same top k as the exhaustive term-at-a-time path."""
+import pytest
+
+from helpers import KS, QUERIES, assert_same
+from posting_list import np
+
+pytestmark = pytest.mark.skipif(np is None, reason="vectorized query processing requires numpy")
+
+
+@pytest.mark.parametrize("k", KS)
+@pytest.mark.parametrize("query", QUERIES)
+def test_vectorized(exhaustive, compressed, query, k):
+    expected = exhaustive.process(query, k)
+    assert_same(compressed.process(query, k, vectorized=True), expected, k)
+    assert_same(exhaustive.process(query, k, vectorized=True), expected, k)
+
+
+@pytest.mark.parametrize("k", [-2, -1000])
+def test_invalid_k(compressed, k):
+    with pytest.raises(ValueError):
+        compressed.process(QUERIES[1], k, vectorized=True)